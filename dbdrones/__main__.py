@@ -0,0 +1,261 @@
+
+
+"""Командная строка: python -m dbdrones [команда]
+
+Без команды запускается приложение. Команды search, count, export, dedup,
+changes, apply и journal работают через DroneRepository и не требуют Qt;
+import использует DroneImporter без графического интерфейса.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from .export import ExportError, exportRecords, formatForPath, writeRecords
+from .repository import DATABASE_NAME, DroneRepository, RepositoryError, SchemaVersionError
+from .sync import SyncError
+from .units import parseDistance, parseWeight
+
+_RANGE_PARSERS = {"weight": parseWeight, "max_distance": parseDistance}
+
+
+def _parseRange(field, text):
+    """Диапазон вида "МИН:МАКС" (любая граница может быть пустой), значения с единицами"""
+    low, sep, high = text.partition(":")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"ожидается МИН:МАКС, получено {text!r}")
+    bounds = []
+    for value in (low, high):
+        number = _RANGE_PARSERS[field](value) if value.strip() else None
+        if value.strip() and number is None:
+            raise argparse.ArgumentTypeError(f"не удалось разобрать {value!r}")
+        bounds.append(number)
+    return tuple(bounds)
+
+
+def _addFilterArguments(parser):
+    parser.add_argument("text", nargs="?", default="", help="текст поиска (по умолчанию - все записи)")
+    parser.add_argument("--weight", type=lambda text: _parseRange("weight", text), help="вес МИН:МАКС, например 250:2kg")
+    parser.add_argument(
+        "--distance", type=lambda text: _parseRange("max_distance", text), help="дистанция МИН:МАКС, например :5km"
+    )
+
+
+def _ranges(args):
+    return {
+        field: bounds
+        for field, bounds in (("weight", args.weight), ("max_distance", args.distance))
+        if bounds is not None
+    }
+
+
+def _search(repository, args):
+    records = repository.search(args.text, _ranges(args), limit=args.limit)
+    if args.format == "table":
+        found = 0
+        for found, record in enumerate(records, 1):
+            print(
+                f"{record['id']:>8}  {record['model_name']:<30.30}  {record['weight'] or 0:>10.10g} г  "
+                f"{record['manufacture']:<20.20}  {record['max_distance'] or 0:>10.10g} м"
+            )
+    else:
+        found = writeRecords(records, sys.stdout, args.format)
+    if not found and args.text:
+        suggestions = repository.suggest(args.text)
+        if suggestions:
+            print(f"Возможно, вы имели в виду: {', '.join(suggestions)}", file=sys.stderr)
+    return 0
+
+
+def _count(repository, args):
+    print(repository.count(args.text, _ranges(args)))
+    return 0
+
+
+def _export(repository, args):
+    ranges = _ranges(args)
+    records = repository.search(args.text, ranges)
+    if args.output == "-":
+        count = writeRecords(records, sys.stdout, args.format or "jsonl")
+    else:
+        total = repository.count(args.text, ranges)
+
+        def report(exported, fraction, rate):
+            print(f"\r{exported}/{total} ({rate:.0f} записей/с)", end="", file=sys.stderr)
+
+        result = exportRecords(records, args.output, args.format or formatForPath(args.output), total, report)
+        print(file=sys.stderr)
+        count = result.exported
+    print(f"Экспортировано записей: {count}", file=sys.stderr)
+    return 0
+
+
+def _dedup(repository, args):
+    from .dedup import findDuplicates, mergeDuplicates
+
+    groups = findDuplicates(repository, args.weight_tolerance / 100, args.distance_tolerance / 100)
+    for records in groups:
+        first = records[0]
+        ids = ", ".join(str(record["id"]) for record in records)
+        print(f"{first['model_name']} / {first['manufacture']}: {ids}")
+    print(f"Групп: {len(groups)}, лишних записей: {sum(len(records) - 1 for records in groups)}", file=sys.stderr)
+    if args.merge and groups:
+        deleted = mergeDuplicates(
+            repository, [(records[0]["id"], [record["id"] for record in records[1:]]) for records in groups]
+        )
+        print(f"Удалено записей: {deleted}. Изображения без ссылок удаляет python -m dbdrones.repair --gc-images",
+              file=sys.stderr)
+    return 0
+
+
+def _changes(repository, args):
+    from .sync import exportChanges
+
+    if args.output == "-":
+        count, last = exportChanges(repository, sys.stdout, args.since, args.limit)
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            count, last = exportChanges(repository, output, args.since, args.limit)
+    print(f"Изменений: {count}, последний номер: {last}", file=sys.stderr)
+    return 0
+
+
+def _apply(repository, args):
+    from .sync import applyChanges
+
+    with open(args.file, encoding="utf-8") as lines:
+        result = applyChanges(repository, lines, args.batch, args.force)
+    conflicts = result["conflicts"]
+    for conflict in conflicts[:10]:
+        print(f"Конфликт #{conflict['seq']} {conflict['table']} {conflict['op']} {conflict['key']}: {conflict['reason']}",
+              file=sys.stderr)
+    if args.conflicts is not None:
+        with open(args.conflicts, "w", encoding="utf-8") as output:
+            for conflict in conflicts:
+                output.write(json.dumps(conflict, ensure_ascii=False) + "\n")
+    print(
+        f"Применено: {result['applied']}, пропущено: {result['skipped']}, конфликтов: {len(conflicts)}"
+        f"{' (применены версии источника)' if args.force and conflicts else ''}, "
+        f"изображений нет в хранилище: {result['missingImages']}. "
+        f"Получены изменения {result['site']} до номера {result['seq']}",
+        file=sys.stderr,
+    )
+    return 2 if conflicts and not args.force else 0
+
+
+def _journal(repository, args):
+    from .sync import journalStatus, pruneChanges, renewSite
+
+    if args.new_site:
+        print(f"Новый идентификатор копии: {renewSite(repository)}", file=sys.stderr)
+    if args.prune is not None:
+        print(f"Удалено изменений из журнала: {pruneChanges(repository, args.prune)}", file=sys.stderr)
+    status = journalStatus(repository)
+    print(f"Копия: {status['site']}")
+    print(f"Журнал: {status['changes']} изменений, номера {status['firstSeq']}-{status['lastSeq']}")
+    for site, seq in status["peers"].items():
+        print(f"Получены изменения {site} до номера {seq}")
+    return 0
+
+
+def _import(args):
+    from .importer import main as importMain
+
+    argv = [args.file, "--db", args.db]
+    if args.batch is not None:
+        argv += ["--batch", str(args.batch)]
+    return importMain(argv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m dbdrones", description="База данных дронов")
+    parser.add_argument("--db", default=DATABASE_NAME, help="файл базы данных SQLite")
+    commands = parser.add_subparsers(dest="command")
+
+    search = commands.add_parser("search", help="найти записи")
+    _addFilterArguments(search)
+    search.add_argument("--limit", type=int, help="не больше N записей")
+    search.add_argument("--format", choices=("table", "csv", "jsonl"), default="table")
+
+    count = commands.add_parser("count", help="количество записей")
+    _addFilterArguments(count)
+
+    export = commands.add_parser("export", help="выгрузить записи в CSV, JSONL или Parquet")
+    export.add_argument("output", help="файл (.csv, .jsonl, .parquet) или '-' для stdout")
+    _addFilterArguments(export)
+    export.add_argument(
+        "--format", choices=("csv", "jsonl", "parquet"), help="формат (по умолчанию - по расширению)"
+    )
+
+    dedup = commands.add_parser("dedup", help="найти повторяющиеся записи")
+    dedup.add_argument("--weight-tolerance", type=float, default=1.0, help="допуск веса, %% (по умолчанию 1)")
+    dedup.add_argument("--distance-tolerance", type=float, default=1.0, help="допуск дистанции, %% (по умолчанию 1)")
+    dedup.add_argument("--merge", action="store_true", help="объединить каждую группу с ее самой ранней записью")
+
+    changes = commands.add_parser("changes", help="выгрузить изменения из журнала для другой копии БД")
+    changes.add_argument("output", help="файл изменений (JSONL) или '-' для stdout")
+    changes.add_argument("--since", type=int, default=0, help="после номера N (см. journal в другой копии)")
+    changes.add_argument("--limit", type=int, help="не больше N изменений")
+
+    apply = commands.add_parser("apply", help="применить файл изменений другой копии БД")
+    apply.add_argument("file", help="файл изменений")
+    apply.add_argument("--batch", type=int, default=1000, help="изменений в транзакции")
+    apply.add_argument("--force", action="store_true", help="при конфликте применять версию источника")
+    apply.add_argument("--conflicts", help="записать конфликты в файл JSONL")
+
+    journal = commands.add_parser("journal", help="состояние журнала изменений")
+    journal.add_argument("--new-site", action="store_true", help="новый идентификатор для скопированного файла БД")
+    journal.add_argument("--prune", type=int, metavar="SEQ", help="удалить изменения до номера SEQ включительно")
+
+    importer = commands.add_parser("import", help="импортировать записи из CSV, JSON или JSONL")
+    importer.add_argument("file", help="входной файл")
+    importer.add_argument("--batch", type=int, help="записей в транзакции")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        from .main import main as runApplication
+
+        return runApplication()
+    if args.command == "import":
+        return _import(args)
+
+    # sqlite3 создал бы пустой файл на месте опечатки в пути
+    if not os.path.exists(args.db):
+        print(f"{args.db}: файл не найден", file=sys.stderr)
+        return 1
+    try:
+        repository = DroneRepository(args.db)
+    except SchemaVersionError as e:
+        print(f"{e}. Обновите схему: python -m dbdrones.repair --db {args.db}", file=sys.stderr)
+        return 1
+    except (RepositoryError, sqlite3.Error) as e:
+        print(f"{args.db}: {e}", file=sys.stderr)
+        return 1
+    with repository:
+        handler = {
+            "search": _search,
+            "count": _count,
+            "export": _export,
+            "dedup": _dedup,
+            "changes": _changes,
+            "apply": _apply,
+            "journal": _journal,
+        }[args.command]
+        try:
+            return handler(repository, args)
+        except RepositoryError as e:
+            print(f"{args.db}: {e}", file=sys.stderr)
+            return 1
+        except BrokenPipeError:
+            # Читатель stdout закрыл канал (например, head): сброс буфера при выходе не должен падать снова
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 0
+        except (ExportError, SyncError, OSError) as e:
+            print(e, file=sys.stderr)
+            return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
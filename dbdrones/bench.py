@@ -0,0 +1,267 @@
+
+
+"""Этот модуль измеряет производительность основных операций приложения без дисплея
+
+Запуск: python -m dbdrones.bench [--sizes 1000,10000,100000] [--output bench.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Платформа Qt без окон должна быть выбрана до создания QApplication
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Количество моделей, производителей и изображений в синтетических данных
+MODELS = 500
+MANUFACTURERS = 50
+IMAGES = 40
+
+
+def _timed(func, repeat=1):
+    """Медиана и минимум времени выполнения func (с)"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return {"median": statistics.median(samples), "min": min(samples), "repeat": repeat}
+
+
+def generateImages(folder, count=IMAGES, size=(1600, 1200)):
+    """Создает папку с JPEG-изображениями размера фотографии с камеры"""
+    from PyQt5.QtGui import QColor, QImage
+
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for number in range(count):
+        path = folder / f"drone_{number:03d}.jpg"
+        if not path.exists():
+            image = QImage(size[0], size[1], QImage.Format_RGB32)
+            image.fill(QColor.fromHsv(number * 360 // count, 160, 220))
+            image.save(str(path), "JPG", 85)
+        paths.append(str(path))
+    return paths
+
+
+def ingestImages(paths):
+    """Добавляет изображения в хранилище открытой БД и возвращает их хэши"""
+    from .imagestore import imageStore
+
+    return [digest for digest in (imageStore().ingest(path) for path in paths) if digest is not None]
+
+
+def generateDataset(databasePath, rows, imageHashes, seed=0):
+    """Заполняет уже созданную схему синтетическими моделями, производителями и записями
+
+    Каждая третья запись ссылается на изображение из хранилища по хэшу, как
+    записи, добавленные через приложение или импорт.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(databasePath)
+    with connection:
+        connection.executemany(
+            "INSERT INTO manufacture (name, country) VALUES (?, ?)",
+            [(f"Maker {number}", rng.choice(("CN", "US", "FR", "RU", "DE"))) for number in range(MANUFACTURERS)],
+        )
+        connection.executemany(
+            "INSERT INTO model (name) VALUES (?)",
+            [(f"Drone {number} {rng.choice(('Mini', 'Pro', 'Air', 'Max'))}",) for number in range(MODELS)],
+        )
+        connection.executemany(
+            "INSERT INTO data (model_id, weight, manufacture_id, max_distance, image_hash) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    rng.randint(1, MODELS),
+                    round(rng.uniform(80, 25000), 1),
+                    rng.randint(1, MANUFACTURERS),
+                    round(rng.uniform(100, 30000)),
+                    imageHashes[number % len(imageHashes)] if imageHashes and number % 3 == 0 else None,
+                )
+                for number in range(rows)
+            ),
+        )
+    connection.close()
+
+
+def _processEvents(app, seconds=0.0):
+    deadline = time.perf_counter() + seconds
+    app.processEvents()
+    while time.perf_counter() < deadline:
+        app.processEvents()
+
+
+def _waitQueries(app, queries, timeout=30):
+    """Ждет завершения фоновых выборок окна"""
+    deadline = time.perf_counter() + timeout
+    while queries.isBusy() and time.perf_counter() < deadline:
+        app.processEvents()
+
+
+def benchmarkSize(app, workdir, rows, images, repeat):
+    """Измеряет все сценарии на базе из rows записей"""
+    from .database import closeConnection, openConnection
+    from .views import Window
+
+    databasePath = str(workdir / f"bench_{rows}.sqlite")
+    results = {}
+
+    started = time.perf_counter()
+    error = openConnection(databasePath)
+    results["createConnection_empty"] = {"median": time.perf_counter() - started, "min": None, "repeat": 1}
+    if error is not None:
+        raise RuntimeError(error)
+
+    started = time.perf_counter()
+    imageHashes = ingestImages(images)
+    results["images_ingest"] = {"median": time.perf_counter() - started, "min": None, "repeat": 1}
+
+    # Подключение Qt закрывается: sqlite3 и QtSql в одном процессе
+    # не должны одновременно держать открытым один файл
+    closeConnection()
+    started = time.perf_counter()
+    generateDataset(databasePath, rows, imageHashes)
+    results["generate"] = {"median": time.perf_counter() - started, "min": None, "repeat": 1}
+
+    results["createConnection"] = _timed(lambda: openConnection(databasePath), repeat)
+
+    # Запуск до первой отрисовки: то же, что делает main(), без цикла событий
+    windows = []
+
+    def startup():
+        openConnection(databasePath)
+        win = Window()
+        win.resize(1200, 700)
+        win.show()
+        app.processEvents()
+        win.table.viewport().grab()
+        windows.append(win)
+
+    results["startup_first_paint"] = _timed(startup, repeat)
+    win = windows[-1]
+    for old in windows[:-1]:
+        old.close()
+        old.deleteLater()
+    app.processEvents()
+
+    contacts = win.contactsModel
+    model = contacts.model
+    visible = range(min(model.rowCount(), 40))
+
+    def select():
+        model.select()
+        for row in visible:
+            model.index(row, 1).data()
+
+    results["model_select"] = _timed(select, repeat)
+    # Поиск выполняется в фоновом потоке: замер - до применения результата к модели
+    def search(text):
+        contacts.searchData(text)
+        _waitQueries(app, contacts.queries)
+        return model.rowCount()
+
+    results["model_search"] = _timed(lambda: search("drone 1"), repeat)
+    results["model_search_rare"] = _timed(lambda: search("drone 499 max"), repeat)
+    contacts.resetSearch()
+    _waitQueries(app, contacts.queries)
+
+    record = ["Drone 1 Mini", "900", "Maker 1", "5000", images[0] if images else ""]
+    results["model_add"] = _timed(lambda: contacts.addData(record), repeat * 5)
+    results["model_delete"] = _timed(lambda: contacts.deleteData(0), repeat * 5)
+
+    # Отрисовка видимой области при прокрутке: первый проход - с декодированием, второй - из кэша
+    scrollBar = win.table.verticalScrollBar()
+    delegate = win.table.itemDelegate()
+    positions = [scrollBar.maximum() * step // 20 for step in range(21)]
+
+    def paintPass():
+        for position in positions:
+            scrollBar.setValue(position)
+            win.table.viewport().grab()
+
+    results["paint_scroll_cold"] = _timed(paintPass)
+    started = time.perf_counter()
+    while delegate.loader.pendingCount() and time.perf_counter() - started < 30:
+        _processEvents(app, 0.01)
+    results["paint_images_ready"] = {"median": time.perf_counter() - started, "min": None, "repeat": 1}
+    results["paint_scroll_warm"] = _timed(paintPass, repeat)
+    results["thumbnail_cache"] = delegate.cache.stats()
+
+    sizes = [(1200, 700), (1000, 600), (1400, 800), (900, 500)]
+
+    def resize():
+        for size in sizes:
+            win.resize(*size)
+            app.processEvents()
+
+    results["window_resize"] = _timed(resize, repeat)
+
+    win.close()
+    win.deleteLater()
+    app.processEvents()
+    return results
+
+
+def main(argv=None):
+    """Запускает замеры и сохраняет результаты в JSON"""
+    from PyQt5.QtCore import QT_VERSION_STR
+    from PyQt5.QtWidgets import QApplication
+
+    from . import __version__
+
+    parser = argparse.ArgumentParser(description="Замеры производительности dbdrones")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="размеры таблицы через запятую (до 1000000)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого замера")
+    parser.add_argument("--workdir", help="папка для баз и изображений (по умолчанию временная)")
+    parser.add_argument("--output", default="-", help="файл JSON с результатами ('-' - stdout)")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    temporary = None
+    if args.workdir:
+        workdir = Path(args.workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix="dbdrones-bench-")
+        workdir = Path(temporary.name)
+
+    images = generateImages(workdir / "images")
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {},
+    }
+    for rows in (int(size) for size in args.sizes.split(",")):
+        print(f"{rows} записей...", file=sys.stderr)
+        report["results"][str(rows)] = benchmarkSize(app, workdir, rows, images, args.repeat)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text, encoding="utf-8")
+    if temporary is not None:
+        temporary.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,16 +2,38 @@
 
 """Этот модуль обеспечивает подключение к базе данных"""
 
+from PyQt5.QtCore import QCoreApplication
 from PyQt5.QtWidgets import QMessageBox
-from PyQt5.QtSql import QSqlDatabase, QSqlQuery
+from PyQt5.QtSql import QSqlDatabase
 import os
+import sys
 from pathlib import Path
 
+from .querylog import InstrumentedQuery
+from .repository import (
+    CHANGE_LOG_TABLES,
+    DATABASE_NAME,
+    PRAGMAS,
+    SCHEMA_VERSION,
+    TRIGRAM_SQLITE_VERSION,
+    RepositoryError,
+)
+from .units import parseDistance, parseWeight
+
+# Файл, в котором прежние версии фактически хранили данные
+_LEGACY_DATABASE_NAME = "model.sqlite"
+
+# Подготовленные запросы: текст запроса -> QSqlQuery
+_preparedQueries = {}
+
+# Значения, не распознанные миграциями при последнем открытии БД
+_migrationRejects = 0
+
 
 
 def _createContactsTable():
     """Создает таблицу с полем для хранения изображений"""
-    createTableQuery = QSqlQuery()
+    createTableQuery = InstrumentedQuery()
     return createTableQuery.exec(
         """
         CREATE TABLE IF NOT EXISTS data (
@@ -28,7 +50,7 @@ def _createContactsTable():
 
 def _createManufacturerTable():
     """Создает таблицу производителей"""
-    createTableQuery = QSqlQuery()
+    createTableQuery = InstrumentedQuery()
     return createTableQuery.exec(
         """
         CREATE TABLE IF NOT EXISTS manufacture (
@@ -42,7 +64,7 @@ def _createManufacturerTable():
 
 def _createModelTable():
     """Создает таблицу моделей"""
-    createTableQuery = QSqlQuery()
+    createTableQuery = InstrumentedQuery()
     return createTableQuery.exec(
         """
         CREATE TABLE IF NOT EXISTS model (
@@ -53,21 +75,1020 @@ def _createModelTable():
     )
 
 
-def createConnection(databaseName):
-    """Создает все таблицы при подключении"""
+# Триггеры, поддерживающие data_fts в актуальном состоянии (схемы версий 1-2)
+_SEARCH_TRIGGERS_V1 = (
+    """
+    CREATE TRIGGER IF NOT EXISTS data_fts_ai AFTER INSERT ON data BEGIN
+        INSERT INTO data_fts (rowid, model_name, weight, manufacture, max_distance)
+        VALUES (new.id, new.model_name, new.weight, new.manufacture, new.max_distance);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS data_fts_ad AFTER DELETE ON data BEGIN
+        INSERT INTO data_fts (data_fts, rowid, model_name, weight, manufacture, max_distance)
+        VALUES ('delete', old.id, old.model_name, old.weight, old.manufacture, old.max_distance);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS data_fts_au AFTER UPDATE ON data BEGIN
+        INSERT INTO data_fts (data_fts, rowid, model_name, weight, manufacture, max_distance)
+        VALUES ('delete', old.id, old.model_name, old.weight, old.manufacture, old.max_distance);
+        INSERT INTO data_fts (rowid, model_name, weight, manufacture, max_distance)
+        VALUES (new.id, new.model_name, new.weight, new.manufacture, new.max_distance);
+    END
+    """,
+)
+
+
+def _execAll(statements):
+    """Выполняет запросы по очереди, останавливаясь на первой ошибке"""
+    query = InstrumentedQuery()
+    for statement in statements:
+        if not query.exec(statement):
+            print("SQL Error:", query.lastError().text())
+            return False
+    return True
+
+
+def _createSearchIndex():
+    """Создает полнотекстовый индекс FTS5 по таблице data и триггеры синхронизации"""
+    query = InstrumentedQuery()
+    query.exec("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_fts'")
+    exists = query.next()
+
+    ok = _execAll((
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS data_fts USING fts5(
+            model_name, weight, manufacture, max_distance,
+            content='data', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+    ) + _SEARCH_TRIGGERS_V1)
+    if not ok:
+        return False
+
+    # Индекс создан впервые - заполняем его уже существующими строками
+    if not exists:
+        return query.exec("INSERT INTO data_fts (data_fts) VALUES ('rebuild')")
+    return True
+
+
+def _migrateBaseSchema():
+    """Версия 1: исходные таблицы и полнотекстовый индекс"""
+    return (
+        _createContactsTable()
+        and _createManufacturerTable()
+        and _createModelTable()
+        and _createSearchIndex()
+    )
+
+
+def _migrateNumericColumns():
+    """Версия 2: вес и дистанция хранятся числами (граммы, метры) и индексируются
+
+    Значения вида "0,25 кг" или "5 km" приводятся к базовым единицам.
+    Значения, которые разобрать не удалось, заменяются на NULL, а исходный
+    текст сохраняется в таблице migration_rejects.
+    """
+    global _migrationRejects
+    if not _execAll((
+        """
+        CREATE TABLE IF NOT EXISTS migration_rejects (
+            data_id INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE data_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL,
+            model_name VARCHAR(40) NOT NULL,
+            weight REAL,
+            manufacture VARCHAR(40) NOT NULL,
+            max_distance REAL,
+            image_path TEXT
+        )
+        """,
+    )):
+        return False
+
+    select = InstrumentedQuery()
+    select.setForwardOnly(True)
+    insert = InstrumentedQuery()
+    insert.prepare(
+        "INSERT INTO data_new (id, model_name, weight, manufacture, max_distance, image_path) "
+        "VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    select.exec("SELECT id, model_name, weight, manufacture, max_distance, image_path FROM data")
+    rejects = []
+    while select.next():
+        weight = parseWeight(select.value(2))
+        distance = parseDistance(select.value(4))
+        for field, column, parsed in (("weight", 2, weight), ("max_distance", 4, distance)):
+            if parsed is None and not select.isNull(column) and str(select.value(column)).strip():
+                rejects.append((select.value(0), field, str(select.value(column))))
+        for position, value in enumerate(
+            (select.value(0), select.value(1), weight, select.value(3), distance, select.value(5))
+        ):
+            insert.bindValue(position, value)
+        if not insert.exec():
+            print("SQL Error:", insert.lastError().text())
+            return False
+    select.finish()
+    insert.finish()
+    for reject in rejects:
+        if execPrepared("INSERT INTO migration_rejects (data_id, field, value) VALUES (?, ?, ?)", reject) is None:
+            return False
+    if rejects:
+        _migrationRejects += len(rejects)
+        print(f"Migration: {len(rejects)} weight/max_distance values not recognized, set to NULL; "
+              "original text kept in migration_rejects")
+
+    return _execAll((
+        "DROP TABLE data",
+        "ALTER TABLE data_new RENAME TO data",
+        "CREATE INDEX IF NOT EXISTS idx_data_weight ON data (weight)",
+        "CREATE INDEX IF NOT EXISTS idx_data_max_distance ON data (max_distance)",
+    ) + _SEARCH_TRIGGERS_V1 + (
+        "INSERT INTO data_fts (data_fts) VALUES ('rebuild')",
+    ))
+
+
+# Триггеры data_fts для схемы с внешними ключами: названия берутся из data_view
+_SEARCH_TRIGGERS = (
+    """
+    CREATE TRIGGER data_fts_ai AFTER INSERT ON data BEGIN
+        INSERT INTO data_fts (rowid, model_name, weight, manufacture, max_distance)
+        SELECT id, model_name, weight, manufacture, max_distance FROM data_view WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER data_fts_ad AFTER DELETE ON data BEGIN
+        INSERT INTO data_fts (data_fts, rowid, model_name, weight, manufacture, max_distance)
+        VALUES (
+            'delete', old.id,
+            (SELECT name FROM model WHERE id = old.model_id), old.weight,
+            (SELECT name FROM manufacture WHERE id = old.manufacture_id), old.max_distance
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER data_fts_au AFTER UPDATE ON data BEGIN
+        INSERT INTO data_fts (data_fts, rowid, model_name, weight, manufacture, max_distance)
+        VALUES (
+            'delete', old.id,
+            (SELECT name FROM model WHERE id = old.model_id), old.weight,
+            (SELECT name FROM manufacture WHERE id = old.manufacture_id), old.max_distance
+        );
+        INSERT INTO data_fts (rowid, model_name, weight, manufacture, max_distance)
+        SELECT id, model_name, weight, manufacture, max_distance FROM data_view WHERE id = new.id;
+    END
+    """,
+    # Переименование модели или производителя переиндексирует только их записи
+    """
+    CREATE TRIGGER model_fts_au AFTER UPDATE OF name ON model BEGIN
+        INSERT INTO data_fts (data_fts, rowid, model_name, weight, manufacture, max_distance)
+        SELECT 'delete', id, old.name, weight, manufacture, max_distance
+        FROM data_view WHERE model_id = new.id;
+        INSERT INTO data_fts (rowid, model_name, weight, manufacture, max_distance)
+        SELECT id, model_name, weight, manufacture, max_distance
+        FROM data_view WHERE model_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER manufacture_fts_au AFTER UPDATE OF name ON manufacture BEGIN
+        INSERT INTO data_fts (data_fts, rowid, model_name, weight, manufacture, max_distance)
+        SELECT 'delete', id, model_name, weight, old.name, max_distance
+        FROM data_view WHERE manufacture_id = new.id;
+        INSERT INTO data_fts (rowid, model_name, weight, manufacture, max_distance)
+        SELECT id, model_name, weight, manufacture, max_distance
+        FROM data_view WHERE manufacture_id = new.id;
+    END
+    """,
+)
+
+
+# Представление data с названиями из справочников (схема версии 4)
+_DATA_VIEW = """
+    CREATE VIEW data_view AS
+    SELECT data.id, model.name AS model_name, data.weight,
+           manufacture.name AS manufacture, data.max_distance, data.image_path,
+           data.model_id, data.manufacture_id, manufacture.country, data.uid
+    FROM data
+    JOIN model ON model.id = data.model_id
+    JOIN manufacture ON manufacture.id = data.manufacture_id
+"""
+
+
+def _migrateForeignKeys():
+    """Версия 3: data ссылается на model и manufacture по id вместо копии названия
+
+    Недостающие модели и производители создаются из существующих записей
+    (страна производителя остается пустой). Полнотекстовый индекс строится
+    по представлению data_view, которое соединяет таблицы.
+    """
+    return _execAll((
+        "INSERT OR IGNORE INTO model (name) SELECT DISTINCT model_name FROM data",
+        "INSERT OR IGNORE INTO manufacture (name, country) SELECT DISTINCT manufacture, '' FROM data",
+        "DROP TABLE data_fts",
+        """
+        CREATE TABLE data_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL,
+            model_id INTEGER NOT NULL REFERENCES model (id),
+            weight REAL,
+            manufacture_id INTEGER NOT NULL REFERENCES manufacture (id),
+            max_distance REAL,
+            image_path TEXT
+        )
+        """,
+        """
+        INSERT INTO data_new (id, model_id, weight, manufacture_id, max_distance, image_path)
+        SELECT data.id, model.id, data.weight, manufacture.id, data.max_distance, data.image_path
+        FROM data
+        JOIN model ON model.name = data.model_name
+        JOIN manufacture ON manufacture.name = data.manufacture
+        """,
+        "DROP TABLE data",
+        "ALTER TABLE data_new RENAME TO data",
+        "CREATE INDEX idx_data_weight ON data (weight)",
+        "CREATE INDEX idx_data_max_distance ON data (max_distance)",
+        "CREATE INDEX idx_data_model_id ON data (model_id)",
+        "CREATE INDEX idx_data_manufacture_id ON data (manufacture_id)",
+        """
+        CREATE VIEW data_view AS
+        SELECT data.id, model.name AS model_name, data.weight,
+               manufacture.name AS manufacture, data.max_distance, data.image_path,
+               data.model_id, data.manufacture_id, manufacture.country
+        FROM data
+        JOIN model ON model.id = data.model_id
+        JOIN manufacture ON manufacture.id = data.manufacture_id
+        """,
+        """
+        CREATE VIRTUAL TABLE data_fts USING fts5(
+            model_name, weight, manufacture, max_distance,
+            content='data_view', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+    ) + _SEARCH_TRIGGERS + (
+        "INSERT INTO data_fts (data_fts) VALUES ('rebuild')",
+    ))
+
+
+def _migrateStableIds():
+    """Версия 4: у каждой записи есть постоянный внешний идентификатор uid
+
+    uid не меняется при перенумерации id и используется при экспорте. Таблица
+    пересоздается, поэтому представление и зависящие от него триггеры
+    создаются заново.
+    """
+    return _execAll((
+        "DROP TRIGGER model_fts_au",
+        "DROP TRIGGER manufacture_fts_au",
+        "DROP VIEW data_view",
+        """
+        CREATE TABLE data_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL,
+            model_id INTEGER NOT NULL REFERENCES model (id),
+            weight REAL,
+            manufacture_id INTEGER NOT NULL REFERENCES manufacture (id),
+            max_distance REAL,
+            image_path TEXT,
+            uid TEXT NOT NULL UNIQUE DEFAULT (lower(hex(randomblob(16))))
+        )
+        """,
+        """
+        INSERT INTO data_new (id, model_id, weight, manufacture_id, max_distance, image_path)
+        SELECT id, model_id, weight, manufacture_id, max_distance, image_path FROM data
+        """,
+        # Счетчик AUTOINCREMENT не должен откатиться назад: id удаленных записей не переиспользуются
+        """
+        UPDATE sqlite_sequence
+        SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'data'), 0))
+        WHERE name = 'data_new'
+        """,
+        "DROP TABLE data",
+        "ALTER TABLE data_new RENAME TO data",
+        "CREATE INDEX idx_data_weight ON data (weight)",
+        "CREATE INDEX idx_data_max_distance ON data (max_distance)",
+        "CREATE INDEX idx_data_model_id ON data (model_id)",
+        "CREATE INDEX idx_data_manufacture_id ON data (manufacture_id)",
+        _DATA_VIEW,
+    ) + _SEARCH_TRIGGERS)
+
+
+# Триггеры, считающие ссылки записей data на изображения хранилища
+_IMAGE_TRIGGERS = (
+    """
+    CREATE TRIGGER image_ref_ai AFTER INSERT ON data WHEN new.image_hash IS NOT NULL BEGIN
+        UPDATE image SET refcount = refcount + 1 WHERE hash = new.image_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER image_ref_ad AFTER DELETE ON data WHEN old.image_hash IS NOT NULL BEGIN
+        UPDATE image SET refcount = refcount - 1 WHERE hash = old.image_hash;
+    END
+    """,
+    """
+    CREATE TRIGGER image_ref_au AFTER UPDATE OF image_hash ON data
+    WHEN old.image_hash IS NOT new.image_hash BEGIN
+        UPDATE image SET refcount = refcount - 1 WHERE hash = old.image_hash;
+        UPDATE image SET refcount = refcount + 1 WHERE hash = new.image_hash;
+    END
+    """,
+)
+
+
+def _migrateImageStore():
+    """Версия 5: изображения хранятся в каталоге рядом с БД и адресуются хэшем
+
+    Существующие файлы из image_path копируются в хранилище, запись получает
+    image_hash, а image_path очищается. Недоступные файлы остаются ссылкой
+    по пути.
+    """
+    from .imagestore import imageStore
+
+    if not _execAll((
+        """
+        CREATE TABLE image (
+            hash TEXT PRIMARY KEY,
+            suffix TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX idx_image_unused ON image (hash) WHERE refcount <= 0",
+        "ALTER TABLE data ADD COLUMN image_hash TEXT REFERENCES image (hash)",
+        "CREATE INDEX idx_data_image_hash ON data (image_hash)",
+    ) + _IMAGE_TRIGGERS):
+        return False
+
+    query = InstrumentedQuery()
+    query.setForwardOnly(True)
+    query.exec("SELECT DISTINCT image_path FROM data WHERE image_path IS NOT NULL AND image_path != ''")
+    paths = []
+    while query.next():
+        paths.append(query.value(0))
+    query.finish()
+
+    store = imageStore()
+    missing = []
+    for path in paths:
+        digest = store.ingest(path)
+        if digest is None:
+            missing.append(path)
+        elif execPrepared(
+            "UPDATE data SET image_hash = ?, image_path = NULL WHERE image_path = ?", (digest, path)
+        ) is None:
+            return False
+    if missing:
+        print(f"Migration: {len(missing)} image files not found or unreadable, paths kept")
+    return True
+
+
+# Сводные таблицы: таблица -> столбец группировки в data
+STATISTICS_TABLES = {"model_stats": "model_id", "manufacture_stats": "manufacture_id"}
+
+_STATISTICS_COLUMNS = "records, weight_count, weight_sum, weight_min, weight_max, distance_max"
+
+
+def _statisticsTable(table, key, reference):
+    return f"""
+        CREATE TABLE {table} (
+            {key} INTEGER PRIMARY KEY REFERENCES {reference} (id),
+            records INTEGER NOT NULL,
+            weight_count INTEGER NOT NULL,
+            weight_sum REAL NOT NULL,
+            weight_min REAL,
+            weight_max REAL,
+            distance_max REAL
+        )
+        """
+
+
+def _statisticsAdd(table, key, row):
+    """Учитывает запись row (new/old) в сводке ее группы"""
+    return f"""
+        INSERT INTO {table} ({key}, {_STATISTICS_COLUMNS})
+        VALUES ({row}.{key}, 1, {row}.weight IS NOT NULL, COALESCE({row}.weight, 0),
+                {row}.weight, {row}.weight, {row}.max_distance)
+        ON CONFLICT ({key}) DO UPDATE SET
+            records = records + 1,
+            weight_count = weight_count + excluded.weight_count,
+            weight_sum = weight_sum + excluded.weight_sum,
+            weight_min = COALESCE(MIN(weight_min, excluded.weight_min), weight_min, excluded.weight_min),
+            weight_max = COALESCE(MAX(weight_max, excluded.weight_max), weight_max, excluded.weight_max),
+            distance_max = COALESCE(MAX(distance_max, excluded.distance_max), distance_max, excluded.distance_max);
+    """
+
+
+def _statisticsRemove(table, key, row):
+    """Исключает запись row из сводки; крайние значения пересчитываются, только если запись была крайней"""
+    return f"""
+        UPDATE {table} SET
+            records = records - 1,
+            weight_count = weight_count - ({row}.weight IS NOT NULL),
+            weight_sum = weight_sum - COALESCE({row}.weight, 0),
+            weight_min = CASE WHEN {row}.weight <= weight_min
+                THEN (SELECT MIN(weight) FROM data WHERE {key} = {row}.{key}) ELSE weight_min END,
+            weight_max = CASE WHEN {row}.weight >= weight_max
+                THEN (SELECT MAX(weight) FROM data WHERE {key} = {row}.{key}) ELSE weight_max END,
+            distance_max = CASE WHEN {row}.max_distance >= distance_max
+                THEN (SELECT MAX(max_distance) FROM data WHERE {key} = {row}.{key}) ELSE distance_max END
+        WHERE {key} = {row}.{key};
+        DELETE FROM {table} WHERE {key} = {row}.{key} AND records <= 0;
+    """
+
+
+# Триггеры, поддерживающие сводные таблицы при каждом изменении data
+_STATISTICS_TRIGGERS = (
+    "CREATE TRIGGER stats_ai AFTER INSERT ON data BEGIN"
+    + "".join(_statisticsAdd(table, key, "new") for table, key in STATISTICS_TABLES.items())
+    + "END",
+    "CREATE TRIGGER stats_ad AFTER DELETE ON data BEGIN"
+    + "".join(_statisticsRemove(table, key, "old") for table, key in STATISTICS_TABLES.items())
+    + "END",
+    # Изменение - это удаление старой версии записи и добавление новой
+    "CREATE TRIGGER stats_au AFTER UPDATE OF model_id, manufacture_id, weight, max_distance ON data BEGIN"
+    + "".join(
+        _statisticsRemove(table, key, "old") + _statisticsAdd(table, key, "new")
+        for table, key in STATISTICS_TABLES.items()
+    )
+    + "END",
+)
+
+
+def _fillStatistics():
+    """Заполняет сводные таблицы агрегатами по data"""
+    return _execAll(tuple(
+        f"INSERT INTO {table} ({key}, {_STATISTICS_COLUMNS}) "
+        f"SELECT {key}, COUNT(*), COUNT(weight), TOTAL(weight), MIN(weight), MAX(weight), MAX(max_distance) "
+        f"FROM data GROUP BY {key}"
+        for table, key in STATISTICS_TABLES.items()
+    ))
+
+
+def _migrateStatistics():
+    """Версия 6: сводки по моделям и производителям, которые поддерживают триггеры
+
+    Индексы (группа, вес) заменяют индексы по внешним ключам: по ним триггер
+    находит новый минимум и максимум веса группы без просмотра ее записей.
+    """
+    return _execAll((
+        _statisticsTable("model_stats", "model_id", "model"),
+        _statisticsTable("manufacture_stats", "manufacture_id", "manufacture"),
+        "DROP INDEX idx_data_model_id",
+        "DROP INDEX idx_data_manufacture_id",
+        "CREATE INDEX idx_data_model_weight ON data (model_id, weight)",
+        "CREATE INDEX idx_data_manufacture_weight ON data (manufacture_id, weight)",
+    ) + _STATISTICS_TRIGGERS) and _fillStatistics()
+
+
+def _migrateSortIndexes():
+    """Версия 7: индексы (группа, дистанция) для сортировки по модели и производителю
+
+    Вместе с индексами (группа, вес), веса и дистанции они покрывают частые
+    порядки таблицы: страница выбирается обходом индекса без сортировки.
+    """
+    return _execAll((
+        "CREATE INDEX idx_data_model_distance ON data (model_id, max_distance)",
+        "CREATE INDEX idx_data_manufacture_distance ON data (manufacture_id, max_distance)",
+    ))
+
+
+def _trigramIndex(table):
+    """Индекс триграмм названий справочника table и триггеры, обновляющие его при изменениях"""
+    index = f"{table}_trigram"
+    return (
+        f"CREATE VIRTUAL TABLE {index} USING fts5(name, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"""
+        CREATE TRIGGER {index}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index} (rowid, name) VALUES (new.id, new.name);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {index}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index} ({index}, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {index}_au AFTER UPDATE OF name ON {table} BEGIN
+            INSERT INTO {index} ({index}, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO {index} (rowid, name) VALUES (new.id, new.name);
+        END
+        """,
+        f"INSERT INTO {index} ({index}) VALUES ('rebuild')",
+    )
+
+
+def sqliteVersion():
+    """Версия SQLite подключения Qt: (3, 49, 1)"""
+    query = InstrumentedQuery()
+    if not (query.exec("SELECT sqlite_version()") and query.next()):
+        return (0, 0, 0)
+    return tuple(int(part) for part in query.value(0).split("."))
+
+
+def _migrateTrigramIndex():
+    """Версия 8: индексы триграмм названий моделей и производителей для поиска с опечатками
+
+    Записи data ссылаются на названия по внешним ключам, поэтому индекс
+    справочников покрывает весь текст, который показывают записи. Без
+    токенизатора trigram (SQLite до 3.34) индекс не создается: варианты
+    исправления не предлагаются, остальное работает.
+    """
+    if sqliteVersion() < TRIGRAM_SQLITE_VERSION:
+        print(f"SQLite {'.'.join(map(str, sqliteVersion()))}: no trigram tokenizer, search suggestions disabled")
+        return True
+    return _execAll(_trigramIndex("model") + _trigramIndex("manufacture"))
+
+
+def _jsonNumber(expression):
+    """Число для json_object без потери точности
+
+    json_object выводит REAL с 15 значащими цифрами; число, которое при этом
+    меняется, выводится с 17 цифрами.
+    """
+    return (
+        f"json(CASE WHEN {expression} IS NULL THEN NULL "
+        f"WHEN CAST(printf('%!.15g', {expression}) AS REAL) = {expression} THEN printf('%!.15g', {expression}) "
+        f"ELSE printf('%!.17g', {expression}) END)"
+    )
+
+
+# Значения полей журнала, которые не совпадают со столбцами таблицы (строка - new или old)
+_CHANGE_LOG_EXPRESSIONS = {
+    "data": {
+        "model_name": "(SELECT name FROM model WHERE id = {row}.model_id)",
+        "manufacture": "(SELECT name FROM manufacture WHERE id = {row}.manufacture_id)",
+        "weight": _jsonNumber("{row}.weight"),
+        "max_distance": _jsonNumber("{row}.max_distance"),
+    },
+}
+# Столбцы, изменение которых попадает в журнал
+_CHANGE_LOG_COLUMNS = {
+    "model": ("name",),
+    "manufacture": ("name", "country"),
+    "data": ("uid", "model_id", "weight", "manufacture_id", "max_distance", "image_path", "image_hash"),
+}
+
+
+def _changeValues(table, row):
+    """JSON со значениями полей журнала для строки row (new или old)"""
+    expressions = _CHANGE_LOG_EXPRESSIONS.get(table, {})
+    fields = CHANGE_LOG_TABLES[table][1]
+    return "json_object({})".format(", ".join(
+        f"'{field}', {expressions.get(field, '{row}.' + field).format(row=row)}" for field in fields
+    ))
+
+
+def _changeLogTriggers(table):
+    """Триггеры, записывающие добавление, изменение и удаление строк table в change_log
+
+    origin - узел, где изменение сделано впервые: при применении изменений
+    другой копии он берется из sync_site.applying, для своих изменений - NULL.
+    """
+    key = CHANGE_LOG_TABLES[table][0]
+    columns = _CHANGE_LOG_COLUMNS[table]
+    origin = "(SELECT applying FROM sync_site)"
+    changed = " OR ".join(f"old.{column} IS NOT new.{column}" for column in columns)
+    return (
+        f"""
+        CREATE TRIGGER change_log_{table}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO change_log (table_name, op, row_key, new, origin)
+            VALUES ('{table}', 'insert', new.{key}, {_changeValues(table, "new")}, {origin});
+        END
+        """,
+        f"""
+        CREATE TRIGGER change_log_{table}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO change_log (table_name, op, row_key, old, origin)
+            VALUES ('{table}', 'delete', old.{key}, {_changeValues(table, "old")}, {origin});
+        END
+        """,
+        # Запросы, которые записывают те же значения, в журнал не попадают
+        f"""
+        CREATE TRIGGER change_log_{table}_au AFTER UPDATE OF {", ".join(columns)} ON {table} WHEN {changed} BEGIN
+            INSERT INTO change_log (table_name, op, row_key, old, new, origin)
+            VALUES ('{table}', 'update', old.{key}, {_changeValues(table, "old")}, {_changeValues(table, "new")},
+                    {origin});
+        END
+        """,
+    )
+
+
+def _migrateChangeLog():
+    """Версия 9: журнал изменений data, model и manufacture для обмена изменениями между копиями БД
+
+    Номер изменения seq только растет (AUTOINCREMENT), поэтому копия,
+    получившая изменения до номера N, запрашивает только следующие (см. sync).
+    sync_site хранит идентификатор этой копии, sync_peer - номер последнего
+    примененного изменения каждой другой копии. Существующие строки в журнал
+    не переносятся: копии начинаются с одного и того же файла.
+    """
+    return _execAll((
+        """
+        CREATE TABLE change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')),
+            row_key TEXT NOT NULL,
+            old TEXT,
+            new TEXT,
+            origin TEXT
+        )
+        """,
+        """
+        CREATE TABLE sync_site (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            site TEXT NOT NULL,
+            applying TEXT
+        )
+        """,
+        "INSERT INTO sync_site (id, site) VALUES (1, lower(hex(randomblob(16))))",
+        "CREATE TABLE sync_peer (site TEXT PRIMARY KEY, seq INTEGER NOT NULL)",
+    ) + tuple(trigger for table in CHANGE_LOG_TABLES for trigger in _changeLogTriggers(table)))
+
+
+# Миграции схемы по порядку: номер версии = позиция в списке + 1,
+# последняя версия - repository.SCHEMA_VERSION
+MIGRATIONS = (
+    _migrateBaseSchema,
+    _migrateNumericColumns,
+    _migrateForeignKeys,
+    _migrateStableIds,
+    _migrateImageStore,
+    _migrateStatistics,
+    _migrateSortIndexes,
+    _migrateTrigramIndex,
+    _migrateChangeLog,
+)
+
+
+def schemaVersion():
+    """Текущая версия схемы из PRAGMA user_version"""
+    query = InstrumentedQuery()
+    query.exec("PRAGMA user_version")
+    return query.value(0) if query.next() else 0
+
+
+def migrate():
+    """Применяет недостающие миграции, каждую в отдельной транзакции"""
+    global _migrationRejects
+    _migrationRejects = 0
+    db = QSqlDatabase.database()
+    version = schemaVersion()
+    if version > SCHEMA_VERSION:
+        print(f"Database schema version {version} is newer than supported {SCHEMA_VERSION}")
+        return False
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        db.transaction()
+        if MIGRATIONS[number - 1]() and InstrumentedQuery().exec(f"PRAGMA user_version = {number}"):
+            db.commit()
+        else:
+            db.rollback()
+            return False
+    return True
+
+
+def _adoptLegacyDatabase(databaseName):
+    """Переименовывает файл данных прежних версий в единый файл БД
+
+    Раньше приложение открывало data.sqlite, manufacture.sqlite и model.sqlite
+    на одном подключении, и все данные оказывались в последнем из них.
+    """
+    if databaseName == DATABASE_NAME and not os.path.exists(databaseName):
+        legacy = Path(databaseName).with_name(_LEGACY_DATABASE_NAME)
+        if legacy.exists():
+            os.replace(legacy, databaseName)
+
+
+def _applyPragmas(connection=None):
+    """Применяет настройки производительности SQLite"""
+    query = InstrumentedQuery() if connection is None else InstrumentedQuery(connection)
+    for name, value in PRAGMAS:
+        if not query.exec(f"PRAGMA {name} = {value}"):
+            print("SQL Error:", query.lastError().text())
+
+
+def preparedQuery(sql):
+    """Подготовленный запрос из кэша; компилируется только при первом обращении"""
+    query = _preparedQueries.get(sql)
+    if query is None:
+        query = InstrumentedQuery()
+        query.setForwardOnly(True)
+        if not query.prepare(sql):
+            print("SQL Error:", query.lastError().text())
+            return query
+        _preparedQueries[sql] = query
+    else:
+        # Освобождаем результат предыдущего выполнения
+        query.finish()
+    return query
+
+
+def execPrepared(sql, params=()):
+    """Выполняет закэшированный подготовленный запрос; None - при ошибке"""
+    query = preparedQuery(sql)
+    for position, value in enumerate(params):
+        query.bindValue(position, value)
+    if not query.exec():
+        print("SQL Error:", query.lastError().text())
+        return None
+    return query
+
+
+class QtSqlBackend:
+    """Выполнение запросов repository.DroneRepository через подключение Qt
+
+    Приложение не открывает ту же БД через sqlite3: у Qt своя копия SQLite,
+    и две копии библиотеки в одном процессе не согласуют блокировки файла.
+    Запросы берутся из кэша подготовленных, поэтому попадают в журнал запросов.
+    """
+
+    def _exec(self, sql, params):
+        query = preparedQuery(sql)
+        for position, value in enumerate(params):
+            query.bindValue(position, value)
+        if not query.exec():
+            raise RepositoryError(query.lastError().text())
+        return query
+
+    def rows(self, sql, params=(), fetchSize=None):
+        """Генератор строк; запрос освобождается, когда перебор окончен или прерван"""
+        query = self._exec(sql, params)
+        count = query.record().count()
+        try:
+            while query.next():
+                # NULL - None, как в sqlite3 (QSqlQuery.value возвращает пустую строку)
+                yield tuple(None if query.isNull(i) else query.value(i) for i in range(count))
+        finally:
+            query.finish()
+
+    def execute(self, sql, params=()):
+        """Выполняет изменяющий запрос; возвращает (id последней вставки, число строк)"""
+        query = self._exec(sql, params)
+        result = query.lastInsertId(), query.numRowsAffected()
+        query.finish()
+        return result
+
+    def begin(self):
+        if not QSqlDatabase.database().transaction():
+            raise RepositoryError(QSqlDatabase.database().lastError().text())
+
+    def commit(self):
+        if not QSqlDatabase.database().commit():
+            raise RepositoryError(QSqlDatabase.database().lastError().text())
+
+    def rollback(self):
+        QSqlDatabase.database().rollback()
+
+    def close(self):
+        """Подключение принадлежит приложению и закрывается closeConnection()"""
+
+
+def allocateIds(count, table="data"):
+    """Резервирует count последовательных id таблицы с AUTOINCREMENT
+
+    Вызывается внутри транзакции пакетной вставки: счетчик sqlite_sequence
+    сдвигается и читается в ней же, поэтому пакет получает id без обращения
+    к БД на каждую строку, а зарезервированные id не достанутся никому
+    другому (блокировка записи держится до конца транзакции). UPDATE ...
+    RETURNING не используется: он есть только с SQLite 3.35. Возвращает
+    range или None при ошибке.
+    """
+    if count <= 0:
+        return range(0)
+    if execPrepared(
+        "INSERT INTO sqlite_sequence (name, seq) "
+        f"SELECT ?, COALESCE((SELECT MAX(id) FROM {table}), 0) "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+        (table, table),
+    ) is None:
+        return None
+    if execPrepared(
+        f"UPDATE sqlite_sequence SET seq = MAX(seq, COALESCE((SELECT MAX(id) FROM {table}), 0)) + ? WHERE name = ?",
+        (count, table),
+    ) is None:
+        return None
+    query = execPrepared("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    if query is None or not query.next():
+        return None
+    last = query.value(0)
+    query.finish()
+    return range(last - count + 1, last + 1)
+
+
+def fleetStatistics(table):
+    """Сводка по группам из model_stats или manufacture_stats, по убыванию числа записей
+
+    Читает только сводную таблицу: время не зависит от количества записей.
+    Строки: (название, записей, вес мин., вес средний, вес макс., дистанция макс.).
+    """
+    key = STATISTICS_TABLES[table]
+    reference = key[:-len("_id")]
+    query = execPrepared(
+        f"SELECT {reference}.name, s.records, s.weight_min, s.weight_sum / NULLIF(s.weight_count, 0), "
+        f"s.weight_max, s.distance_max FROM {table} AS s "
+        f"JOIN {reference} ON {reference}.id = s.{key} ORDER BY s.records DESC, {reference}.name"
+    )
+    rows = []
+    while query is not None and query.next():
+        rows.append(tuple(query.value(i) for i in range(6)))
+    return rows
+
+
+def _statisticsRows(sql):
+    query = InstrumentedQuery()
+    query.setForwardOnly(True)
+    rows = {}
+    if not query.exec(sql):
+        print("SQL Error:", query.lastError().text())
+        return None
+    while query.next():
+        rows[query.value(0)] = tuple(query.value(i) for i in range(1, 7))
+    return rows
+
+
+def verifyStatistics():
+    """Сравнивает сводные таблицы с агрегатами по data
+
+    Возвращает список расхождений (таблица, id группы, сохраненное, фактическое)
+    или None при ошибке. Суммы сравниваются с допуском на округление.
+    """
+    mismatches = []
+    for table, key in STATISTICS_TABLES.items():
+        stored = _statisticsRows(f"SELECT {key}, {_STATISTICS_COLUMNS} FROM {table}")
+        actual = _statisticsRows(
+            f"SELECT {key}, COUNT(*), COUNT(weight), TOTAL(weight), MIN(weight), MAX(weight), "
+            f"MAX(max_distance) FROM data GROUP BY {key}"
+        )
+        if stored is None or actual is None:
+            return None
+        for group in stored.keys() | actual.keys():
+            expected, found = actual.get(group), stored.get(group)
+            if expected is None or found is None or not all(
+                a == b or (a is not None and b is not None and abs(a - b) <= 1e-6 * max(1.0, abs(a)))
+                for a, b in zip(expected, found)
+            ):
+                mismatches.append((table, group, found, expected))
+    return mismatches
+
+
+def _hasMigrationRejects():
+    query = execPrepared("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'migration_rejects'")
+    if query is None:
+        return False
+    # Незавершенный запрос к sqlite_master не дает менять схему
+    found = query.next()
+    query.finish()
+    return found
+
+
+def migrationRejects():
+    """Значения, которые миграция не смогла разобрать: [(id записи, поле, исходный текст)]
+
+    Пустой список, если таблицы нет (БД создана новой версией или обновлена до
+    появления таблицы); None при ошибке.
+    """
+    if not _hasMigrationRejects():
+        return []
+    query = execPrepared("SELECT data_id, field, value FROM migration_rejects ORDER BY data_id, field")
+    if query is None:
+        return None
+    rows = []
+    while query.next():
+        rows.append((query.value(0), query.value(1), query.value(2)))
+    return rows
+
+
+def rebuildStatistics():
+    """Пересчитывает сводные таблицы с нуля одной транзакцией"""
+    db = QSqlDatabase.database()
+    db.transaction()
+    if _execAll(tuple(f"DELETE FROM {table}" for table in STATISTICS_TABLES)) and _fillStatistics():
+        return db.commit()
+    db.rollback()
+    return False
+
+
+def rekeyData():
+    """Перенумеровывает записи data подряд с 1 в порядке текущих id
+
+    Нужна для баз прежних версий, где id вычислялся из хэша полей в диапазоне
+    0-9999. Внешние идентификаторы uid не меняются. Возвращает количество
+    записей или None при ошибке.
+    """
+    db = QSqlDatabase.database()
+    db.transaction()
+    ok = _execAll((
+        # Полнотекстовый индекс перестраивается один раз в конце, а не на каждую строку
+        "DROP TRIGGER data_fts_ai",
+        "DROP TRIGGER data_fts_ad",
+        "DROP TRIGGER data_fts_au",
+        "CREATE TEMP TABLE rekey (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)",
+        "INSERT INTO temp.rekey SELECT id, ROW_NUMBER() OVER (ORDER BY id) FROM data",
+        # Сначала уводим id в отрицательные, чтобы новые номера не пересекались со старыми
+        "UPDATE data SET id = -id",
+        "UPDATE data SET id = (SELECT new_id FROM temp.rekey WHERE old_id = -data.id)",
+    ) + ((
+        # Нераспознанные при миграции значения остаются привязаны к своим записям
+        "UPDATE migration_rejects SET data_id = "
+        "(SELECT new_id FROM temp.rekey WHERE old_id = migration_rejects.data_id) "
+        "WHERE data_id IN (SELECT old_id FROM temp.rekey)",
+    ) if _hasMigrationRejects() else ()) + (
+        "DROP TABLE temp.rekey",
+        "UPDATE sqlite_sequence SET seq = (SELECT COALESCE(MAX(id), 0) FROM data) WHERE name = 'data'",
+    ) + tuple(
+        statement for statement in _SEARCH_TRIGGERS if "ON data BEGIN" in statement
+    ) + (
+        "INSERT INTO data_fts (data_fts) VALUES ('rebuild')",
+    ))
+    if not (ok and db.commit()):
+        db.rollback()
+        return None
+    query = execPrepared("SELECT COUNT(*) FROM data")
+    return query.value(0) if query is not None and query.next() else 0
+
+
+def closeConnection():
+    """Закрывает подключение по умолчанию и освобождает подготовленные запросы"""
+    _preparedQueries.clear()
+    if QSqlDatabase.contains():
+        name = QSqlDatabase.database(open=False).connectionName()
+        QSqlDatabase.database(open=False).close()
+        QSqlDatabase.removeDatabase(name)
+
+
+_coreApplication = None
+
+
+def coreApplication():
+    """QCoreApplication для работы с БД без графического интерфейса (инструменты командной строки)
+
+    Ссылка хранится в модуле: без нее PyQt сразу удалил бы объект.
+    """
+    global _coreApplication
+    if QCoreApplication.instance() is None:
+        _coreApplication = QCoreApplication(sys.argv[:1])
+    return QCoreApplication.instance()
+
+
+def openConnection(databaseName=DATABASE_NAME):
+    """Открывает БД, настраивает ее и применяет миграции без участия GUI
+
+    Возвращает текст ошибки или None, если подключение прошло успешно.
+    """
+    _adoptLegacyDatabase(databaseName)
+    closeConnection()
 
     connection = QSqlDatabase.addDatabase("QSQLITE")
     connection.setDatabaseName(databaseName)
+    connection.setConnectOptions("QSQLITE_BUSY_TIMEOUT=5000")
 
     if not connection.open():
+        return f"Database Error: {connection.lastError().text()}"
+
+    _applyPragmas()
+    if not migrate():
+        return "Database Error: schema migration failed"
+    return None
+
+
+def openReadConnection(name, databaseName):
+    """Открывает дополнительное подключение только для чтения (для фоновых выборок)
+
+    Схема не проверяется и не мигрирует: это делает основное подключение.
+    Возвращает текст ошибки или None.
+    """
+    connection = QSqlDatabase.addDatabase("QSQLITE", name)
+    connection.setDatabaseName(databaseName)
+    connection.setConnectOptions("QSQLITE_BUSY_TIMEOUT=5000")
+    if not connection.open():
+        return f"Database Error: {connection.lastError().text()}"
+    _applyPragmas(connection)
+    if not InstrumentedQuery(connection).exec("PRAGMA query_only = ON"):
+        return "Database Error: cannot make connection read-only"
+    return None
+
+
+def createConnection(databaseName=DATABASE_NAME):
+    """Открывает БД и при ошибке показывает сообщение"""
+
+    error = openConnection(databaseName)
+    if error is not None:
         QMessageBox.warning(
             None,
             "DB Drones",
-            f"Database Error: {connection.lastError().text()}",
+            error,
         )
         return False
-
-    _createContactsTable()
-    _createManufacturerTable()
-    _createModelTable()
-    return True
\ No newline at end of file
+    if _migrationRejects:
+        QMessageBox.warning(
+            None,
+            "DB Drones",
+            f"При обновлении базы не распознано значений веса и дистанции: {_migrationRejects}. "
+            "В записях они оставлены пустыми, исходный текст сохранен в таблице migration_rejects "
+            "(список: python -m dbdrones.repair --rejects).",
+        )
+    return True
@@ -0,0 +1,145 @@
+"""Этот модуль находит и объединяет повторяющиеся записи о дронах
+
+Попарное сравнение всех записей - O(n²), поэтому записи сравниваются только
+внутри блоков. Сначала точные копии (одинаковые модель, производитель, вес,
+дистанция и изображение) сводятся к одной записи по отпечатку содержимого.
+Затем оставшиеся записи раскладываются по ячейкам (модель, производитель,
+интервал веса) с интервалами в логарифмической шкале шириной в допуск.
+Запись сравнивается только с записями своей и двух соседних ячеек, а
+найденные пары объединяются в группы (система непересекающихся множеств).
+
+Работает через DroneRepository, поэтому подходит и для приложения
+(database.QtSqlBackend), и для командной строки.
+"""
+
+import math
+
+# Допуск по умолчанию: относительная разница веса и дистанции, при которой записи похожи
+WEIGHT_TOLERANCE = 0.01
+DISTANCE_TOLERANCE = 0.01
+# Через сколько просмотренных записей вызывается progress
+PROGRESS_STEP = 10000
+
+_SCAN_SQL = "SELECT id, model_id, manufacture_id, weight, max_distance, image_hash, image_path FROM data"
+
+
+def _bucketWidth(tolerance):
+    """Ширина интервала -ln(1 - допуск): не меньше разницы логарифмов похожих значений"""
+    return -math.log1p(-tolerance) if 0 < tolerance < 1 else None
+
+
+def _buckets(value, width):
+    """Интервал значения и соседние; значения вне логарифмической шкалы сравниваются только на равенство"""
+    if value is None or value <= 0 or width is None:
+        return value, (value,)
+    bucket = math.floor(math.log(value) / width)
+    return bucket, (bucket - 1, bucket, bucket + 1)
+
+
+def _close(first, second, tolerance):
+    if first is None or second is None:
+        return first is second
+    return abs(first - second) <= tolerance * max(abs(first), abs(second))
+
+
+class _Groups:
+    """Система непересекающихся множеств id"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while item != root:
+            item, self.parent[item] = self.parent[item], root
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            # Корнем группы остается меньший id
+            self.parent[max(first, second)] = min(first, second)
+
+
+def findDuplicates(repository, weightTolerance=WEIGHT_TOLERANCE, distanceTolerance=DISTANCE_TOLERANCE,
+                   progress=None):
+    """Группы повторяющихся записей: списки записей (словари FIELDS) по возрастанию id
+
+    progress(просмотрено, всего) -> False прерывает поиск (возвращается None).
+    """
+    total = repository.count()
+    groups = _Groups()
+    # Отпечаток содержимого -> первая запись с ним
+    fingerprints = {}
+    # Ячейка -> [(id, вес, дистанция)] записей с разными отпечатками
+    cells = {}
+    width = _bucketWidth(weightTolerance)
+    for scanned, (rowId, modelId, manufactureId, weight, distance, imageHash, imagePath) in enumerate(
+        repository.backend.rows(_SCAN_SQL), 1
+    ):
+        if progress is not None and scanned % PROGRESS_STEP == 0 and progress(scanned, total) is False:
+            return None
+        fingerprint = (modelId, manufactureId, weight, distance, imageHash or imagePath)
+        first = fingerprints.setdefault(fingerprint, rowId)
+        if first != rowId:
+            groups.union(first, rowId)
+            continue
+        bucket, neighbours = _buckets(weight, width)
+        for neighbour in neighbours:
+            for otherId, otherWeight, otherDistance in cells.get((modelId, manufactureId, neighbour), ()):
+                if _close(weight, otherWeight, weightTolerance) and _close(distance, otherDistance, distanceTolerance):
+                    groups.union(otherId, rowId)
+        cells.setdefault((modelId, manufactureId, bucket), []).append((rowId, weight, distance))
+    if progress is not None:
+        progress(total, total)
+
+    members = {}
+    for rowId in groups.parent:
+        members.setdefault(groups.find(rowId), []).append(rowId)
+    records = {
+        record["id"]: record
+        for record in repository.records(rowId for ids in members.values() for rowId in ids)
+    }
+    return [
+        [records[rowId] for rowId in sorted(ids) if rowId in records]
+        for _, ids in sorted(members.items())
+    ]
+
+
+def mergeDuplicates(repository, merges):
+    """Объединяет записи одной транзакцией и возвращает количество удаленных
+
+    merges - [(id остающейся записи, [id объединяемых с ней])]. Пустые вес,
+    дистанция и изображение остающейся записи берутся из объединяемых,
+    объединяемые записи удаляются.
+    """
+    deleted = 0
+    with repository.transaction():
+        records = {
+            record["id"]: record
+            for record in repository.records(rowId for keepId, otherIds in merges for rowId in [keepId, *otherIds])
+        }
+        for keepId, otherIds in merges:
+            keep = records.get(keepId)
+            if keep is None:
+                continue
+            others = [records[rowId] for rowId in sorted(otherIds) if rowId in records and rowId != keepId]
+            changes = {}
+            for field in ("weight", "max_distance"):
+                if keep[field] is None:
+                    changes[field] = next((other[field] for other in others if other[field] is not None), None)
+            if not (keep["image_hash"] or keep["image_path"]):
+                donor = next((other for other in others if other["image_hash"] or other["image_path"]), None)
+                if donor is not None:
+                    changes.update(image_hash=donor["image_hash"], image_path=donor["image_path"])
+            changes = {field: value for field, value in changes.items() if value is not None}
+            if changes:
+                repository.backend.execute(
+                    f"UPDATE data SET {', '.join(f'{field} = ?' for field in changes)} WHERE id = ?",
+                    list(changes.values()) + [keepId],
+                )
+            for other in others:
+                deleted += repository.backend.execute("DELETE FROM data WHERE id = ?", (other["id"],))[1]
+    return deleted
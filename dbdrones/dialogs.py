@@ -0,0 +1,527 @@
+
+
+"""Этот модуль содержит диалоговые окна приложения
+
+Модуль импортируется при первом открытии диалога, а не при запуске.
+"""
+
+import time
+
+from PyQt5.QtCore import Qt, QSize, QStringListModel, QTimer
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import (
+    QAbstractItemView,
+    QComboBox,
+    QCompleter,
+    QDialog,
+    QDialogButtonBox,
+    QDockWidget,
+    QDoubleSpinBox,
+    QFileDialog,
+    QFormLayout,
+    QInputDialog,
+    QLabel,
+    QLineEdit,
+    QMessageBox,
+    QProgressDialog,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QTabWidget,
+    QTreeWidget,
+    QTreeWidgetItem,
+    QVBoxLayout,
+)
+
+from . import startup
+from .database import fleetStatistics
+from .images import readScaledImage
+from .querylog import queryLog
+from .units import parseDistance, parseWeight
+
+
+class DiagnosticsDialog(QDialog):
+    """Самые медленные и частые запросы из журнала queryLog"""
+
+    COLUMNS = ("Запрос", "Вызовов", "Медленных", "Всего (мс)", "Макс. (мс)", "Строк", "План")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Диагностика запросов")
+        self.resize(1000, 500)
+        layout = QVBoxLayout(self)
+
+        # Порог медленного запроса задается в миллисекундах
+        self.thresholdField = QDoubleSpinBox()
+        self.thresholdField.setRange(0, 60000)
+        self.thresholdField.setSuffix(" мс")
+        self.thresholdField.setValue(queryLog.slowThreshold * 1000)
+        self.thresholdField.valueChanged.connect(self.setThreshold)
+        form = QFormLayout()
+        form.addRow("Порог медленного запроса:", self.thresholdField)
+        # Фазы запуска приложения, мс от старта
+        phases = ", ".join(f"{name} {elapsed * 1000:.0f}" for name, elapsed in startup.phases)
+        form.addRow("Запуск (мс):", QLabel(phases or "нет данных"))
+        layout.addLayout(form)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setWordWrap(False)
+        layout.addWidget(self.table)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        for text, handler in (
+            ("Обновить", self.refresh),
+            ("Очистить", self.clearLog),
+            ("Экспорт JSON...", self.exportJson),
+        ):
+            button = buttons.addButton(text, QDialogButtonBox.ActionRole)
+            button.clicked.connect(handler)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.refresh()
+
+    def setThreshold(self, value):
+        queryLog.slowThreshold = value / 1000
+
+    def refresh(self):
+        """Перечитывает сводку из журнала"""
+        stats = queryLog.slowest(100)
+        self.table.setRowCount(len(stats))
+        for row, stat in enumerate(stats):
+            values = (
+                " ".join(stat["sql"].split()),
+                stat["count"],
+                stat["slow"],
+                f"{stat['total'] * 1000:.1f}",
+                f"{stat['max'] * 1000:.1f}",
+                stat["rows"],
+                "; ".join(stat["plan"] or ()),
+            )
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                item.setToolTip(str(value))
+                self.table.setItem(row, column, item)
+        self.table.resizeColumnsToContents()
+        self.table.setColumnWidth(0, min(self.table.columnWidth(0), 400))
+
+    def clearLog(self):
+        queryLog.clear()
+        self.refresh()
+
+    def exportJson(self):
+        """Сохраняет самые медленные запросы в JSON-файл"""
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт диагностики", "queries.json", "JSON (*.json)")
+        if not path:
+            return
+        try:
+            queryLog.exportJson(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить файл: {e}")
+
+
+class StatisticsPanel(QDockWidget):
+    """Сводка по производителям и моделям из таблиц, которые поддерживают триггеры
+
+    Панель перечитывает сводку после изменений таблицы, пока она видна;
+    частые изменения объединяются в одно обновление.
+    """
+
+    COLUMNS = ("Название", "Записей", "Вес мин. (г)", "Вес средний (г)", "Вес макс. (г)", "Дистанция макс. (м)")
+    TABLES = (("По производителям", "manufacture_stats"), ("По моделям", "model_stats"))
+    REFRESH_DELAY_MS = 300
+
+    def __init__(self, model, parent=None):
+        super().__init__("Статистика", parent)
+        self.tabs = QTabWidget()
+        self.tables = {}
+        for title, table in self.TABLES:
+            widget = QTableWidget(0, len(self.COLUMNS))
+            widget.setHorizontalHeaderLabels(self.COLUMNS)
+            widget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            widget.setWordWrap(False)
+            widget.verticalHeader().hide()
+            self.tabs.addTab(widget, title)
+            self.tables[table] = widget
+        self.setWidget(self.tabs)
+
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.setInterval(self.REFRESH_DELAY_MS)
+        self.refreshTimer.timeout.connect(self.refresh)
+        for signal in (model.modelReset, model.rowsInserted, model.rowsRemoved, model.dataChanged):
+            signal.connect(self.scheduleRefresh)
+        self.visibilityChanged.connect(self.scheduleRefresh)
+
+    def scheduleRefresh(self, *args):
+        if self.isVisible():
+            self.refreshTimer.start()
+
+    def refresh(self):
+        """Перечитывает сводные таблицы"""
+        for table, widget in self.tables.items():
+            rows = fleetStatistics(table)
+            widget.setRowCount(len(rows))
+            for row, values in enumerate(rows):
+                for column, value in enumerate(values):
+                    text = "" if value is None else f"{value:.10g}" if isinstance(value, float) else str(value)
+                    item = QTableWidgetItem(text)
+                    if column:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    widget.setItem(row, column, item)
+            widget.resizeColumnsToContents()
+
+
+class DuplicatesDialog(QDialog):
+    """Группы повторяющихся записей; отмеченные записи группы объединяются с основной"""
+
+    COLUMNS = ("ID", "Модель", "Вес (г)", "Производитель", "Макс. дистанция (м)", "Изображение")
+    FIELDS = ("id", "model_name", "weight", "manufacture", "max_distance", "image")
+
+    def __init__(self, contactsModel, parent=None):
+        super().__init__(parent)
+        self.contactsModel = contactsModel
+        self.setWindowTitle("Повторяющиеся записи")
+        self.resize(900, 550)
+        layout = QVBoxLayout(self)
+
+        # Допуск - относительная разница значений, при которой записи считаются повтором
+        form = QFormLayout()
+        self.toleranceFields = {}
+        for field, title in (("weight", "Допуск веса:"), ("max_distance", "Допуск дистанции:")):
+            spin = QDoubleSpinBox()
+            spin.setRange(0, 50)
+            spin.setDecimals(1)
+            spin.setSuffix(" %")
+            spin.setValue(1.0)
+            form.addRow(title, spin)
+            self.toleranceFields[field] = spin
+        layout.addLayout(form)
+
+        self.summaryLabel = QLabel()
+        layout.addWidget(self.summaryLabel)
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(self.COLUMNS)
+        self.tree.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.tree)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        for text, handler in (
+            ("Найти", self.find),
+            ("Сделать основной", self.setKeep),
+            ("Объединить отмеченные", self.merge),
+        ):
+            button = buttons.addButton(text, QDialogButtonBox.ActionRole)
+            button.clicked.connect(handler)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        # Поиск начинается после показа окна
+        QTimer.singleShot(0, self.find)
+
+    def find(self):
+        """Ищет группы повторов с текущими допусками"""
+        progress = QProgressDialog("Поиск повторяющихся записей...", "Отмена", 0, 1000, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+
+        def report(scanned, total):
+            progress.setValue(int(scanned / total * 1000) if total else 1000)
+            return not progress.wasCanceled()
+
+        started = time.perf_counter()
+        groups = self.contactsModel.findDuplicates(
+            self.toleranceFields["weight"].value() / 100,
+            self.toleranceFields["max_distance"].value() / 100,
+            report,
+        )
+        progress.close()
+        if groups is None:
+            self.summaryLabel.setText("Поиск прерван")
+            return
+        self.tree.clear()
+        for number, records in enumerate(groups, 1):
+            group = QTreeWidgetItem([f"Группа {number}: {len(records)} записей"])
+            group.setFirstColumnSpanned(True)
+            # Основная запись группы - по умолчанию самая ранняя
+            group.setData(0, Qt.UserRole, records[0]["id"])
+            for record in records:
+                values = dict(record, image="есть" if record["image_hash"] or record["image_path"] else "")
+                item = QTreeWidgetItem([
+                    f"{value:.10g}" if isinstance(value, float) else str(value if value is not None else "")
+                    for value in (values[field] for field in self.FIELDS)
+                ])
+                item.setData(0, Qt.UserRole, record["id"])
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(0, Qt.Checked)
+                group.addChild(item)
+            self.tree.addTopLevelItem(group)
+            self._markKeep(group)
+        self.tree.expandAll()
+        for column in range(len(self.COLUMNS)):
+            self.tree.resizeColumnToContents(column)
+        duplicates = sum(len(records) - 1 for records in groups)
+        self.summaryLabel.setText(
+            f"Групп: {len(groups)}, лишних записей: {duplicates} ({time.perf_counter() - started:.1f} с). "
+            "Отмеченные записи группы объединяются с основной (выделена жирным)."
+        )
+
+    def _markKeep(self, group):
+        keepId = group.data(0, Qt.UserRole)
+        for index in range(group.childCount()):
+            item = group.child(index)
+            font = item.font(0)
+            font.setBold(item.data(0, Qt.UserRole) == keepId)
+            for column in range(len(self.COLUMNS)):
+                item.setFont(column, font)
+
+    def setKeep(self):
+        """Делает выделенную запись основной в ее группе"""
+        item = self.tree.currentItem()
+        if item is None or item.parent() is None:
+            return
+        item.parent().setData(0, Qt.UserRole, item.data(0, Qt.UserRole))
+        item.setCheckState(0, Qt.Checked)
+        self._markKeep(item.parent())
+
+    def merge(self):
+        """Объединяет отмеченные записи каждой группы с ее основной записью"""
+        merges = []
+        for index in range(self.tree.topLevelItemCount()):
+            group = self.tree.topLevelItem(index)
+            keepId = group.data(0, Qt.UserRole)
+            others = [
+                group.child(row).data(0, Qt.UserRole)
+                for row in range(group.childCount())
+                if group.child(row).checkState(0) == Qt.Checked and group.child(row).data(0, Qt.UserRole) != keepId
+            ]
+            if others:
+                merges.append((keepId, others))
+        if not merges:
+            QMessageBox.information(self, "Объединение", "Нет отмеченных записей для объединения")
+            return
+        count = sum(len(others) for _, others in merges)
+        answer = QMessageBox.question(
+            self, "Объединение", f"Удалить {count} записей, объединив их с основными записями групп ({len(merges)})?"
+        )
+        if answer != QMessageBox.Yes:
+            return
+        deleted = self.contactsModel.mergeDuplicates(merges)
+        if deleted is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось объединить записи, изменения отменены")
+            return
+        # Объединенные записи убираются, группы из одной записи - тоже. Дерево
+        # пересобирается целиком: удаление элементов по одному - O(n) на каждый
+        merged = {rowId for _, others in merges for rowId in others}
+        groups = []
+        for group in self.tree.invisibleRootItem().takeChildren():
+            items = [item for item in group.takeChildren() if item.data(0, Qt.UserRole) not in merged]
+            if len(items) > 1:
+                group.addChildren(items)
+                groups.append(group)
+        self.tree.addTopLevelItems(groups)
+        self.tree.expandAll()
+        self.summaryLabel.setText(f"Объединено, удалено записей: {deleted}")
+
+
+class AddDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.setWindowTitle("Добавить дрон")
+        self.main_layout = QVBoxLayout()  # Используем только один layout
+        self.setLayout(self.main_layout)
+        self.data = None
+        self.image_path = ""
+        self.setupUI()
+        self.setupImageUI()
+
+    def setupUI(self):
+        # Создаем выпадающие списки
+        self.modelCombo = QComboBox()
+        self.manufacturerCombo = QComboBox()
+
+        # Настраиваем списки
+        self.setupComboBox(self.modelCombo, "модель", self.getModels)
+        self.setupComboBox(self.manufacturerCombo, "производителя", self.getManufacturers)
+
+        # Остальные поля
+        self.weightField = QLineEdit()
+        self.weightField.setPlaceholderText("например, 250 или 0,25 кг")
+        self.distanceField = QLineEdit()
+        self.distanceField.setPlaceholderText("например, 5000 или 5 км")
+
+        # Форма для основных полей
+        form_layout = QFormLayout()
+        form_layout.addRow("Модель:", self.modelCombo)
+        form_layout.addRow("Производитель:", self.manufacturerCombo)
+        form_layout.addRow("Вес (г):", self.weightField)
+        form_layout.addRow("Макс. дистанция (м):", self.distanceField)
+
+
+        # Добавляем форму в главный layout
+        self.main_layout.addLayout(form_layout)
+
+        # Кнопки
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.main_layout.addWidget(buttons)
+
+    def setupImageUI(self):
+        """Элементы для работы с изображением"""
+        self.btn_load = QPushButton("Загрузить фото дрона")
+        self.btn_load.clicked.connect(self.loadImage)
+
+        self.lbl_preview = QLabel()
+        self.lbl_preview.setFixedSize(200, 200)
+        self.lbl_preview.setStyleSheet("border: 1px solid #ccc;")
+        self.lbl_preview.setAlignment(Qt.AlignCenter)
+
+        # Layout для изображения
+        image_layout = QVBoxLayout()
+        image_layout.addWidget(QLabel("Фото дрона:"))
+        image_layout.addWidget(self.btn_load)
+        image_layout.addWidget(self.lbl_preview)
+
+        # Вставляем layout с изображением перед кнопками
+        self.main_layout.insertLayout(self.main_layout.count() - 1, image_layout)
+
+
+
+
+    def setupComboBox(self, combo, item_type, data_func):
+        """Настраивает выпадающий список"""
+        # Название можно набрать: подсказки фильтруются по подстроке без запросов к БД
+        combo.setEditable(True)
+        combo.setInsertPolicy(QComboBox.NoInsert)
+        completer = QCompleter(QStringListModel(combo), combo)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setFilterMode(Qt.MatchContains)
+        completer.setCompletionMode(QCompleter.PopupCompletion)
+        combo.setCompleter(completer)
+
+        combo.clear()
+        names = data_func()
+        combo.addItems(names)
+        combo.insertItem(0, "")  # Пустая строка в начале
+        combo.addItem(f"+ Добавить {item_type}", "add_item")
+        combo.setCurrentIndex(0)  # Выбираем пустую строку по умолчанию
+        completer.model().setStringList(names)
+
+        combo.currentIndexChanged.connect(
+            lambda: self.handleComboSelection(combo, item_type, data_func)
+        )
+
+    def handleComboSelection(self, combo, item_type, data_func):
+        """Обрабатывает выбор элемента"""
+        if combo.currentData() == "add_item":
+            # Запоминаем текущий индекс перед открытием диалога
+            prev_index = combo.currentIndex()
+
+            if item_type == "модель":
+                new_item, ok = QInputDialog.getText(
+                    self, f"Добавить {item_type}", f"Введите название {item_type}:")
+
+                if ok and new_item:
+                    if self.parent().contactsModel.addModel(new_item):
+                        self.refreshCombo(combo, item_type, data_func, new_item)
+                    else:
+                        QMessageBox.warning(self, "Ошибка", "Не удалось добавить")
+                        combo.setCurrentIndex(0)
+                else:
+                    # При отмене возвращаем выбор на первый элемент
+                    combo.setCurrentIndex(0)
+            else:
+                manufacturer, ok = QInputDialog.getText(
+                    self, "Добавить производителя", "Введите название производителя:")
+
+                if ok and manufacturer:
+                    country, ok = QInputDialog.getText(
+                        self, "Страна производителя", "Введите страну производителя:")
+
+                    if ok and country:
+                        if self.parent().contactsModel.addManufacturer(manufacturer, country):
+                            self.refreshCombo(combo, item_type, data_func, manufacturer)
+                        else:
+                            QMessageBox.warning(self, "Ошибка", "Не удалось добавить")
+                            combo.setCurrentIndex(0)
+                    else:
+                        combo.setCurrentIndex(0)
+                else:
+                    combo.setCurrentIndex(0)
+
+    def refreshCombo(self, combo, item_type, data_func, select_item=None):
+        """Обновляет содержимое комбобокса"""
+        current_text = combo.currentText()
+        names = data_func()
+        combo.blockSignals(True)
+        combo.clear()
+        combo.addItems(names)
+        combo.insertItem(0, "")
+        combo.addItem(f"+ Добавить {item_type}", "add_item")
+        combo.blockSignals(False)
+        combo.completer().model().setStringList(names)
+
+        if select_item:
+            index = combo.findText(select_item)
+            if index >= 0:
+                combo.setCurrentIndex(index)
+        else:
+            combo.setCurrentIndex(0)
+
+    def getModels(self):
+        return self.parent().contactsModel.getModels()
+
+    def getManufacturers(self):
+        return self.parent().contactsModel.getManufacturers()
+
+
+    def loadImage(self):
+        """Диалог выбора изображения"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Выберите изображение дрона",
+            "",
+            "Image Files (*.png *.jpg *.jpeg)"
+        )
+
+        if file_path:
+            self.image_path = file_path
+            # Читаем сразу уменьшенную копию, чтобы не декодировать фото целиком
+            image = readScaledImage(file_path, QSize(200, 200))
+            self.lbl_preview.setPixmap(QPixmap.fromImage(image))
+
+    def accept(self):
+        """Проверка данных перед сохранением"""
+        model = self.modelCombo.currentText()
+        manufacturer = self.manufacturerCombo.currentText()
+        weight = self.weightField.text()
+        distance = self.distanceField.text()
+
+        # Проверка заполненности полей
+        if not all([model, manufacturer, weight, distance]):
+            QMessageBox.warning(self, "Ошибка", "Все поля должны быть заполнены")
+            return
+
+        contactsModel = self.parent().contactsModel
+        # Проверка, что выбраны существующие значения (не пустая строка и не "+ Добавить")
+        if model == "" or self.modelCombo.currentData() == "add_item" or not contactsModel.hasModel(model):
+            QMessageBox.warning(self, "Ошибка", "Выберите модель из списка")
+            return
+
+        if (
+            manufacturer == ""
+            or self.manufacturerCombo.currentData() == "add_item"
+            or not contactsModel.hasManufacturer(manufacturer)
+        ):
+            QMessageBox.warning(self, "Ошибка", "Выберите производителя из списка")
+            return
+
+        weight = parseWeight(weight)
+        distance = parseDistance(distance)
+        if weight is None or distance is None:
+            QMessageBox.warning(self, "Ошибка", "Вес и дистанция должны быть числами")
+            return
+
+        self.data = [model, weight, manufacturer, distance, self.image_path]
+        super().accept()
@@ -0,0 +1,159 @@
+"""Этот модуль реализует потоковую выгрузку записей в CSV, JSONL и Parquet
+
+Записи читаются из курсора (DroneRepository.search) порциями по CHUNK_SIZE
+и сразу пишутся в файл, поэтому расход памяти не зависит от размера выборки.
+Файл пишется во временный и заменяет целевой только после успешной выгрузки.
+Для Parquet нужен необязательный пакет pyarrow.
+"""
+
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from .repository import FIELDS
+
+# Сколько записей пишется за один раз
+CHUNK_SIZE = 1000
+
+# Расширение файла -> формат
+EXPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+
+# Типы столбцов Parquet (остальные поля - строки)
+_PARQUET_TYPES = {"id": "int64", "weight": "float64", "max_distance": "float64"}
+
+
+class ExportError(Exception):
+    """Ошибка выгрузки"""
+
+
+class ExportResult:
+    """Итоги выгрузки"""
+
+    def __init__(self):
+        self.exported = 0
+        self.elapsed = 0.0
+        self.cancelled = False
+
+    @property
+    def rowsPerSecond(self):
+        return self.exported / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        text = f"Выгружено: {self.exported}, {self.rowsPerSecond:.0f} записей/с"
+        return f"{text} (прервано, файл не создан)" if self.cancelled else text
+
+
+def formatForPath(path):
+    """Формат выгрузки по расширению файла"""
+    fileFormat = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fileFormat is None:
+        raise ExportError(f"Неподдерживаемый формат файла: {path}")
+    return fileFormat
+
+
+class _CsvWriter:
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, chunk):
+        self.writer.writerows(chunk)
+
+
+class _JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, chunk):
+        self.stream.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in chunk))
+
+
+class _ParquetWriter:
+    """Каждая порция записывается отдельной группой строк"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ExportError("Для выгрузки в Parquet установите пакет pyarrow") from None
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [(field, _PARQUET_TYPES.get(field, "string")) for field in FIELDS]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, chunk):
+        batch = self.pyarrow.RecordBatch.from_pydict(
+            {field: [record[field] for record in chunk] for field in FIELDS}, schema=self.schema
+        )
+        self.writer.write_table(self.pyarrow.Table.from_batches([batch]))
+
+    def close(self):
+        self.writer.close()
+
+
+def _writeChunks(records, writer, total, progress, chunkSize, result):
+    started = time.perf_counter()
+    records = iter(records)
+    try:
+        while True:
+            chunk = list(islice(records, chunkSize))
+            if not chunk:
+                break
+            writer.write(chunk)
+            result.exported += len(chunk)
+            result.elapsed = time.perf_counter() - started
+            fraction = min(result.exported / total, 1.0) if total else None
+            if progress is not None and progress(result.exported, fraction, result.rowsPerSecond) is False:
+                result.cancelled = True
+                break
+    finally:
+        # Прерванная выборка сразу освобождает курсор
+        close = getattr(records, "close", None)
+        if close is not None:
+            close()
+    result.elapsed = time.perf_counter() - started
+
+
+def writeRecords(records, stream, fileFormat, chunkSize=CHUNK_SIZE):
+    """Пишет записи в открытый текстовый поток в CSV или JSONL и возвращает их количество"""
+    if fileFormat not in ("csv", "jsonl"):
+        raise ExportError(f"Формат {fileFormat} не поддерживается для текстового потока")
+    result = ExportResult()
+    writer = _CsvWriter(stream) if fileFormat == "csv" else _JsonLinesWriter(stream)
+    _writeChunks(records, writer, None, None, chunkSize, result)
+    return result.exported
+
+
+def exportRecords(records, path, fileFormat=None, total=None, progress=None, chunkSize=CHUNK_SIZE):
+    """Выгружает записи (словари FIELDS) в файл и возвращает ExportResult
+
+    total - ожидаемое количество записей для расчета доли. progress(выгружено,
+    доля или None, записей/с) -> False прерывает выгрузку; прерванная
+    выгрузка не оставляет файла.
+    """
+    fileFormat = fileFormat or formatForPath(path)
+    temporary = f"{path}.tmp"
+    result = ExportResult()
+    try:
+        if fileFormat == "parquet":
+            writer = _ParquetWriter(temporary)
+            try:
+                _writeChunks(records, writer, total, progress, chunkSize, result)
+            finally:
+                writer.close()
+        elif fileFormat in ("csv", "jsonl"):
+            with open(temporary, "w", encoding="utf-8", newline="") as stream:
+                writer = _CsvWriter(stream) if fileFormat == "csv" else _JsonLinesWriter(stream)
+                _writeChunks(records, writer, total, progress, chunkSize, result)
+        else:
+            raise ExportError(f"Неизвестный формат выгрузки: {fileFormat}")
+        if not result.cancelled:
+            os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return result
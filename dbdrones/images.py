@@ -0,0 +1,259 @@
+
+
+"""Этот модуль обеспечивает кэширование изображений для таблицы"""
+
+import mmap
+import os
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+# Объем памяти под кэш миниатюр по умолчанию (байт)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Окончание имени готовых миниатюр хранилища изображений
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+# Как часто проверяется, не изменился ли на диске файл из кэша (с)
+STAT_INTERVAL = 2.0
+
+
+def readScaledImage(path, size):
+    """Читает изображение сразу уменьшенным до size с сохранением пропорций
+
+    Декодер получает целевой размер заранее, поэтому изображение в полном
+    разрешении в памяти не создается. Маленькие изображения не увеличиваются.
+    Возвращает пустой QImage, если файл прочитать не удалось.
+    """
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    original = reader.size()
+    if original.isValid() and (
+        original.width() > size.width() or original.height() > size.height()
+    ):
+        reader.setScaledSize(original.scaled(size, Qt.KeepAspectRatio))
+    return reader.read()
+
+
+def readMappedImage(path, size):
+    """Читает готовую миниатюру через отображение файла в память
+
+    Миниатюры маленькие и уже повернуты, поэтому декодер получает данные
+    прямо из mmap без чтения файла в буфер.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            image = QImage.fromData(data)
+    except (OSError, ValueError):
+        return QImage()
+    if image.width() > size.width() or image.height() > size.height():
+        image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+
+def fileModified(path):
+    """Время изменения файла (нс), None - если файл недоступен"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _pixmapCost(pixmap):
+    """Оценивает объем памяти, занимаемый изображением (байт)"""
+    if pixmap.isNull():
+        return 0
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+class ThumbnailCache:
+    """LRU-кэш масштабированных изображений, ограниченный по объему памяти
+
+    Ключ - (путь, ширина, высота). Время изменения файла запоминается при
+    загрузке и сверяется не чаще раза в STAT_INTERVAL, а не при каждой
+    отрисовке; изображения измененного файла вытесняются. Миниатюры
+    хранилища адресуются хэшем содержимого и не меняются, их файлы не
+    проверяются.
+    """
+
+    def __init__(self, maxBytes=DEFAULT_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        # Путь -> (время изменения при загрузке, когда сверялось)
+        self._modified = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def makeKey(path, size):
+        """Ключ кэша для файла и размера"""
+        return (path, size.width(), size.height())
+
+    def get(self, key):
+        """Возвращает изображение из кэша или None"""
+        pixmap = self._items.get(key)
+        if pixmap is not None and not self._isCurrent(key[0]):
+            self._discard(key[0])
+            pixmap = None
+        if pixmap is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return pixmap
+
+    def _isCurrent(self, path):
+        """Не изменился ли файл с момента загрузки (проверяется раз в STAT_INTERVAL)"""
+        known = self._modified.get(path)
+        if known is None or path.endswith(THUMBNAIL_SUFFIX):
+            return True
+        modified, checked = known
+        now = time.monotonic()
+        if now - checked < STAT_INTERVAL:
+            return True
+        if fileModified(path) != modified:
+            return False
+        self._modified[path] = (modified, now)
+        return True
+
+    def _discard(self, path):
+        """Убирает из кэша все изображения файла"""
+        for key in [key for key in self._items if key[0] == path]:
+            self._bytes -= _pixmapCost(self._items.pop(key))
+        self._modified.pop(path, None)
+
+    def put(self, key, pixmap, modified=None):
+        """Помещает изображение в кэш, вытесняя давно не использованные
+
+        modified - время изменения файла, с которого прочитано изображение.
+        """
+        if not key[0].endswith(THUMBNAIL_SUFFIX):
+            known = self._modified.get(key[0])
+            if known is not None and known[0] != modified:
+                # Изображения других размеров прочитаны из прежней версии файла
+                self._discard(key[0])
+            self._modified[key[0]] = (modified, time.monotonic())
+        if key in self._items:
+            self._bytes -= _pixmapCost(self._items.pop(key))
+        cost = _pixmapCost(pixmap)
+        if cost > self.maxBytes:
+            return
+        self._items[key] = pixmap
+        self._bytes += cost
+        while self._bytes > self.maxBytes:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= _pixmapCost(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        """Очищает кэш"""
+        self._items.clear()
+        self._modified.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """Счетчики работы кэша"""
+        return {
+            "items": len(self._items),
+            "bytes": self._bytes,
+            "maxBytes": self.maxBytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class _DecodeSignals(QObject):
+    """Сигналы фоновых задач (QRunnable сам сигналы отправлять не может)"""
+
+    finished = pyqtSignal(object, QImage)
+
+
+class _DecodeJob(QRunnable):
+    """Фоновая задача чтения и масштабирования одного изображения"""
+
+    def __init__(self, key, path, size, signals):
+        super().__init__()
+        # Задачей владеет загрузчик, Qt не должен удалять ее сам
+        self.setAutoDelete(False)
+        self.key = key
+        self.path = path
+        self.size = size
+        self.signals = signals
+        self.rows = set()
+        self.cancelled = False
+        self.modified = None
+
+    def run(self):
+        if self.cancelled:
+            image = QImage()
+        elif self.path.endswith(THUMBNAIL_SUFFIX):
+            image = readMappedImage(self.path, self.size)
+        else:
+            # Время изменения читается в фоне до файла: правка во время чтения даст перезагрузку
+            self.modified = fileModified(self.path)
+            image = readScaledImage(self.path, self.size)
+        self.signals.finished.emit(self, image)
+
+
+class AsyncThumbnailLoader(QObject):
+    """Загружает миниатюры в пуле потоков и складывает их в ThumbnailCache
+
+    Пока задача выполняется, request возвращает None и ячейка рисует заглушку.
+    Когда изображение готово, отправляется сигнал ready со строками, которые
+    его ждали.
+    """
+
+    ready = pyqtSignal(object)
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(2, QThreadPool.globalInstance().maxThreadCount() - 1))
+        self._pending = {}
+        # Все запущенные задачи, включая отмененные: ссылка держится до завершения
+        self._jobs = set()
+        self._signals = _DecodeSignals(self)
+        self._signals.finished.connect(self._onFinished)
+
+    def request(self, path, size, row):
+        """Готовая миниатюра, пустой QPixmap для недоступного файла или None, пока идет загрузка"""
+        key = self.cache.makeKey(path, size)
+        pixmap = self.cache.get(key)
+        if pixmap is not None:
+            return pixmap
+        job = self._pending.get(key)
+        if job is None:
+            job = _DecodeJob(key, path, size, self._signals)
+            self._pending[key] = job
+            self._jobs.add(job)
+            self.pool.start(job)
+        job.rows.add(row)
+        return None
+
+    def cancelOutside(self, first, last):
+        """Отменяет задачи, все строки которых вне диапазона [first, last]"""
+        for key, job in list(self._pending.items()):
+            if not any(first <= row <= last for row in job.rows):
+                job.cancelled = True
+                if self.pool.tryTake(job):
+                    self._jobs.discard(job)
+                del self._pending[key]
+
+    def pendingCount(self):
+        """Количество незавершенных задач"""
+        return len(self._pending)
+
+    def _onFinished(self, job, image):
+        self._jobs.discard(job)
+        if self._pending.get(job.key) is job:
+            del self._pending[job.key]
+        if image.isNull() and job.cancelled:
+            return
+        # Результат отмененной, но уже выполненной задачи тоже пригодится
+        self.cache.put(job.key, QPixmap.fromImage(image), job.modified)
+        if not job.cancelled:
+            self.ready.emit(job.rows)
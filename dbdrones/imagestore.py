@@ -0,0 +1,124 @@
+
+
+"""Этот модуль хранит изображения дронов в каталоге рядом с БД по хэшу содержимого
+
+Файл с одинаковым содержимым хранится один раз: objects/ab/<sha256><расширение>.
+При добавлении сразу создается миниатюра размера ячейки таблицы
+(thumbs/ab/<sha256>.thumb.jpg), поэтому при отрисовке фото не декодируются целиком.
+Таблица image считает ссылки из data (триггеры), файлы без ссылок удаляет
+collectGarbage(). Миниатюры читаются через mmap (images.readMappedImage).
+"""
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+from PyQt5.QtCore import QSize
+from PyQt5.QtSql import QSqlDatabase
+
+from .database import execPrepared
+from .images import THUMBNAIL_SUFFIX, readScaledImage
+
+# Размер миниатюр: совпадает с размером изображения в ячейке таблицы
+THUMBNAIL_SIZE = QSize(200, 150)
+THUMBNAIL_QUALITY = 85
+_CHUNK_SIZE = 1024 * 1024
+
+
+def hashFile(path):
+    """SHA-256 содержимого файла (hex)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageStore:
+    """Каталог изображений с адресацией по содержимому"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def originalPath(self, digest, suffix):
+        return self.root / "objects" / digest[:2] / f"{digest}{suffix}"
+
+    def thumbnailPath(self, digest):
+        return self.root / "thumbs" / digest[:2] / f"{digest}{THUMBNAIL_SUFFIX}"
+
+    def ingest(self, path):
+        """Добавляет файл в хранилище и возвращает его хэш
+
+        Повторное добавление того же содержимого ничего не копирует. Возвращает
+        None, если файл не читается или не является изображением.
+        """
+        try:
+            digest = hashFile(path)
+        except OSError:
+            return None
+        query = execPrepared("SELECT 1 FROM image WHERE hash = ?", (digest,))
+        if query is not None and query.next():
+            query.finish()
+            return digest
+
+        image = readScaledImage(str(path), THUMBNAIL_SIZE)
+        if image.isNull():
+            return None
+        suffix = Path(path).suffix.lower()
+        original = self.originalPath(digest, suffix)
+        thumbnail = self.thumbnailPath(digest)
+        try:
+            for target in (original, thumbnail):
+                target.parent.mkdir(parents=True, exist_ok=True)
+            # Запись через временный файл: в хранилище не бывает недописанных файлов
+            temporary = original.with_name(original.name + ".tmp")
+            shutil.copyfile(path, temporary)
+            os.replace(temporary, original)
+            temporary = thumbnail.with_name(thumbnail.name + ".tmp")
+            if not image.save(str(temporary), "JPG", THUMBNAIL_QUALITY):
+                return None
+            os.replace(temporary, thumbnail)
+        except OSError as e:
+            print("Image store error:", e)
+            return None
+
+        if execPrepared(
+            "INSERT OR IGNORE INTO image (hash, suffix, bytes) VALUES (?, ?, ?)",
+            (digest, suffix, os.path.getsize(original)),
+        ) is None:
+            return None
+        return digest
+
+    def collectGarbage(self):
+        """Удаляет изображения, на которые не ссылается ни одна запись; возвращает их количество"""
+        query = execPrepared("SELECT hash, suffix FROM image WHERE refcount <= 0")
+        unused = []
+        while query is not None and query.next():
+            unused.append((query.value(0), query.value(1)))
+        for digest, suffix in unused:
+            if execPrepared("DELETE FROM image WHERE hash = ? AND refcount <= 0", (digest,)) is None:
+                continue
+            for path in (self.originalPath(digest, suffix), self.thumbnailPath(digest)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        return len(unused)
+
+
+def storeRoot(databaseName):
+    """Каталог хранилища для файла БД: drones.sqlite -> drones.images"""
+    return Path(databaseName).with_suffix(".images")
+
+
+_stores = {}
+
+
+def imageStore():
+    """Хранилище изображений текущей БД"""
+    name = QSqlDatabase.database().databaseName()
+    store = _stores.get(name)
+    if store is None:
+        store = _stores[name] = ImageStore(storeRoot(name))
+    return store
@@ -0,0 +1,360 @@
+
+
+"""Этот модуль реализует массовый импорт записей о дронах из CSV, JSON и JSONL"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+from PyQt5.QtSql import QSqlDatabase
+
+from .database import allocateIds, execPrepared, preparedQuery
+from .imagestore import imageStore
+from .querylog import InstrumentedQuery
+from .units import parseDistance, parseWeight
+
+# Количество записей, сохраняемых одной транзакцией
+DEFAULT_BATCH_SIZE = 5000
+# Сколько ошибок проверки сохранять в отчете
+MAX_REPORTED_ERRORS = 100
+
+# Допустимые названия полей во входных файлах
+FIELD_ALIASES = {
+    "model_name": ("model_name", "model"),
+    "weight": ("weight",),
+    "manufacture": ("manufacture", "manufacturer"),
+    "max_distance": ("max_distance", "distance"),
+    "image_path": ("image_path", "image"),
+    "country": ("country",),
+    "uid": ("uid", "external_id"),
+}
+
+
+class ImportFileError(Exception):
+    """Ошибка чтения входного файла"""
+
+
+class ImportResult:
+    """Итоги импорта"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.skipped = 0
+        self.errors = []
+        self.elapsed = 0.0
+        self.cancelled = False
+
+    @property
+    def rowsPerSecond(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+    def addError(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        text = (
+            f"Добавлено: {self.inserted}, пропущено: {self.skipped}, "
+            f"{self.rowsPerSecond:.0f} записей/с"
+        )
+        if self.cancelled:
+            text += " (прервано)"
+        return text
+
+
+class _ProgressFile:
+    """Текстовый поток поверх бинарного файла с учетом прочитанных байт"""
+
+    def __init__(self, path):
+        self.raw = open(path, "rb")
+        self.size = max(self.raw.seek(0, io.SEEK_END), 1)
+        self.raw.seek(0)
+        self.text = io.TextIOWrapper(self.raw, encoding="utf-8-sig", newline="")
+
+    def fraction(self):
+        return min(self.raw.tell() / self.size, 1.0)
+
+    def close(self):
+        self.text.close()
+
+
+def _readCsv(stream):
+    for line, record in enumerate(csv.DictReader(stream), start=2):
+        yield line, record
+
+
+def _readJsonLines(stream):
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as e:
+                raise ImportFileError(f"Строка {line}: {e}") from e
+
+
+def _readJsonArray(stream, chunkSize=64 * 1024):
+    """Разбирает JSON-массив объектов по частям, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = stream.read(chunkSize).lstrip()
+    if not buffer.startswith("["):
+        raise ImportFileError("Ожидался JSON-массив объектов")
+    buffer = buffer[1:]
+    number = 0
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except ValueError:
+            chunk = stream.read(chunkSize)
+            if not chunk:
+                raise ImportFileError(f"Некорректный JSON после записи {number}")
+            buffer += chunk
+            continue
+        number += 1
+        yield number, record
+        buffer = buffer[end:]
+
+
+READERS = {
+    ".csv": _readCsv,
+    ".json": _readJsonArray,
+    ".jsonl": _readJsonLines,
+    ".ndjson": _readJsonLines,
+}
+
+
+def _field(record, name):
+    for alias in FIELD_ALIASES[name]:
+        value = record.get(alias)
+        if value is not None:
+            return str(value).strip()
+    return ""
+
+
+def validateRecord(record):
+    """Проверяет запись и возвращает словарь значений полей или бросает ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError("запись должна быть объектом")
+    values = {name: _field(record, name) for name in FIELD_ALIASES}
+    for name in ("model_name", "weight", "manufacture", "max_distance"):
+        if not values[name]:
+            raise ValueError(f"не заполнено поле {name}")
+    for name, parse in (("weight", parseWeight), ("max_distance", parseDistance)):
+        number = parse(values[name])
+        if number is None:
+            raise ValueError(f"поле {name} должно быть числом с единицами измерения: {values[name]!r}")
+        values[name] = number
+    return values
+
+
+class DroneImporter:
+    """Потоковый импорт: чтение по частям, проверка, пакетная запись в транзакциях"""
+
+    def __init__(self, batchSize=DEFAULT_BATCH_SIZE, progress=None):
+        self.batchSize = batchSize
+        # progress(обработано, доля файла, записей/с) -> False прерывает импорт
+        self.progress = progress
+        self._manufacturers = None
+        self._models = None
+        # Путь к файлу изображения -> хэш в хранилище (None - файл не добавлен)
+        self._imageHashes = {}
+
+    def _loadLookups(self):
+        self._manufacturers = set()
+        self._models = set()
+        query = InstrumentedQuery()
+        query.setForwardOnly(True)
+        query.exec("SELECT name FROM manufacture")
+        while query.next():
+            self._manufacturers.add(query.value(0))
+        query.exec("SELECT name FROM model")
+        while query.next():
+            self._models.add(query.value(0))
+
+    def _ingestImage(self, path):
+        """Хэш изображения в хранилище; каждый файл добавляется один раз за импорт"""
+        if not path:
+            return None
+        if path not in self._imageHashes:
+            self._imageHashes[path] = imageStore().ingest(path)
+        return self._imageHashes[path]
+
+    def importFile(self, path):
+        """Импортирует файл и возвращает ImportResult"""
+        suffix = path[path.rfind("."):].lower() if "." in path else ""
+        reader = READERS.get(suffix)
+        if reader is None:
+            raise ImportFileError(f"Неподдерживаемый формат файла: {suffix or path}")
+
+        self._loadLookups()
+        result = ImportResult()
+        source = _ProgressFile(path)
+        started = time.perf_counter()
+        try:
+            records = reader(source.text)
+            while True:
+                batch = list(islice(records, self.batchSize))
+                if not batch:
+                    break
+                self._writeBatch(batch, result)
+                result.elapsed = time.perf_counter() - started
+                if self.progress is not None and self.progress(
+                    result.inserted + result.skipped, source.fraction(), result.rowsPerSecond
+                ) is False:
+                    result.cancelled = True
+                    break
+        finally:
+            source.close()
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def _writeBatch(self, batch, result):
+        """Записывает пакет одной транзакцией с заранее подготовленными запросами
+
+        Строка, которую отвергла БД, откатывается до своей точки сохранения и
+        попадает в ошибки; остальные строки пакета записываются.
+        """
+        rows = []
+        for line, record in batch:
+            try:
+                rows.append((line, validateRecord(record)))
+            except ValueError as e:
+                result.addError(line, str(e))
+        if not rows:
+            return
+
+        # Файлы добавляются в хранилище до транзакции: если пакет откатится,
+        # изображения останутся без ссылок и их удалит collectGarbage
+        imageHashes = [self._ingestImage(values["image_path"]) for _, values in rows]
+
+        db = QSqlDatabase.database()
+        db.transaction()
+
+        insertManufacturer = preparedQuery("INSERT OR IGNORE INTO manufacture (name, country) VALUES (?, ?)")
+        insertModel = preparedQuery("INSERT OR IGNORE INTO model (name) VALUES (?)")
+        insertData = preparedQuery(
+            "INSERT INTO data (id, model_id, weight, manufacture_id, max_distance, image_path, image_hash, uid) "
+            "VALUES (?, (SELECT id FROM model WHERE name = ?), ?, "
+            "(SELECT id FROM manufacture WHERE name = ?), ?, ?, ?, "
+            "COALESCE(?, lower(hex(randomblob(16)))))"
+        )
+
+        # id для всего пакета резервируются одним запросом
+        ids = allocateIds(len(rows))
+        if ids is None:
+            db.rollback()
+            for line, _ in rows:
+                result.addError(line, "не удалось выделить id")
+            return
+
+        # Ошибка БД в строке (например, повторный uid) отменяет только эту строку.
+        # Один INSERT в data откатывается сам по себе вместе с триггерами; точка
+        # сохранения нужна, только если строка добавляет еще и справочники
+        nextId, rejected = ids.start, set()
+        for (line, values), imageHash in zip(rows, imageHashes):
+            savepoint = values["manufacture"] not in self._manufacturers or values["model_name"] not in self._models
+            if savepoint and execPrepared("SAVEPOINT import_row") is None:
+                break
+            failed = self._insertRow(nextId, values, imageHash, insertManufacturer, insertModel, insertData)
+            if failed is None:
+                nextId += 1
+            else:
+                result.addError(line, failed)
+                rejected.add(line)
+                if savepoint and execPrepared("ROLLBACK TO import_row") is None:
+                    break
+            if savepoint and execPrepared("RELEASE import_row") is None:
+                break
+        else:
+            # id отклоненных строк возвращаются счетчику, нумерация остается плотной
+            restored = not rejected or execPrepared(
+                "UPDATE sqlite_sequence SET seq = ? WHERE name = 'data'", (nextId - 1,)
+            ) is not None
+            if restored and db.commit():
+                result.inserted += nextId - ids.start
+                if rejected:
+                    self._collectImages()
+                return
+
+        error = db.lastError().text()
+        db.rollback()
+        # Справочники в кэше могли разойтись с БД после отката - перечитываем их
+        self._loadLookups()
+        self._collectImages()
+        for line, _ in rows:
+            if line not in rejected:
+                result.addError(line, f"пакет отменен: {error}")
+
+    def _collectImages(self):
+        """Удаляет изображения, оставшиеся без ссылок после отмененных строк"""
+        imageStore().collectGarbage()
+        self._imageHashes.clear()
+
+    def _insertRow(self, rowId, values, imageHash, insertManufacturer, insertModel, insertData):
+        """Добавляет запись и недостающие справочники; возвращает текст ошибки или None"""
+        if values["manufacture"] not in self._manufacturers:
+            insertManufacturer.bindValue(0, values["manufacture"])
+            insertManufacturer.bindValue(1, values["country"])
+            if not insertManufacturer.exec():
+                return insertManufacturer.lastError().text()
+        if values["model_name"] not in self._models:
+            insertModel.bindValue(0, values["model_name"])
+            if not insertModel.exec():
+                return insertModel.lastError().text()
+        insertData.bindValue(0, rowId)
+        insertData.bindValue(1, values["model_name"])
+        insertData.bindValue(2, values["weight"])
+        insertData.bindValue(3, values["manufacture"])
+        insertData.bindValue(4, values["max_distance"])
+        insertData.bindValue(5, None if imageHash else values["image_path"] or None)
+        insertData.bindValue(6, imageHash)
+        # Внешний идентификатор сохраняется, если он есть во входном файле
+        insertData.bindValue(7, values["uid"] or None)
+        if not insertData.exec():
+            return insertData.lastError().text()
+        # В кэш справочников названия попадают только вместе с записанной строкой
+        self._manufacturers.add(values["manufacture"])
+        self._models.add(values["model_name"])
+        return None
+
+
+def main(argv=None):
+    """Импорт без графического интерфейса: python -m dbdrones.importer ФАЙЛ [--db БД]"""
+    from .database import DATABASE_NAME, coreApplication, openConnection
+
+    parser = argparse.ArgumentParser(description="Импорт записей о дронах")
+    parser.add_argument("file", help="файл CSV, JSON или JSONL")
+    parser.add_argument("--db", default=DATABASE_NAME, help="файл базы данных SQLite")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="записей в транзакции")
+    args = parser.parse_args(argv)
+
+    coreApplication()
+    error = openConnection(args.db)
+    if error is not None:
+        print(error, file=sys.stderr)
+        return 1
+
+    def report(processed, fraction, rate):
+        print(f"\r{fraction:6.1%}  {processed} записей  {rate:.0f} записей/с", end="", file=sys.stderr)
+
+    try:
+        result = DroneImporter(args.batch, report).importFile(args.file)
+    except (OSError, ImportFileError) as e:
+        print(f"\n{e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+    for line, message in result.errors:
+        print(f"{args.file}:{line}: {message}", file=sys.stderr)
+    print(result.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
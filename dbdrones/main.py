@@ -3,24 +3,28 @@
 
 import sys
 
+from . import startup
 from PyQt5.QtWidgets import QApplication
 
 from .database import createConnection
-from .views import Window
 
 def main():
     """Основная функция"""
+    startup.mark("qt_imported")
     # Создание приложения
     app = QApplication(sys.argv)
+    startup.mark("application")
     # Подключение к бд перед созданием окна приложения
-    if not createConnection("data.sqlite"):
-        sys.exit(1)
-    elif not createConnection("manufacture.sqlite"):
-        sys.exit(1)
-    elif not createConnection("model.sqlite"):
+    if not createConnection():
         sys.exit(1)
+    startup.mark("database")
+    # Окно и его зависимости импортируются только после успешного подключения
+    from .views import Window
+
     # Создание главного окна приложения, если подключение прошло успешно
     win = Window()
+    startup.mark("window")
     win.show()
+    startup.mark("shown")
     # Запуск цикла работы
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
@@ -2,118 +2,1076 @@
 
 """Этот модуль реализует модель для управления таблицей """
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from functools import partial
 import os
-from PyQt5.QtSql import QSqlTableModel, QSqlQuery
-from PyQt5.QtGui import QPixmap
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from PyQt5.QtGui import QBrush, QColor, QPixmap
+
+from PyQt5.QtSql import QSqlDatabase
+
+from .database import QtSqlBackend, execPrepared
+from .imagestore import imageStore
+from .repository import (
+    HAS_TRIGRAM_INDEX_SQL,
+    SORT_FIELDS,
+    SUGGEST_CANDIDATES,
+    SUGGEST_SQL,
+    DroneRepository,
+    RepositoryError,
+    buildMatchExpression,
+    buildTrigramExpression,
+    orderBy,
+    rankSuggestions,
+    sortKeys,
+)
+from .units import parseDistance, parseWeight
+from .worker import QueryContext, QueryError
+
+
+# Количество строк в одной странице выборки
+PAGE_SIZE = 200
+# Сколько страниц одновременно держится в памяти
+MAX_CACHED_PAGES = 8
+
+# Фон ячеек с несохраненными правками пакетного режима
+PENDING_BRUSH = QBrush(QColor(255, 236, 150))
+
+# Столбцы таблицы data в порядке отображения
+COLUMNS = ("id", "model_name", "weight", "manufacture", "max_distance", "image_path")
+HEADERS = ("ID", "Модель", "Вес (г)", "Производитель", "Макс. дистанция (м)", "Изображение")
+# Числовые столбцы, по которым возможна фильтрация диапазоном
+RANGE_COLUMNS = ("weight", "max_distance")
+# Позиция хэша изображения в строке выборки
+_IMAGE_HASH = len(COLUMNS)
+# Столбцы-ссылки: название -> (столбец внешнего ключа, таблица справочника)
+RELATIONS = {
+    "model_name": ("model_id", "model"),
+    "manufacture": ("manufacture_id", "manufacture"),
+}
+
+# Выборка строк таблицы с подстановкой названий из справочников по внешним ключам;
+# последним идет хэш изображения в хранилище (в таблице не отображается)
+_SELECT_ROWS = (
+    "SELECT data.id, model.name, data.weight, manufacture.name, data.max_distance, data.image_path, "
+    "data.image_hash "
+    "FROM data "
+    "JOIN model ON model.id = data.model_id "
+    "JOIN manufacture ON manufacture.id = data.manufacture_id"
+)
+
+
+def _rangeConditions(ranges, table="data"):
+    """Условия фильтров по диапазону {столбец: (от, до)} и их параметры"""
+    conditions, params = [], []
+    for column, (low, high) in ranges.items():
+        if low is not None:
+            conditions.append(f"{table}.{column} >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{table}.{column} <= ?")
+            params.append(high)
+    return conditions, params
+
+
+# Соединения со справочниками, нужные для сортировки по названию
+_SORT_JOINS = {
+    "model_name": " JOIN model ON model.id = data.model_id",
+    "manufacture": " JOIN manufacture ON manufacture.id = data.manufacture_id",
+}
+
+
+def _sortJoins(keys):
+    return "".join(_SORT_JOINS[field] for field, _ in keys if field in _SORT_JOINS)
+
+
+def _keysetCondition(keys, values):
+    """Условие "запись идет после записи с ключом values" в порядке keys и его параметры
+
+    NULL в числовых столбцах при сортировке по возрастанию идет первым, по
+    убыванию - последним. Первый ключ ограничивается еще и диапазоном, чтобы
+    обход индекса начинался сразу с нужного места.
+    """
+    condition, params = None, []
+    for (field, descending), value in reversed(list(zip(keys, values))):
+        expression = SORT_FIELDS[field]
+        nullable = field in RANGE_COLUMNS
+        parts, partParams = [], []
+        if value is not None:
+            sign = "<" if descending else ">"
+            if descending and nullable:
+                parts.append(f"({expression} < ? OR {expression} IS NULL)")
+            else:
+                parts.append(f"{expression} {sign} ?")
+            partParams.append(value)
+        elif not descending:
+            parts.append(f"{expression} IS NOT NULL")
+        if condition is not None:
+            parts.append(f"({expression} {'IS' if nullable else '='} ? AND ({condition}))")
+            partParams += [value] + params
+        condition, params = " OR ".join(parts) or "0", partParams
+    (field, descending), value = keys[0], values[0]
+    if len(keys) > 1 and value is not None and not (descending and field in RANGE_COLUMNS):
+        condition = f"{SORT_FIELDS[field]} {'<=' if descending else '>='} ? AND ({condition})"
+        params = [value] + params
+    return condition, params
+
+
+def _value(query, column):
+    """Значение столбца строки; для NULL QSqlQuery.value возвращает пустую строку, здесь - None"""
+    return None if query.isNull(column) else query.value(column)
+
+
+def _sortValue(value):
+    """Ключ Python, упорядочивающий значения как SQLite: NULL, числа, строки"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, value)
+
+
+# Задачи выборки: выполняются в фоновом потоке (worker) или синхронно с QueryContext()
+
+def lookupNames(context, table):
+    """Названия справочника по алфавиту"""
+    query = context.query(f"SELECT name FROM {table} ORDER BY name")
+    names = []
+    while query.next():
+        names.append(query.value(0))
+    return names
+
+
+def suggestCorrections(context, text, limit=5):
+    """Варианты исправления текста поиска по индексу триграмм названий"""
+    expression = buildTrigramExpression(text)
+    if not expression:
+        return []
+    query = context.query(HAS_TRIGRAM_INDEX_SQL)
+    if not (query.next() and query.value(0)):
+        return []
+    query = context.query(SUGGEST_SQL, (expression, SUGGEST_CANDIDATES, expression, SUGGEST_CANDIDATES))
+    names = []
+    while query.next():
+        names.append(query.value(0))
+    return rankSuggestions(text, names, limit)
+
+
+def countRecords(context, ranges):
+    """COUNT записей под фильтрами, по порциям id"""
+    conditions, params = _rangeConditions(ranges)
+    condition = " AND ".join(["data.id > ?", "data.id <= ?"] + conditions)
+    total = 0
+    for low, high in context.idRanges():
+        query = context.query(f"SELECT COUNT(*) FROM data WHERE {condition}", [low, high] + params)
+        total += query.value(0) if query.next() else 0
+    return total
+
+
+def matchIds(context, expression, ranges, keys=None):
+    """id совпадений поиска в порядке релевантности или в порядке keys
+
+    Совпадения выбираются по порциям id и сортируются после выборки: bm25
+    считается по статистике всей таблицы, поэтому rank от порций не зависит.
+    """
+    conditions, params = _rangeConditions(ranges)
+    condition = " AND ".join(["data_fts MATCH ?", "data_fts.rowid > ?", "data_fts.rowid <= ?"] + conditions)
+    if keys:
+        columns = ", ".join(SORT_FIELDS[field] for field, _ in keys)
+        joins = _sortJoins(keys)
+    else:
+        keys, columns, joins = [("rank", False), ("id", False)], "data_fts.rank, data.id", ""
+    matches = []
+    for low, high in context.idRanges():
+        query = context.query(
+            f"SELECT data.id, {columns} FROM data_fts JOIN data ON data.id = data_fts.rowid{joins} WHERE {condition}",
+            [expression, low, high] + params,
+        )
+        while query.next():
+            matches.append([_value(query, i) for i in range(len(keys) + 1)])
+    # Устойчивая сортировка по ключам от последнего к первому
+    for position in range(len(keys), 0, -1):
+        matches.sort(key=lambda match: _sortValue(match[position]), reverse=keys[position - 1][1])
+    return [match[0] for match in matches]
+
+
+class LookupCache:
+    """Отсортированные списки названий справочников (model, manufacture) в памяти
+
+    Список читается из БД при первом обращении (функцией load, по умолчанию
+    через подключение Qt) или заранее в фоне (prefetch). Добавленные
+    приложением названия вставляются в список без повторного запроса; после
+    изменений в обход приложения (импорт) кэш сбрасывается через invalidate().
+    """
+
+    def __init__(self, load=None):
+        self._names = {}
+        self._load = load or self._query
+        self._queries = None
+
+    @staticmethod
+    def _query(table):
+        try:
+            return lookupNames(QueryContext(), table)
+        except QueryError as e:
+            print("SQL Error:", e)
+            return []
+
+    def prefetch(self, queries):
+        """Загружает справочники в фоновом потоке; до готовности names() читает их сам"""
+        self._queries = queries
+        for table in ("model", "manufacture"):
+            if table not in self._names:
+                queries.submit(f"lookup:{table}", partial(lookupNames, table=table), partial(self._loaded, table))
+
+    def _loaded(self, table, names):
+        self._names.setdefault(table, names)
+
+    def _cancelPrefetch(self, table):
+        # Фоновая выборка могла начаться до изменения справочника
+        if self._queries is not None:
+            self._queries.cancel(f"lookup:{table}")
+
+    def names(self, table):
+        """Названия справочника по алфавиту (список не изменять)"""
+        names = self._names.get(table)
+        if names is None:
+            names = self._names[table] = self._load(table)
+        return names
+
+    def contains(self, table, name):
+        names = self.names(table)
+        position = bisect_left(names, name)
+        return position < len(names) and names[position] == name
+
+    def add(self, table, name):
+        """Учитывает название, добавленное в справочник"""
+        names = self._names.get(table)
+        if names is None:
+            self._cancelPrefetch(table)
+        elif not self.contains(table, name):
+            insort(names, name)
+
+    def invalidate(self, table=None):
+        """Сбрасывает кэш справочника (None - всех справочников)"""
+        for name in ("model", "manufacture") if table is None else (table,):
+            self._names.pop(name, None)
+            self._cancelPrefetch(name)
+
+
+class DronesTableModel(QAbstractTableModel):
+    """Табличная модель, которая держит в памяти только окно страниц вокруг видимой области
+
+    Страницы выбираются по ключу сортировки (по умолчанию id > ?), количество
+    строк берется из закэшированного COUNT. При select(deferCount=True) модель
+    сразу сообщает только строки первой страницы, а COUNT выполняется в
+    fetchCount(). Сортировка по нескольким столбцам выполняется в SQL: при
+    частых порядках страница берется обходом индекса. При активном поиске
+    порядок строк задает список id совпадений из data_fts, упорядоченный по
+    релевантности, а при поиске с сортировкой - по ее ключам. Фильтры по
+    диапазону добавляются в WHERE как сравнения с индексированными столбцами.
+    selectInBackground() выбирает совпадения поиска и COUNT в фоновом потоке.
+
+    В пакетном режиме правки не пишутся сразу, а копятся в очереди (повторная
+    правка ячейки заменяет предыдущую) и записываются одной транзакцией
+    commitBatch() или отбрасываются rollbackBatch().
+    """
+
+    # Количество несохраненных правок пакетного режима
+    pendingChanged = pyqtSignal(int)
+    # Отложенный COUNT выполнен
+    countReady = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._headers = list(HEADERS)
+        self.lookups = LookupCache()
+        self._matchExpression = ""
+        self._ranges = {}
+        self._matchIds = None
+        # Сортировка [(номер столбца, Qt.SortOrder)], применяется при select()
+        self._sortOrder = []
+        # Поиск и фильтры, которыми сделана текущая выборка
+        self._activeFilter = ("", {})
+        # Заданный порядок текущей выборки [(поле, по убыванию)] и полный порядок с id
+        self._activeSort = []
+        self._keys = sortKeys([])
+        self._count = None
+        # Число строк, показанных до подсчета COUNT (None - подсчет не отложен)
+        self._provisional = None
+        # Счетчик изменений выборки: фоновый результат по устаревшей выборке не применяется
+        self._version = 0
+        self._pages = OrderedDict()
+        # Номер страницы -> ключ сортировки записи, после которой она начинается (None - с начала)
+        self._anchors = {0: None}
+        self._batch = False
+        # Очередь правок: (id записи, столбец) -> новое значение
+        self._pending = {}
+
+    def setMatchExpression(self, expression):
+        """Устанавливает выражение MATCH (пустая строка - без поиска)"""
+        self._matchExpression = expression
+
+    def setRangeFilter(self, column, low=None, high=None):
+        """Ограничивает числовой столбец диапазоном [low, high] (None - без границы)"""
+        if column not in RANGE_COLUMNS:
+            raise ValueError(f"Фильтр по диапазону не поддерживается для {column}")
+        if low is None and high is None:
+            self._ranges.pop(column, None)
+        else:
+            self._ranges[column] = (low, high)
+
+    def clearFilters(self):
+        """Снимает поиск и все фильтры по диапазону"""
+        self._matchExpression = ""
+        self._ranges.clear()
+
+    def setSortOrder(self, sortOrder):
+        """Устанавливает сортировку [(номер столбца, Qt.SortOrder)], первый столбец - главный
+
+        Пустой список - порядок по id (при поиске - по релевантности).
+        """
+        for column, _ in sortOrder:
+            if COLUMNS[column] not in SORT_FIELDS:
+                raise ValueError(f"Сортировка не поддерживается для {COLUMNS[column]}")
+        self._sortOrder = list(sortOrder)
+        self.headerDataChanged.emit(Qt.Horizontal, 0, len(COLUMNS) - 1)
+
+    def sortOrder(self):
+        return list(self._sortOrder)
+
+    def isSortable(self, column):
+        return COLUMNS[column] in SORT_FIELDS
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.setSortOrder([(column, order)])
+        self.select()
+
+    def _requestedSort(self):
+        return [(COLUMNS[column], order == Qt.DescendingOrder) for column, order in self._sortOrder]
+
+    def _filterConditions(self, table="data"):
+        """Условия фильтров по диапазону текущей выборки и их параметры"""
+        return _rangeConditions(self._activeFilter[1], table)
+
+    def select(self, deferCount=False):
+        """Сбрасывает закэшированные страницы и количество строк
+
+        С deferCount=True без поиска представление сначала получает только
+        первую страницу; остальные строки добавляются вызовом fetchCount().
+        """
+        sort = self._requestedSort()
+        ids = self._selectMatchIds(sort) if self._matchExpression else None
+        self._reset(self._matchExpression, dict(self._ranges), sort, ids, deferCount)
+        return True
+
+    def _reset(self, expression, ranges, sort, ids, deferCount):
+        self.beginResetModel()
+        self._version += 1
+        self._pages.clear()
+        self._anchors = {0: None}
+        self._count = None
+        self._provisional = None
+        self._activeFilter = (expression, ranges)
+        self._activeSort = sort
+        self._keys = sortKeys(sort)
+        self._matchIds = ids
+        if deferCount and self._matchIds is None:
+            loaded = len(self._page(0))
+            if loaded < PAGE_SIZE:
+                self._count = loaded
+            else:
+                self._provisional = loaded
+        self.endResetModel()
+
+    def selectInBackground(self, queries):
+        """То же, что select(deferCount=True), но поиск и COUNT выполняются в фоновом потоке
+
+        До результата поиска таблица показывает прежнюю выборку. Новый вызов
+        отменяет незаконченный поиск.
+        """
+        queries.cancel("count")
+        if not self._matchExpression:
+            queries.cancel("select")
+            self.select(deferCount=True)
+            self.requestCount(queries)
+            return
+        expression, ranges, version = self._matchExpression, dict(self._ranges), self._version
+        sort = self._requestedSort()
+
+        def apply(ids):
+            if self._version != version:
+                # Пока шел поиск, записи добавлялись или удалялись
+                self.selectInBackground(queries)
+            else:
+                self._reset(expression, ranges, sort, ids, False)
+
+        keys = sortKeys(sort) if sort else None
+        queries.submit("select", partial(matchIds, expression=expression, ranges=ranges, keys=keys), apply)
+
+    def requestCount(self, queries):
+        """Выполняет отложенный COUNT в фоновом потоке"""
+        if self._provisional is None:
+            return
+        version = self._version
+
+        def apply(count):
+            if self._version != version:
+                self.fetchCount()
+            elif self._provisional is not None:
+                self._count = count
+                self._applyCount()
+
+        queries.submit("count", partial(countRecords, ranges=self._activeFilter[1]), apply)
+
+    def fetchCount(self):
+        """Выполняет отложенный COUNT и добавляет в представление остальные строки"""
+        if self._provisional is None:
+            return
+        self._applyCount()
+
+    def _applyCount(self):
+        loaded, self._provisional = self._provisional, None
+        count = self.rowCount()
+        if count > loaded:
+            self.beginInsertRows(QModelIndex(), loaded, count - 1)
+            self.endInsertRows()
+        elif count < loaded:
+            self.beginRemoveRows(QModelIndex(), count, loaded - 1)
+            self.endRemoveRows()
+        self.countReady.emit(count)
+
+    def totalRowCount(self):
+        """Количество строк выборки с учетом еще не досчитанных"""
+        self.fetchCount()
+        return self.rowCount()
+
+    def activeFilter(self):
+        """Выражение MATCH и диапазоны {столбец: (от, до)} текущей выборки"""
+        return self._activeFilter
+
+    def activeSort(self):
+        """Сортировка текущей выборки [(поле, по убыванию)]; пустая - порядок по умолчанию"""
+        return self._activeSort
+
+    def _selectMatchIds(self, sort):
+        """id всех совпадений поиска в порядке релевантности или сортировки"""
+        try:
+            return matchIds(QueryContext(), self._matchExpression, self._ranges, sortKeys(sort) if sort else None)
+        except QueryError as e:
+            print("SQL Error:", e)
+            return []
+
+    def _matchCondition(self):
+        """Условие и параметры принадлежности записи data.id текущей выборке"""
+        conditions, params = self._filterConditions()
+        if self._matchIds is not None:
+            conditions.append(
+                "data.id IN (SELECT rowid FROM data_fts WHERE data_fts MATCH ?)"
+            )
+            params.append(self._activeFilter[0])
+        return " AND ".join(conditions) or "1", params
+
+    def _invalidateFrom(self, row):
+        """Сбрасывает закэшированные страницы и границы, начиная со страницы строки row"""
+        page = row // PAGE_SIZE
+        for cached in [p for p in self._pages if p >= page]:
+            del self._pages[cached]
+        self._anchors = {p: anchor for p, anchor in self._anchors.items() if p <= page}
+
+    def recordInserted(self, rowId):
+        """Встраивает запись, уже добавленную в БД, без повторной выборки всей таблицы
+
+        Запись, не попадающая под поиск и фильтры, не показывается. Без сортировки
+        новая запись с наибольшим id добавляется в конец; иначе позиция считается
+        по индексу id или по ключу сортировки.
+        """
+        self._version += 1
+        if self._matchIds is None and self._count is None:
+            # Количество строк еще не посчитано - подсчет уже учтет новую запись
+            return
+        condition, params = self._matchCondition()
+        query = execPrepared(f"SELECT 1 FROM data WHERE data.id = ? AND {condition}", [rowId] + params)
+        if query is None or not query.next():
+            return
+        count = self.rowCount()
+        if self._matchIds is not None and not self._activeSort:
+            # Порядок по релевантности не пересчитывается: новая запись идет в конец
+            position = count
+        elif self._activeSort:
+            position = self._rowsBefore(rowId, condition, params, count)
+        else:
+            query = execPrepared("SELECT EXISTS (SELECT 1 FROM data WHERE id > ?)", (rowId,))
+            if query is not None and query.next() and query.value(0):
+                query = execPrepared(
+                    f"SELECT COUNT(*) FROM data WHERE data.id < ? AND {condition}", [rowId] + params
+                )
+                position = query.value(0) if query is not None and query.next() else count
+            else:
+                position = count
+
+        self.beginInsertRows(QModelIndex(), position, position)
+        if self._matchIds is not None:
+            self._matchIds.insert(position, rowId)
+        else:
+            self._count = count + 1
+        self._invalidateFrom(position)
+        self.endInsertRows()
+
+    def _rowsBefore(self, rowId, condition, params, default):
+        """Количество записей выборки, которые в текущем порядке идут раньше записи rowId"""
+        keys, joins = self._keys, _sortJoins(self._keys)
+        query = execPrepared(
+            f"SELECT {', '.join(SORT_FIELDS[field] for field, _ in keys)} FROM data{joins} WHERE data.id = ?",
+            (rowId,),
+        )
+        if query is None or not query.next():
+            return default
+        values = [_value(query, i) for i in range(len(keys))]
+        # Раньше записи идут те, что шли бы после нее в обратном порядке
+        before, beforeParams = _keysetCondition([(field, not descending) for field, descending in keys], values)
+        query = execPrepared(
+            f"SELECT COUNT(*) FROM data{joins} WHERE ({before}) AND {condition}", beforeParams + params
+        )
+        return query.value(0) if query is not None and query.next() else default
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        """Удаляет строки из БД и сообщает представлению только об удаленных строках
+
+        Удаление всех строк выборки выполняется одним запросом DELETE по условию.
+        """
+        total = self.totalRowCount()
+        if parent.isValid() or count <= 0 or row < 0 or row + count > total:
+            return False
+
+        db = QSqlDatabase.database()
+        db.transaction()
+        if count == total:
+            condition, params = self._matchCondition()
+            ok = execPrepared(f"DELETE FROM data WHERE {condition}", params) is not None
+        else:
+            ids = [self.rowId(r) for r in range(row, row + count)]
+            ok = all(execPrepared("DELETE FROM data WHERE id = ?", (rowId,)) is not None for rowId in ids)
+        if not (ok and db.commit()):
+            db.rollback()
+            return False
+
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        self._version += 1
+        if self._matchIds is not None:
+            del self._matchIds[row:row + count]
+        else:
+            self._count = total - count
+        self._invalidateFrom(row)
+        self.endRemoveRows()
+        if self._pending:
+            self._prunePending()
+        # Файлы изображений, на которые больше никто не ссылается, удаляются
+        imageStore().collectGarbage()
+        return True
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._matchIds is not None:
+            return len(self._matchIds)
+        if self._provisional is not None:
+            return self._provisional
+        if self._count is None:
+            conditions, params = self._filterConditions()
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            query = execPrepared(f"SELECT COUNT(*) FROM data{where}", params)
+            self._count = query.value(0) if query is not None and query.next() else 0
+        return self._count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def _page(self, page):
+        """Страница строк из кэша; при промахе выбирается из БД, старые страницы вытесняются"""
+        rows = self._pages.get(page)
+        if rows is not None:
+            self._pages.move_to_end(page)
+            return rows
+        if self._matchIds is not None:
+            rows = self._fetchMatchPage(page)
+        else:
+            rows = self._fetchKeysetPage(page)
+        self._pages[page] = rows
+        if len(self._pages) > MAX_CACHED_PAGES:
+            self._pages.popitem(last=False)
+        return rows
+
+    def _readRows(self, query):
+        rows = []
+        while query.next():
+            rows.append([_value(query, i) for i in range(len(COLUMNS) + 1)])
+        return rows
+
+    def _fetchKeysetPage(self, page):
+        """Выбирает страницу по ключу от ближайшей известной границы
+
+        При последовательной прокрутке граница предыдущей страницы известна и
+        смещение равно нулю; при прыжке индекс пропускается через OFFSET. id
+        страницы выбираются из индекса без соединений, названия - только для них.
+        """
+        known = max(p for p in self._anchors if p <= page)
+        anchor = self._anchors[known]
+        conditions, params = self._filterConditions()
+        if anchor is not None:
+            condition, anchorParams = _keysetCondition(self._keys, anchor)
+            conditions.append(f"({condition})")
+            params += anchorParams
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = orderBy(self._keys)
+        query = execPrepared(
+            f"{_SELECT_ROWS} WHERE data.id IN ("
+            f"SELECT data.id FROM data{_sortJoins(self._keys)}{where} ORDER BY {order} LIMIT ? OFFSET ?"
+            f") ORDER BY {order}",
+            params + [PAGE_SIZE, (page - known) * PAGE_SIZE],
+        )
+        if query is None:
+            return []
+        rows = self._readRows(query)
+        if len(rows) == PAGE_SIZE:
+            self._anchors[page + 1] = [rows[-1][COLUMNS.index(field)] for field, _ in self._keys]
+        return rows
+
+    def _fetchMatchPage(self, page):
+        """Выбирает страницу результатов поиска по списку id"""
+        ids = self._matchIds[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        if not ids:
+            return []
+        # Список дополняется NULL до размера страницы, чтобы запрос был один и тот же
+        query = execPrepared(
+            f"{_SELECT_ROWS} WHERE data.id IN ({', '.join('?' * PAGE_SIZE)})",
+            ids + [None] * (PAGE_SIZE - len(ids)),
+        )
+        if query is None:
+            return []
+        byId = {row[0]: row for row in self._readRows(query)}
+        return [byId.get(rowId, [rowId] + [None] * len(COLUMNS)) for rowId in ids]
+
+    def _row(self, row):
+        rows = self._page(row // PAGE_SIZE)
+        offset = row % PAGE_SIZE
+        return rows[offset] if offset < len(rows) else None
+
+    def rowId(self, row):
+        """id записи в строке row"""
+        values = self._row(row)
+        return values[0] if values else None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole, Qt.BackgroundRole):
+            return None
+        values = self._row(index.row())
+        if not values:
+            return None
+        key = (values[0], COLUMNS[index.column()])
+        if role == Qt.BackgroundRole:
+            return PENDING_BRUSH if key in self._pending else None
+        if key in self._pending:
+            value = self._pending[key]
+            if role == Qt.DisplayRole and isinstance(value, float):
+                return f"{value:.10g}"
+            return value
+        value = values[index.column()]
+        if COLUMNS[index.column()] == "image_path" and values[_IMAGE_HASH]:
+            # Изображение из хранилища показывается готовой миниатюрой
+            return str(imageStore().thumbnailPath(values[_IMAGE_HASH]))
+        if role == Qt.DisplayRole and isinstance(value, float):
+            # 895.0 -> "895", 0.25 -> "0.25"
+            return f"{value:.10g}"
+        return value
+
+    def setData(self, index, value, role=Qt.EditRole):
+        """Сохраняет измененное значение ячейки в БД, в пакетном режиме - в очередь правок"""
+        if not index.isValid() or role != Qt.EditRole or index.column() == 0:
+            return False
+        values = self._row(index.row())
+        if values is None:
+            return False
+        column = COLUMNS[index.column()]
+        if column == "weight":
+            value = parseWeight(value)
+        elif column == "max_distance":
+            value = parseDistance(value)
+        if column in RANGE_COLUMNS and value is None:
+            return False
+        if column in RELATIONS and not self.lookups.contains(RELATIONS[column][1], value):
+            return False
+        if column == "image_path":
+            if values[_IMAGE_HASH] and value == str(imageStore().thumbnailPath(values[_IMAGE_HASH])):
+                # Значение не менялось: в ячейке показан путь к миниатюре
+                return True
+            value = value or None
+        if self._batch:
+            self._queue(index, values, column, value)
+            return True
+        if column == "image_path":
+            return self._setImage(index, values, value)
+        if execPrepared(self._updateSql(column), (value, values[0])) is None:
+            return False
+        values[index.column()] = value
+        if self._matchIds is None and any(field == column for field, _ in self._keys):
+            # Запись переходит на место по новому ключу: строки между прежней и новой
+            # позицией сдвигаются, страницы и границы с первой из них перечитываются
+            condition, params = self._matchCondition()
+            moved = self._rowsBefore(values[0], condition, params, index.row())
+            first, last = sorted((index.row(), moved))
+            self._invalidateFrom(first)
+            self.dataChanged.emit(
+                self.index(first, 0), self.index(last, len(COLUMNS) - 1), [Qt.DisplayRole, Qt.EditRole]
+            )
+            return True
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
+
+    @staticmethod
+    def _updateSql(column):
+        """Запрос изменения столбца записи; параметры - значение и id"""
+        if column == "image_path":
+            return "UPDATE data SET image_hash = ?, image_path = NULL WHERE id = ?"
+        if column in RELATIONS:
+            # Название заменяется ссылкой на существующую запись справочника
+            foreignKey, table = RELATIONS[column]
+            return f"UPDATE data SET {foreignKey} = (SELECT id FROM {table} WHERE name = ?) WHERE id = ?"
+        return f"UPDATE data SET {column} = ? WHERE id = ?"
+
+    def _setImage(self, index, values, path):
+        """Заменяет изображение записи файлом path (None - убрать изображение)"""
+        digest = imageStore().ingest(path) if path else None
+        if path and digest is None:
+            return False
+        if execPrepared(self._updateSql("image_path"), (digest, values[0])) is None:
+            return False
+        values[index.column()] = None
+        values[_IMAGE_HASH] = digest
+        # Прежнее изображение могло остаться без ссылок
+        imageStore().collectGarbage()
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
+
+    def _queue(self, index, values, column, value):
+        """Ставит правку в очередь; правка, возвращающая сохраненное значение, из очереди убирается"""
+        key = (values[0], column)
+        if column == "image_path":
+            unchanged = value is None and not (values[_IMAGE_HASH] or values[index.column()])
+        else:
+            unchanged = value == values[index.column()]
+        if unchanged:
+            self._pending.pop(key, None)
+        else:
+            self._pending[key] = value
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole, Qt.BackgroundRole])
+        self.pendingChanged.emit(len(self._pending))
+
+    def isBatchMode(self):
+        return self._batch
+
+    def setBatchMode(self, enabled):
+        """Включает или выключает пакетный режим; при выключении очередь записывается
+
+        Возвращает False, если очередь записать не удалось (режим остается включенным).
+        """
+        if not enabled and not self.commitBatch():
+            return False
+        self._batch = enabled
+        return True
+
+    def pendingCount(self):
+        """Количество несохраненных правок"""
+        return len(self._pending)
+
+    def commitBatch(self):
+        """Записывает очередь правок одной транзакцией
+
+        При ошибке транзакция откатывается, а очередь сохраняется. Новые
+        изображения копируются в хранилище до начала транзакции.
+        """
+        if not self._pending:
+            return True
+        digests = {}
+        for (rowId, column), value in self._pending.items():
+            if column == "image_path" and value and value not in digests:
+                digests[value] = imageStore().ingest(value)
+                if digests[value] is None:
+                    print("Image store error: cannot read", value)
+                    return False
+
+        db = QSqlDatabase.database()
+        db.transaction()
+        # Правки одного столбца идут подряд и используют один подготовленный запрос
+        for (rowId, column), value in sorted(self._pending.items(), key=lambda item: item[0][1]):
+            if column == "image_path":
+                value = digests.get(value)
+            if execPrepared(self._updateSql(column), (value, rowId)) is None:
+                db.rollback()
+                return False
+        if not db.commit():
+            db.rollback()
+            return False
+
+        images = any(column == "image_path" for _, column in self._pending)
+        resorted = {field for field, _ in self._keys} & {column for _, column in self._pending}
+        self._pending.clear()
+        # Страницы перечитываются с записанными значениями; границы страниц
+        # остаются прежними, если не менялись столбцы сортировки
+        self._pages.clear()
+        if resorted:
+            self._anchors = {0: None}
+        self._emitAllChanged()
+        self.pendingChanged.emit(0)
+        if images:
+            imageStore().collectGarbage()
+        return True
+
+    def rollbackBatch(self):
+        """Отбрасывает очередь правок"""
+        if not self._pending:
+            return
+        self._pending.clear()
+        self._emitAllChanged()
+        self.pendingChanged.emit(0)
+
+    def _emitAllChanged(self):
+        count = self.rowCount()
+        if count:
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(count - 1, len(COLUMNS) - 1),
+                [Qt.DisplayRole, Qt.EditRole, Qt.BackgroundRole],
+            )
+
+    def _prunePending(self):
+        """Убирает из очереди правки удаленных записей"""
+        for rowId in {rowId for rowId, _ in self._pending}:
+            query = execPrepared("SELECT 1 FROM data WHERE id = ?", (rowId,))
+            if query is not None and not query.next():
+                for key in [key for key in self._pending if key[0] == rowId]:
+                    del self._pending[key]
+        self.pendingChanged.emit(len(self._pending))
+
+    def relationNames(self, column):
+        """Названия из справочника для столбца-ссылки (для выбора в редакторе)"""
+        _, table = RELATIONS[COLUMNS[column]]
+        return self.lookups.names(table)
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() != 0:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and 0 <= section < len(self._headers):
+            if len(self._sortOrder) > 1:
+                # При сортировке по нескольким столбцам у заголовка - номер ключа
+                for number, (column, order) in enumerate(self._sortOrder, 1):
+                    if column == section:
+                        return f"{self._headers[section]} {'▼' if order == Qt.DescendingOrder else '▲'}{number}"
+            return self._headers[section]
+        return super().headerData(section, orientation, role)
+
+    def setHeaderData(self, section, orientation, value, role=Qt.EditRole):
+        if orientation != Qt.Horizontal or not 0 <= section < len(self._headers):
+            return False
+        self._headers[section] = value
+        self.headerDataChanged.emit(orientation, section, section)
+        return True
+
 
 class ContactsModel:
     def __init__(self):
+        # Справочники и запись данных - через общий слой доступа поверх подключения Qt
+        self.repository = DroneRepository(QtSqlBackend())
         self.model = self._createModel()
+        self.model.lookups = LookupCache(self.repository.names)
+        # Фоновые выборки (startBackgroundQueries); без них все запросы синхронные
+        self.queries = None
 
     @staticmethod
     def _createModel():
         """Создание и настройка модели"""
-        tableModel = QSqlTableModel()
-        tableModel.setTable("data")
-        tableModel.setEditStrategy(QSqlTableModel.OnFieldChange)
-        tableModel.select()
-        headers = ("ID", "Модель", "Вес (г)", "Производитель", "Макс. дистанция (м)", "Изображение")
-        for columnIndex, header in enumerate(headers):
-            tableModel.setHeaderData(columnIndex, Qt.Horizontal, header)
+        tableModel = DronesTableModel()
+        # Окно показывается с первой страницей, COUNT выполняется после отрисовки
+        tableModel.select(deferCount=True)
         return tableModel
 
-    def _generate_hash(self, data):
-        """Генерирование числового хэша из полей данных (нужно для присваивания ID)"""
-        combined = "".join(str(field) for field in data)
-        return abs(hash(combined)) % (10 ** 4)  # 8-digit numeric hash
-
     def addData(self, data):
         """Добавляет данные с изображением"""
-        hash_id = self._generate_hash(data)
-        rows = self.model.rowCount()
-        self.model.insertRows(rows, 1)
-
-        # Устанавливаем значения для всех полей
-        self.model.setData(self.model.index(rows, 0), hash_id)  # ID
-        self.model.setData(self.model.index(rows, 1), data[0])  # model_name
-        self.model.setData(self.model.index(rows, 2), data[1])  # weight
-        self.model.setData(self.model.index(rows, 3), data[2])  # manufacture
-        self.model.setData(self.model.index(rows, 4), data[3])  # max_distance
-
-        # Сохраняем путь к изображению (5-й столбец)
-        if len(data) > 4 and data[4]:
-            self.model.setData(self.model.index(rows, 5), data[4])  # image_path
-
-        if not self.model.submitAll():
-            print("SQL Error:", self.model.lastError().text())
-        self.model.select()
+        # Изображение (5-й столбец) необязательно и копируется в хранилище
+        imagePath = data[4] if len(data) > 4 and data[4] else None
+        imageHash = imageStore().ingest(imagePath) if imagePath else None
+        # Недостающие модель и производитель создаются вместе с записью,
+        # id выдает счетчик AUTOINCREMENT - без коллизий и повторов
+        try:
+            rowId = self.repository.insert({
+                "model_name": data[0],
+                "weight": parseWeight(data[1]),  # г
+                "manufacture": data[2],
+                "max_distance": parseDistance(data[3]),  # м
+                # Путь сохраняется, только если файл не удалось добавить в хранилище
+                "image_path": None if imageHash else imagePath,
+                "image_hash": imageHash,
+            })
+        except RepositoryError as e:
+            print("SQL Error:", e)
+            return
+        self.model.lookups.add("model", data[0])
+        self.model.lookups.add("manufacture", data[2])
+        self.model.recordInserted(rowId)
 
     def _store_image(self, row, image_path):
-        """Сохраняет изображение в БД"""
+        """Сохраняет изображение записи в хранилище изображений"""
         if os.path.exists(image_path):
-            # Вариант 1: Сохраняем путь к файлу
-            self.model.setData(self.model.index(row, 6), image_path)
-
-            # Вариант 2: Сохраняем бинарные данные (раскомментировать)
-             #with open(image_path, 'rb') as f:
-                # image_data = f.read()
-             #self.model.setData(self.model.index(row, 5), image_data)
+            return self.model.setData(self.model.index(row, COLUMNS.index("image_path")), image_path)
+        return False
 
     def getManufacturers(self):
-        """Получение списка производителей"""
-        query = QSqlQuery()
-        query.exec("SELECT name FROM manufacture")
-        manufacturers = []
-        while query.next():
-            manufacturers.append(query.value(0))
-        return manufacturers
+        """Получение списка производителей (из кэша)"""
+        return self.model.lookups.names("manufacture")
 
     def getModels(self):
-        """Получение списка моделей"""
-        query = QSqlQuery()
-        query.exec("SELECT name FROM model")
-        models = []
-        while query.next():
-            models.append(query.value(0))
-        return models
+        """Получение списка моделей (из кэша)"""
+        return self.model.lookups.names("model")
+
+    def hasManufacturer(self, name):
+        return self.model.lookups.contains("manufacture", name)
+
+    def hasModel(self, name):
+        return self.model.lookups.contains("model", name)
 
     def addManufacturer(self, name, country):
         """Добавление нового производителя"""
-        query = QSqlQuery()
-        query.prepare("INSERT INTO manufacture (name, country) VALUES (?, ?)")
-        query.addBindValue(name)
-        query.addBindValue(country)
-        return query.exec()
+        if not self.repository.addManufacturer(name, country):
+            return False
+        self.model.lookups.add("manufacture", name)
+        return True
 
     def addModel(self, name):
         """Добавление новой модели"""
-        query = QSqlQuery()
-        query.prepare("INSERT INTO model (name) VALUES (?)")
-        query.addBindValue(name)
-        return query.exec()
+        if not self.repository.addModel(name):
+            return False
+        self.model.lookups.add("model", name)
+        return True
+
+    def invalidateLookups(self):
+        """Сбрасывает кэш справочников после изменений в обход модели"""
+        self.model.lookups.invalidate()
 
     def deleteData(self, row):
         """Удаление выбранных данных из бд"""
         self.model.removeRow(row)
-        self.model.submitAll()
-        self.model.select()
 
     def clearData(self):
-        """Удаление всех данных из бд"."""
-        self.model.setEditStrategy(QSqlTableModel.OnManualSubmit)
-        self.model.removeRows(0, self.model.rowCount())
-        self.model.submitAll()
-        self.model.setEditStrategy(QSqlTableModel.OnFieldChange)
-        self.model.select()
-
-    # Добавляем в класс ContactsModel новый метод
+        """Удаление всех данных текущей выборки из бд"""
+        self.model.removeRows(0, self.model.totalRowCount())
+
+    def exportData(self, path, fileFormat=None, progress=None):
+        """Потоково выгружает текущую выборку (поиск и фильтры) в файл; возвращает ExportResult"""
+        from .export import exportRecords
+
+        # Выражение MATCH при повторном разборе buildMatchExpression не меняется
+        expression, ranges = self.model.activeFilter()
+        records = self.repository.search(expression, ranges, sort=self.model.activeSort())
+        return exportRecords(records, path, fileFormat, self.model.totalRowCount(), progress)
+
+    def findDuplicates(self, weightTolerance, distanceTolerance, progress=None):
+        """Группы повторяющихся записей (см. dedup.findDuplicates)"""
+        from .dedup import findDuplicates
+
+        return findDuplicates(self.repository, weightTolerance, distanceTolerance, progress)
+
+    def mergeDuplicates(self, merges):
+        """Объединяет повторяющиеся записи [(id остающейся, [id объединяемых])] одной транзакцией
+
+        Возвращает количество удаленных записей или None при ошибке.
+        """
+        from .dedup import mergeDuplicates
+
+        try:
+            deleted = mergeDuplicates(self.repository, merges)
+        except RepositoryError as e:
+            print("SQL Error:", e)
+            return None
+        if self.model.pendingCount():
+            self.model._prunePending()
+        self._select()
+        # Изображения удаленных записей могли остаться без ссылок
+        imageStore().collectGarbage()
+        return deleted
+
+    def startBackgroundQueries(self):
+        """Переносит поиск, подсчет строк и загрузку справочников в фоновый поток"""
+        from .worker import BackgroundQueries
+
+        self.queries = BackgroundQueries(QSqlDatabase.database().databaseName())
+        self.model.lookups.prefetch(self.queries)
+        return self.queries
+
+    def stopBackgroundQueries(self):
+        if self.queries is not None:
+            self.queries.stop()
+
+    def _select(self):
+        if self.queries is not None:
+            self.model.selectInBackground(self.queries)
+        else:
+            self.model.select()
+
+    def countRows(self):
+        """Досчитывает строки выборки, показанной по первой странице"""
+        if self.queries is not None:
+            self.model.requestCount(self.queries)
+        else:
+            self.model.fetchCount()
+
+    def suggest(self, search_text, callback):
+        """Передает в callback варианты исправления текста поиска ("возможно, вы имели в виду")"""
+        task = partial(suggestCorrections, text=search_text)
+        if self.queries is not None:
+            self.queries.submit("suggest", task, callback)
+            return
+        try:
+            callback(task(QueryContext()))
+        except QueryError as e:
+            print("SQL Error:", e)
+
     def searchData(self, search_text):
-        """Поиск по всем полям"""
-        self.model.setFilter(f"""
-            model_name LIKE '%{search_text}%' OR
-            weight LIKE '%{search_text}%' OR
-            manufactorer LIKE '%{search_text}%' OR
-            max_distance LIKE '%{search_text}%'
-        """)
-        self.model.select()
\ No newline at end of file
+        """Поиск по всем полям через полнотекстовый индекс (пустой текст - без поиска)"""
+        self.model.setMatchExpression(buildMatchExpression(search_text))
+        self._select()
+
+    def sortData(self, column, append=False):
+        """Сортировка по столбцу; повторный выбор главного столбца меняет направление
+
+        append=True добавляет столбец к текущей сортировке (или меняет его
+        направление, если он уже в ней есть).
+        """
+        if not self.model.isSortable(column):
+            return
+        sortOrder = self.model.sortOrder()
+        orders = dict(sortOrder)
+        flipped = Qt.AscendingOrder if orders.get(column) == Qt.DescendingOrder else Qt.DescendingOrder
+        if append and column in orders:
+            sortOrder = [(sortColumn, flipped if sortColumn == column else order) for sortColumn, order in sortOrder]
+        elif append:
+            sortOrder.append((column, Qt.AscendingOrder))
+        elif sortOrder and sortOrder[0][0] == column:
+            sortOrder = [(column, flipped)]
+        else:
+            sortOrder = [(column, Qt.AscendingOrder)]
+        self.model.setSortOrder(sortOrder)
+        self._select()
+
+    def setRangeFilter(self, column, low=None, high=None):
+        """Фильтр числового столбца по диапазону; применяется при следующем поиске"""
+        self.model.setRangeFilter(column, low, high)
+
+    def resetSearch(self):
+        """Сброс поиска и фильтров"""
+        self.model.clearFilters()
+        self._select()
\ No newline at end of file
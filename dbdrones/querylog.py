@@ -0,0 +1,243 @@
+
+
+"""Этот модуль ведет журнал выполнения SQL-запросов для диагностики производительности"""
+
+import json
+import threading
+import time
+from collections import deque
+
+from PyQt5.QtSql import QSqlDatabase, QSqlQuery
+
+# Запрос медленнее этого порога (с) считается медленным, для него сохраняется план
+SLOW_QUERY_SECONDS = 0.05
+# Сколько последних выполнений хранить в журнале
+MAX_ENTRIES = 2000
+
+
+def _shortValue(value, limit=80):
+    """Значение параметра для журнала: длинные строки обрезаются"""
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} байт>"
+    text = value if isinstance(value, (int, float)) or value is None else str(value)
+    if isinstance(text, str) and len(text) > limit:
+        return text[:limit] + "..."
+    return text
+
+
+class QueryEntry:
+    """Одно выполнение запроса"""
+
+    def __init__(self, sql, params, connectionName=None):
+        self.sql = sql
+        self.params = params
+        # Подключение, на котором выполнялся запрос (None - по умолчанию)
+        self.connectionName = connectionName
+        self.started = time.time()
+        self.duration = 0.0
+        self.rows = 0
+        self.error = None
+        self.finished = False
+
+    def toDict(self):
+        return {
+            "sql": self.sql,
+            "params": [_shortValue(value) for value in self.params],
+            "started": self.started,
+            "duration": self.duration,
+            "rows": self.rows,
+            "error": self.error,
+        }
+
+
+class QueryLog:
+    """Журнал запросов: последние выполнения и сводка по каждому тексту запроса
+
+    В журнал пишут и фоновые выборки (worker), поэтому сводка меняется под блокировкой.
+    План медленного запроса снимается уже после нее, на подключении вызывающего
+    потока: EXPLAIN не задерживает запросы других потоков.
+    """
+
+    def __init__(self, slowThreshold=SLOW_QUERY_SECONDS, maxEntries=MAX_ENTRIES):
+        self.slowThreshold = slowThreshold
+        self.enabled = True
+        self.entries = deque(maxlen=maxEntries)
+        self.stats = {}
+        self._lock = threading.Lock()
+        # Тексты запросов, план которых сейчас снимается
+        self._planning = set()
+
+    def begin(self, sql, params, connectionName=None):
+        entry = QueryEntry(sql, params, connectionName)
+        if self.enabled:
+            self.entries.append(entry)
+        return entry
+
+    def finish(self, entry):
+        """Учитывает завершенное выполнение в сводке и снимает план медленного запроса"""
+        if entry.finished:
+            return
+        entry.finished = True
+        if not self.enabled:
+            return
+        with self._lock:
+            needsPlan = self._record(entry)
+        if not needsPlan:
+            return
+        plan = explainQueryPlan(entry.sql, entry.params, entry.connectionName)
+        with self._lock:
+            self._planning.discard(entry.sql)
+            stat = self.stats.get(entry.sql)
+            # Сводку могли очистить, пока снимался план
+            if stat is not None and stat["plan"] is None:
+                stat["plan"] = plan
+
+    def _record(self, entry):
+        """Учитывает выполнение в сводке; True - для запроса нужно снять план"""
+        stat = self.stats.get(entry.sql)
+        if stat is None:
+            stat = self.stats[entry.sql] = {
+                "sql": entry.sql,
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "rows": 0,
+                "slow": 0,
+                "errors": 0,
+                "lastParams": [],
+                "plan": None,
+            }
+        stat["count"] += 1
+        stat["total"] += entry.duration
+        stat["rows"] += entry.rows
+        stat["errors"] += entry.error is not None
+        if entry.duration >= stat["max"]:
+            stat["max"] = entry.duration
+            stat["lastParams"] = [_shortValue(value) for value in entry.params]
+        if entry.duration >= self.slowThreshold and entry.error is None:
+            stat["slow"] += 1
+            if stat["plan"] is None and entry.sql not in self._planning:
+                self._planning.add(entry.sql)
+                return True
+        return False
+
+    def slowest(self, limit=20):
+        """Запросы с наибольшим суммарным временем, начиная с медленных"""
+        with self._lock:
+            stats = list(self.stats.values())
+        return sorted(
+            stats, key=lambda stat: (stat["slow"] > 0, stat["total"]), reverse=True
+        )[:limit]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.stats.clear()
+
+    def toDict(self, limit=50):
+        return {
+            "slowThreshold": self.slowThreshold,
+            "slowest": [
+                dict(stat, avg=stat["total"] / stat["count"] if stat["count"] else 0.0)
+                for stat in self.slowest(limit)
+            ],
+            "recent": [entry.toDict() for entry in list(self.entries)[-limit:]],
+        }
+
+    def exportJson(self, path, limit=50):
+        """Сохраняет сводку и последние выполнения в JSON"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.toDict(limit), f, indent=2, ensure_ascii=False)
+
+
+# Общий журнал приложения
+queryLog = QueryLog()
+
+
+def explainQueryPlan(sql, params, connectionName=None):
+    """План выполнения запроса (EXPLAIN QUERY PLAN) в виде списка строк"""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+        return []
+    query = QSqlQuery() if connectionName is None else QSqlQuery(QSqlDatabase.database(connectionName))
+    query.setForwardOnly(True)
+    if not query.prepare(f"EXPLAIN QUERY PLAN {sql}"):
+        return []
+    for position, value in enumerate(params):
+        query.bindValue(position, value)
+    if not query.exec():
+        return []
+    plan = []
+    while query.next():
+        plan.append(query.value(3))
+    return plan
+
+
+class InstrumentedQuery(QSqlQuery):
+    """QSqlQuery, который записывает каждое выполнение в queryLog
+
+    Время включает выполнение и выборку строк: для SELECT запись завершается,
+    когда строки закончились, при finish() или при следующем выполнении.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Запрос к другому подключению (фоновый поток) объясняется на нем же
+        self._connectionName = args[0].connectionName() if args and isinstance(args[0], QSqlDatabase) else None
+        self._sql = ""
+        self._params = {}
+        self._entry = None
+
+    def prepare(self, sql):
+        self._sql = sql
+        self._params = {}
+        return super().prepare(sql)
+
+    def bindValue(self, position, value, *args):
+        self._params[position] = value
+        super().bindValue(position, value, *args)
+
+    def addBindValue(self, value, *args):
+        self._params[len(self._params)] = value
+        super().addBindValue(value, *args)
+
+    def _finishEntry(self):
+        if self._entry is not None:
+            queryLog.finish(self._entry)
+            self._entry = None
+
+    def exec(self, *args):
+        self._finishEntry()
+        sql = args[0] if args else self._sql
+        params = [] if args else [self._params[key] for key in sorted(self._params)]
+        entry = queryLog.begin(sql, params, self._connectionName)
+        started = time.perf_counter()
+        ok = super().exec(*args)
+        entry.duration = time.perf_counter() - started
+        if not ok:
+            entry.error = self.lastError().text()
+        if ok and self.isSelect():
+            self._entry = entry
+        else:
+            entry.rows = max(self.numRowsAffected(), 0) if ok else 0
+            queryLog.finish(entry)
+        if not args:
+            self._params = {}
+        return ok
+
+    exec_ = exec
+
+    def next(self):
+        if self._entry is None:
+            return super().next()
+        started = time.perf_counter()
+        ok = super().next()
+        self._entry.duration += time.perf_counter() - started
+        if ok:
+            self._entry.rows += 1
+        else:
+            self._finishEntry()
+        return ok
+
+    def finish(self):
+        self._finishEntry()
+        super().finish()
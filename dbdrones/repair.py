@@ -0,0 +1,109 @@
+
+
+"""Этот модуль проверяет и исправляет идентификаторы записей о дронах и сводные таблицы"""
+
+import argparse
+import sys
+
+from .database import (
+    DATABASE_NAME,
+    coreApplication,
+    execPrepared,
+    migrationRejects,
+    openConnection,
+    rebuildStatistics,
+    rekeyData,
+    verifyStatistics,
+)
+
+
+def checkIds():
+    """Сводка по id таблицы data и счетчику AUTOINCREMENT"""
+    query = execPrepared(
+        "SELECT COUNT(*), MIN(id), MAX(id), "
+        "(SELECT seq FROM sqlite_sequence WHERE name = 'data') FROM data"
+    )
+    if query is None or not query.next():
+        return None
+    report = {
+        "count": query.value(0),
+        "minId": query.value(1) or 0,
+        "maxId": query.value(2) or 0,
+        "sequence": query.value(3) or 0,
+    }
+    query.finish()
+    # Плотная нумерация: id занимают ровно 1..count
+    report["dense"] = report["count"] == 0 or (
+        report["minId"] == 1 and report["maxId"] == report["count"]
+    )
+    return report
+
+
+def repairSequence():
+    """Сдвигает счетчик AUTOINCREMENT так, чтобы он был не меньше наибольшего id"""
+    return execPrepared(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX(id), 0) FROM data)) "
+        "WHERE name = 'data'"
+    ) is not None
+
+
+def main(argv=None):
+    """Проверка и исправление: python -m dbdrones.repair [--db БД] [--rekey] [--rebuild-stats] [--gc-images] [--rejects]"""
+    parser = argparse.ArgumentParser(description="Проверка и исправление id записей")
+    parser.add_argument("--db", default=DATABASE_NAME, help="файл базы данных SQLite")
+    parser.add_argument("--rekey", action="store_true", help="перенумеровать записи подряд с 1")
+    parser.add_argument(
+        "--rebuild-stats", action="store_true", help="пересчитать сводки по моделям и производителям"
+    )
+    parser.add_argument(
+        "--gc-images", action="store_true", help="удалить изображения хранилища без ссылок из записей"
+    )
+    parser.add_argument(
+        "--rejects", action="store_true", help="показать значения, не распознанные при обновлении БД"
+    )
+    args = parser.parse_args(argv)
+
+    coreApplication()
+    error = openConnection(args.db)
+    if error is not None:
+        print(error, file=sys.stderr)
+        return 1
+
+    report = checkIds()
+    print(f"До: {report}")
+    if not repairSequence():
+        return 1
+    if args.rekey:
+        count = rekeyData()
+        if count is None:
+            print("Не удалось перенумеровать записи", file=sys.stderr)
+            return 1
+        print(f"Перенумеровано записей: {count}")
+    print(f"После: {checkIds()}")
+    if args.rebuild_stats:
+        mismatches = verifyStatistics()
+        if mismatches is None:
+            return 1
+        for table, group, found, expected in mismatches[:10]:
+            print(f"{table} [{group}]: {found} != {expected}")
+        print(f"Расхождений в сводках: {len(mismatches)}")
+        if not rebuildStatistics() or verifyStatistics() != []:
+            print("Не удалось пересчитать сводки", file=sys.stderr)
+            return 1
+        print("Сводки пересчитаны и совпадают с данными")
+    if args.gc_images:
+        from .imagestore import imageStore
+
+        print(f"Удалено изображений без ссылок: {imageStore().collectGarbage()}")
+    if args.rejects:
+        rejects = migrationRejects()
+        if rejects is None:
+            return 1
+        for rowId, field, value in rejects:
+            print(f"id {rowId} {field}: {value!r}")
+        print(f"Нераспознанных значений: {len(rejects)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
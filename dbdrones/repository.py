@@ -0,0 +1,429 @@
+
+
+"""Этот модуль предоставляет доступ к данным о дронах без Qt
+
+Запросы к той же схеме, что и у приложения. Без Qt работает через
+стандартный модуль sqlite3, поэтому подходит для скриптов и заданий cron
+на серверах без дисплея; приложение использует те же запросы через свое
+подключение QtSql. Выборки возвращают генераторы: строки читаются из
+курсора порциями по мере перебора, а не загружаются целиком.
+"""
+
+import re
+import sqlite3
+from contextlib import contextmanager
+from itertools import islice
+
+# Единый файл базы данных приложения
+DATABASE_NAME = "drones.sqlite"
+
+# Настройки SQLite, применяемые при каждом подключении
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -32 * 1024),  # в КиБ, ~32 МБ
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "ON"),
+)
+
+# Версия схемы, которую ожидает код; миграции - в database.MIGRATIONS
+SCHEMA_VERSION = 9
+
+# Сколько строк читается из курсора за один раз
+FETCH_SIZE = 500
+
+# Поля записи, которые возвращают выборки
+FIELDS = (
+    "id", "uid", "model_name", "weight", "manufacture", "country",
+    "max_distance", "image_path", "image_hash",
+)
+# Числовые поля, по которым возможна фильтрация диапазоном
+RANGE_FIELDS = ("weight", "max_distance")
+# Справочники: таблица -> поле записи с названием
+LOOKUP_TABLES = {"model": "model_name", "manufacture": "manufacture"}
+# Поля, по которым возможна сортировка: поле -> выражение SQL
+SORT_FIELDS = {
+    "id": "data.id",
+    "model_name": "model.name",
+    "weight": "data.weight",
+    "manufacture": "manufacture.name",
+    "max_distance": "data.max_distance",
+}
+
+# Таблицы журнала изменений change_log: таблица -> (поле-ключ строки, поля значений).
+# Ключ не зависит от id, которые в копиях БД назначаются независимо
+CHANGE_LOG_TABLES = {
+    "model": ("name", ("name",)),
+    "manufacture": ("name", ("name", "country")),
+    "data": ("uid", ("uid", "model_name", "weight", "manufacture", "max_distance", "image_path", "image_hash")),
+}
+
+# Сколько кандидатов на исправление берется из индекса триграмм каждого справочника
+SUGGEST_CANDIDATES = 50
+# Наименьшее сходство слов, при котором слово считается опечаткой другого
+SIMILARITY_THRESHOLD = 0.3
+
+# Токенизатор trigram для индекса названий есть в SQLite начиная с 3.34; со
+# старой версией индекс не создается и варианты исправления не предлагаются
+TRIGRAM_SQLITE_VERSION = (3, 34, 0)
+HAS_TRIGRAM_INDEX_SQL = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'model_trigram'"
+
+# Кандидаты на исправление: названия моделей и производителей с общими триграммами
+SUGGEST_SQL = (
+    "SELECT name FROM (SELECT name FROM model_trigram WHERE model_trigram MATCH ? ORDER BY rank LIMIT ?) "
+    "UNION ALL "
+    "SELECT name FROM (SELECT name FROM manufacture_trigram WHERE manufacture_trigram MATCH ? ORDER BY rank LIMIT ?)"
+)
+
+_SELECT_RECORDS = (
+    "SELECT data.id, data.uid, model.name, data.weight, manufacture.name, manufacture.country, "
+    "data.max_distance, data.image_path, data.image_hash "
+    "FROM data "
+    "JOIN model ON model.id = data.model_id "
+    "JOIN manufacture ON manufacture.id = data.manufacture_id"
+)
+
+
+def buildMatchExpression(search_text):
+    """Преобразует введенный текст в выражение MATCH для FTS5
+
+    Каждое слово экранируется и ищется по префиксу, слова объединяются через AND.
+    Возвращает пустую строку, если в тексте нет ни одного слова.
+    """
+    terms = re.findall(r"\w+", search_text)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def trigrams(word):
+    """Триграммы слова с границами: "DJI" -> {"  d", " dj", "dji", "ji "}"""
+    padded = f"  {word.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(first, second):
+    """Сходство слов от 0 до 1: доля общих триграмм"""
+    first, second = trigrams(first), trigrams(second)
+    return len(first & second) / len(first | second)
+
+
+def buildTrigramExpression(search_text):
+    """Выражение MATCH для индекса триграмм: любая триграмма слов текста
+
+    Возвращает пустую строку, если в тексте нет слов длиннее двух букв.
+    """
+    words = re.findall(r"\w+", search_text.lower())
+    grams = sorted({word[i:i + 3] for word in words for i in range(len(word) - 2)})
+    return " OR ".join(f'"{gram}"' for gram in grams)
+
+
+def rankSuggestions(search_text, names, limit=5):
+    """Варианты исправления текста поиска по названиям-кандидатам, лучшие первыми
+
+    Первым идет текст, в котором каждое слово с опечаткой заменено самым
+    похожим словом из названий, за ним - сами названия по убыванию сходства.
+    Слово, с которого начинается какое-либо слово названий, опечаткой не считается.
+    """
+    words = re.findall(r"\w+", search_text)
+    vocabulary = {word for name in names for word in re.findall(r"\w+", name)}
+    scores = {}
+
+    def wordScore(word, candidate):
+        key = (word, candidate)
+        if key not in scores:
+            prefix = candidate.lower().startswith(word.lower())
+            scores[key] = 1.0 if prefix else similarity(word, candidate)
+        return scores[key]
+
+    corrected = []
+    for word in words:
+        best = max(sorted(vocabulary), key=lambda candidate: wordScore(word, candidate), default=None)
+        score = wordScore(word, best) if best is not None else 0.0
+        # Короткие слова и слова, найденные по префиксу, не исправляются
+        typo = len(word) >= 3 and SIMILARITY_THRESHOLD <= score < 1.0
+        corrected.append(best if typo else word)
+
+    ranked = []
+    for name in set(names):
+        nameWords = re.findall(r"\w+", name)
+        score = sum(max((wordScore(word, candidate) for candidate in nameWords), default=0.0) for word in words)
+        ranked.append((-score / max(len(words), 1), name))
+    ranked.sort()
+
+    suggestions = [" ".join(corrected)] if corrected != words else []
+    for score, name in ranked:
+        if -score < SIMILARITY_THRESHOLD or len(suggestions) >= limit:
+            break
+        if name.lower() not in (suggestion.lower() for suggestion in suggestions):
+            suggestions.append(name)
+    return suggestions
+
+
+def sortKeys(sort):
+    """Полный порядок сортировки [(поле, по убыванию)] с ключами, делающими его однозначным
+
+    После названия модели или производителя идет вес: порядок внутри группы
+    берется из индекса (группа, вес). Последний ключ - id. Добавленные ключи
+    идут в направлении последнего заданного, чтобы весь порядок был обходом
+    индекса в одну сторону.
+    """
+    keys, seen = [], set()
+    for field, descending in sort:
+        if field not in SORT_FIELDS:
+            raise ValueError(f"Сортировка не поддерживается для {field}")
+        if field not in seen:
+            keys.append((field, descending))
+            seen.add(field)
+        if field == "id":
+            return keys
+    descending = keys[-1][1] if keys else False
+    if keys and keys[-1][0] in LOOKUP_TABLES.values() and "weight" not in seen:
+        keys.append(("weight", descending))
+    keys.append(("id", descending))
+    return keys
+
+
+def orderBy(keys):
+    """ORDER BY для порядка [(поле, по убыванию)]"""
+    return ", ".join(f"{SORT_FIELDS[field]} DESC" if descending else SORT_FIELDS[field] for field, descending in keys)
+
+
+class RepositoryError(Exception):
+    """Ошибка выполнения запроса"""
+
+
+class SchemaVersionError(RepositoryError):
+    """Схема БД не совпадает с версией, которую ожидает код"""
+
+
+class SqliteBackend:
+    """Выполнение запросов через модуль sqlite3
+
+    Не используйте его в процессе, где та же БД открыта через QtSql: Qt
+    содержит свою копию SQLite, а две копии библиотеки в одном процессе не
+    согласуют блокировки файла. Для приложения есть database.QtSqlBackend.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        # Автофиксация: транзакции открываются явно через transaction()
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        for name, value in PRAGMAS:
+            self.connection.execute(f"PRAGMA {name} = {value}")
+
+    def rows(self, sql, params=(), fetchSize=FETCH_SIZE):
+        """Генератор строк; курсор закрывается, когда перебор окончен или прерван"""
+        try:
+            cursor = self.connection.execute(sql, params)
+        except sqlite3.Error as e:
+            raise RepositoryError(str(e)) from e
+        try:
+            while True:
+                rows = cursor.fetchmany(fetchSize)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def execute(self, sql, params=()):
+        """Выполняет изменяющий запрос; возвращает (id последней вставки, число строк)"""
+        try:
+            cursor = self.connection.execute(sql, params)
+        except sqlite3.Error as e:
+            raise RepositoryError(str(e)) from e
+        return cursor.lastrowid, cursor.rowcount
+
+    def begin(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self.connection.execute("COMMIT")
+
+    def rollback(self):
+        self.connection.execute("ROLLBACK")
+
+    def close(self):
+        self.connection.close()
+
+
+class DroneRepository:
+    """Записи о дронах, модели и производители
+
+    source - путь к файлу БД (запросы через sqlite3) или готовый объект
+    выполнения запросов с теми же методами, что у SqliteBackend.
+    """
+
+    def __init__(self, source=DATABASE_NAME, timeout=5.0):
+        self.backend = SqliteBackend(source, timeout) if isinstance(source, str) else source
+        version = self.schemaVersion()
+        if version != SCHEMA_VERSION:
+            self.backend.close()
+            raise SchemaVersionError(f"{source}: версия схемы {version}, ожидается {SCHEMA_VERSION}")
+
+    def close(self):
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _value(self, sql, params=()):
+        for row in self.backend.rows(sql, params):
+            return row[0]
+        return None
+
+    def schemaVersion(self):
+        return self._value("PRAGMA user_version")
+
+    @contextmanager
+    def transaction(self):
+        """Выполняет блок одной транзакцией; при исключении изменения откатываются"""
+        self.backend.begin()
+        try:
+            yield self
+        except BaseException:
+            self.backend.rollback()
+            raise
+        self.backend.commit()
+
+    @staticmethod
+    def _filter(text="", ranges=None):
+        """Условие WHERE для поиска по тексту и диапазонам, его параметры и признак поиска"""
+        conditions, params = [], []
+        expression = buildMatchExpression(text) if text else ""
+        if expression:
+            conditions.append("data_fts MATCH ?")
+            params.append(expression)
+        for field, (low, high) in (ranges or {}).items():
+            if field not in RANGE_FIELDS:
+                raise ValueError(f"Фильтр по диапазону не поддерживается для {field}")
+            if low is not None:
+                conditions.append(f"data.{field} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"data.{field} <= ?")
+                params.append(high)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params, bool(expression)
+
+    def count(self, text="", ranges=None):
+        """Количество записей, подходящих под поиск и фильтры"""
+        where, params, matching = self._filter(text, ranges)
+        source = "data_fts JOIN data ON data.id = data_fts.rowid" if matching else "data"
+        return self._value(f"SELECT COUNT(*) FROM {source}{where}", params)
+
+    def search(self, text="", ranges=None, limit=None, fetchSize=FETCH_SIZE, sort=None):
+        """Записи (словари FIELDS) по поиску и фильтрам
+
+        sort - порядок [(поле, по убыванию)] по полям SORT_FIELDS. Без него при
+        поиске по тексту записи упорядочены по релевантности, иначе по id.
+        """
+        where, params, matching = self._filter(text, ranges)
+        sql = _SELECT_RECORDS
+        if matching:
+            sql += " JOIN data_fts ON data_fts.rowid = data.id"
+        if sort:
+            sql += f"{where} ORDER BY {orderBy(sortKeys(sort))}"
+        else:
+            sql += where + (" ORDER BY data_fts.rank" if matching else " ORDER BY data.id")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for row in self.backend.rows(sql, params, fetchSize):
+            yield dict(zip(FIELDS, row))
+
+    def suggest(self, text, limit=5):
+        """Варианты исправления текста поиска по названиям моделей и производителей"""
+        expression = buildTrigramExpression(text)
+        if not expression or not self._value(HAS_TRIGRAM_INDEX_SQL):
+            return []
+        params = (expression, SUGGEST_CANDIDATES, expression, SUGGEST_CANDIDATES)
+        return rankSuggestions(text, [row[0] for row in self.backend.rows(SUGGEST_SQL, params)], limit)
+
+    def get(self, rowId):
+        """Запись по id или None"""
+        for row in self.backend.rows(f"{_SELECT_RECORDS} WHERE data.id = ?", (rowId,)):
+            return dict(zip(FIELDS, row))
+        return None
+
+    def records(self, ids, chunkSize=FETCH_SIZE):
+        """Записи по списку id (порциями по chunkSize id); отсутствующие id пропускаются"""
+        ids = iter(ids)
+        while True:
+            chunk = list(islice(ids, chunkSize))
+            if not chunk:
+                return
+            # Порция дополняется NULL до chunkSize, чтобы запрос был один и тот же
+            for row in self.backend.rows(
+                f"{_SELECT_RECORDS} WHERE data.id IN ({', '.join('?' * chunkSize)})",
+                chunk + [None] * (chunkSize - len(chunk)),
+            ):
+                yield dict(zip(FIELDS, row))
+
+    def names(self, table):
+        """Названия из справочника model или manufacture по алфавиту"""
+        if table not in LOOKUP_TABLES:
+            raise ValueError(f"Неизвестный справочник {table}")
+        return [row[0] for row in self.backend.rows(f"SELECT name FROM {table} ORDER BY name")]
+
+    def addModel(self, name):
+        """Добавляет модель; False - если такая уже есть"""
+        _, count = self.backend.execute("INSERT OR IGNORE INTO model (name) VALUES (?)", (name,))
+        return count > 0
+
+    def addManufacturer(self, name, country):
+        """Добавляет производителя; False - если такой уже есть"""
+        _, count = self.backend.execute(
+            "INSERT OR IGNORE INTO manufacture (name, country) VALUES (?, ?)", (name, country)
+        )
+        return count > 0
+
+    def _insert(self, record):
+        self.backend.execute("INSERT OR IGNORE INTO model (name) VALUES (?)", (record["model_name"],))
+        self.backend.execute(
+            "INSERT OR IGNORE INTO manufacture (name, country) VALUES (?, ?)",
+            (record["manufacture"], record.get("country") or ""),
+        )
+        rowId, _ = self.backend.execute(
+            "INSERT INTO data (model_id, weight, manufacture_id, max_distance, image_path, image_hash, uid) "
+            "VALUES ((SELECT id FROM model WHERE name = ?), ?, "
+            "(SELECT id FROM manufacture WHERE name = ?), ?, ?, ?, "
+            "COALESCE(?, lower(hex(randomblob(16)))))",
+            (
+                record["model_name"],
+                record["weight"],
+                record["manufacture"],
+                record["max_distance"],
+                record.get("image_path") or None,
+                record.get("image_hash"),
+                record.get("uid") or None,
+            ),
+        )
+        return rowId
+
+    def insert(self, record):
+        """Добавляет запись (словарь с полями FIELDS, вес в граммах, дистанция в метрах)
+
+        Недостающие модель и производитель создаются. Возвращает id записи.
+        """
+        with self.transaction():
+            return self._insert(record)
+
+    def insertMany(self, records):
+        """Добавляет записи одной транзакцией и возвращает их количество"""
+        count = 0
+        with self.transaction():
+            for record in records:
+                self._insert(record)
+                count += 1
+        return count
+
+    def delete(self, ids):
+        """Удаляет записи по id одной транзакцией и возвращает количество удаленных"""
+        deleted = 0
+        with self.transaction():
+            for rowId in ids:
+                deleted += self.backend.execute("DELETE FROM data WHERE id = ?", (rowId,))[1]
+        return deleted
@@ -0,0 +1,28 @@
+
+
+"""Этот модуль замеряет фазы запуска приложения
+
+Время отсчитывается от импорта модуля. Если задана переменная окружения
+DBDRONES_STARTUP_TIMINGS, каждая фаза сразу печатается в stderr.
+"""
+
+import os
+import sys
+import time
+
+_started = time.perf_counter()
+# Фазы запуска по порядку: (название, секунд от старта)
+phases = []
+
+
+def mark(name):
+    """Отмечает окончание фазы запуска"""
+    elapsed = time.perf_counter() - _started
+    phases.append((name, elapsed))
+    if os.environ.get("DBDRONES_STARTUP_TIMINGS"):
+        print(f"startup: {name} {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+
+def timings():
+    """Фазы запуска в виде словаря название -> секунд от старта"""
+    return dict(phases)
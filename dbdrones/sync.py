@@ -0,0 +1,337 @@
+"""Этот модуль переносит изменения между копиями БД по журналу change_log
+
+Триггеры (database._migrateChangeLog) записывают в change_log каждое
+добавление, изменение и удаление в data, model и manufacture с возрастающим
+номером seq. Строки определяются не по id (в каждой копии свои счетчики), а
+по uid записи и названию модели или производителя. exportChanges пишет
+изменения после номера since в файл JSONL, applyChanges проигрывает их в
+другой копии порциями по транзакции: время зависит от числа изменений, а не
+от размера таблиц.
+
+Изменение применяется, только если строка получателя совпадает с ее
+состоянием в источнике до изменения (для изменения - только в измененных
+полях). Иначе это конфликт: он пропускается и попадает в отчет, а с force
+строка получает версию источника. Номер последнего примененного изменения
+каждой копии хранится в sync_peer, поэтому повторное применение того же
+файла ничего не меняет. Изменения, которые сделала сама копия-получатель и
+которые вернулись к ней через другую копию, пропускаются.
+
+Файлы изображений не переносятся: если изображения нет в хранилище
+получателя, запись сохраняется без него.
+"""
+
+import json
+from itertools import islice
+
+from .repository import CHANGE_LOG_TABLES
+
+# Первая строка файла изменений
+CHANGES_FORMAT = "dbdrones-changes"
+CHANGES_VERSION = 1
+# Сколько изменений применяется одной транзакцией
+APPLY_BATCH = 1000
+
+# Поля записи data, которые хранятся как ссылка на справочник: поле -> (столбец, таблица)
+_LOOKUP_COLUMNS = {"model_name": ("model_id", "model"), "manufacture": ("manufacture_id", "manufacture")}
+
+# Текущие значения строки по ключу; столбцы - в порядке CHANGE_LOG_TABLES
+_CURRENT_SQL = {
+    "model": "SELECT name FROM model WHERE name = ?",
+    "manufacture": "SELECT name, country FROM manufacture WHERE name = ?",
+    "data": (
+        "SELECT data.uid, model.name, data.weight, manufacture.name, data.max_distance, "
+        "data.image_path, data.image_hash "
+        "FROM data "
+        "JOIN model ON model.id = data.model_id "
+        "JOIN manufacture ON manufacture.id = data.manufacture_id "
+        "WHERE data.uid = ?"
+    ),
+}
+# Строки справочника, на которые ссылаются записи, удалить нельзя
+_IN_USE_SQL = {
+    "model": "SELECT 1 FROM data WHERE model_id = (SELECT id FROM model WHERE name = ?) LIMIT 1",
+    "manufacture": "SELECT 1 FROM data WHERE manufacture_id = (SELECT id FROM manufacture WHERE name = ?) LIMIT 1",
+}
+
+
+class SyncError(Exception):
+    """Файл изменений не подходит для применения"""
+
+
+def siteId(repository):
+    """Идентификатор этой копии БД"""
+    return repository._value("SELECT site FROM sync_site")
+
+
+def lastSeq(repository):
+    """Номер последнего изменения в журнале (0 - журнал пуст)"""
+    return repository._value("SELECT COALESCE(MAX(seq), 0) FROM change_log")
+
+
+def journalStatus(repository):
+    """Идентификатор копии, размер журнала и номера примененных изменений других копий"""
+    first, last, count = next(repository.backend.rows("SELECT MIN(seq), MAX(seq), COUNT(*) FROM change_log"))
+    return {
+        "site": siteId(repository),
+        "firstSeq": first or 0,
+        "lastSeq": last or 0,
+        "changes": count,
+        "peers": dict(repository.backend.rows("SELECT site, seq FROM sync_peer ORDER BY site")),
+    }
+
+
+def pruneChanges(repository, upTo):
+    """Удаляет из журнала изменения с номером не больше upTo и возвращает их количество
+
+    Номера новых изменений продолжаются с прежнего: seq не переиспользуется.
+    """
+    with repository.transaction():
+        return repository.backend.execute("DELETE FROM change_log WHERE seq <= ?", (upTo,))[1]
+
+
+def renewSite(repository):
+    """Дает копии БД новый идентификатор и возвращает его
+
+    Нужен после копирования файла на другой узел: копия уже содержит все
+    изменения исходной БД, поэтому они отмечаются в sync_peer как примененные.
+    Изменения журнала без origin сделаны в исходной БД и получают ее
+    идентификатор, иначе исходная БД приняла бы их за изменения копии.
+    """
+    with repository.transaction():
+        previous = siteId(repository)
+        repository.backend.execute("UPDATE change_log SET origin = ? WHERE origin IS NULL", (previous,))
+        repository.backend.execute(
+            "INSERT INTO sync_peer (site, seq) VALUES (?, (SELECT COALESCE(MAX(seq), 0) FROM change_log)) "
+            "ON CONFLICT (site) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+            (previous,),
+        )
+        repository.backend.execute("UPDATE sync_site SET site = lower(hex(randomblob(16)))")
+        return siteId(repository)
+
+
+def exportChanges(repository, output, since=0, limit=None):
+    """Пишет в output (текстовый файл) изменения с номером больше since
+
+    limit ограничивает количество изменений в файле: следующий файл
+    начинается с последнего номера. Возвращает (количество, последний номер).
+    """
+    site = siteId(repository)
+    output.write(json.dumps({"format": CHANGES_FORMAT, "version": CHANGES_VERSION, "site": site, "since": since}))
+    output.write("\n")
+    sql = "SELECT seq, table_name, op, row_key, old, new, COALESCE(origin, ?) FROM change_log WHERE seq > ? ORDER BY seq"
+    params = [site, since]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    count, last = 0, since
+    for seq, table, op, key, old, new, origin in repository.backend.rows(sql, params):
+        # Значения уже хранятся в журнале как JSON и вставляются в строку без разбора
+        output.write(
+            f'{{"seq": {seq}, "table": {json.dumps(table)}, "op": {json.dumps(op)}, '
+            f'"key": {json.dumps(key, ensure_ascii=False)}, "old": {old or "null"}, "new": {new or "null"}, '
+            f'"origin": {json.dumps(origin)}}}\n'
+        )
+        count, last = count + 1, seq
+    return count, last
+
+
+def readChanges(lines):
+    """Заголовок файла изменений и генератор изменений (словари) из строк файла"""
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError) as e:
+        raise SyncError("не файл изменений: нет заголовка") from e
+    if not isinstance(header, dict) or header.get("format") != CHANGES_FORMAT:
+        raise SyncError("не файл изменений: неизвестный формат")
+    if header.get("version") != CHANGES_VERSION:
+        raise SyncError(f"версия файла изменений {header.get('version')}, поддерживается {CHANGES_VERSION}")
+
+    def changes():
+        for number, line in enumerate(lines, 2):
+            if not line.strip():
+                continue
+            try:
+                change = json.loads(line)
+            except ValueError as e:
+                raise SyncError(f"строка {number}: {e}") from e
+            if change.get("table") not in CHANGE_LOG_TABLES or change.get("op") not in ("insert", "update", "delete"):
+                raise SyncError(f"строка {number}: неизвестное изменение")
+            yield change
+
+    return header, changes()
+
+
+class _Applier:
+    """Применение изменений одной копии к БД repository"""
+
+    def __init__(self, repository, force):
+        self.repository = repository
+        self.backend = repository.backend
+        self.force = force
+        self.images = {}
+        self.missingImages = set()
+        self.local = None
+
+    def current(self, table, key):
+        for row in self.backend.rows(_CURRENT_SQL[table], (key,)):
+            return dict(zip(CHANGE_LOG_TABLES[table][1], row))
+        return None
+
+    def hasImage(self, digest):
+        if digest not in self.images:
+            self.images[digest] = any(True for _ in self.backend.rows("SELECT 1 FROM image WHERE hash = ?", (digest,)))
+        return self.images[digest]
+
+    def same(self, table, field, local, remote):
+        """Значения поля совпадают; изображение, которого нет у получателя, совпадает с пустым"""
+        if local == remote:
+            return True
+        return table == "data" and field == "image_hash" and local is None and not self.hasImage(remote)
+
+    def matches(self, table, local, values, fields):
+        return all(self.same(table, field, local[field], values[field]) for field in fields)
+
+    def values(self, table, values):
+        """Значения для записи в БД: изображения, которого нет в хранилище, запись не получает"""
+        digest = values.get("image_hash") if table == "data" else None
+        if digest is not None and not self.hasImage(digest):
+            self.missingImages.add(digest)
+            values = dict(values, image_hash=None)
+        return values
+
+    def insert(self, table, values):
+        values = self.values(table, values)
+        if table == "data":
+            self.repository._insert(dict(values, country=None))
+        else:
+            fields = CHANGE_LOG_TABLES[table][1]
+            self.backend.execute(
+                f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                [values[field] for field in fields],
+            )
+
+    def update(self, table, key, values):
+        values = self.values(table, values)
+        assignments, params = [], []
+        for field, value in values.items():
+            if table == "data" and field in _LOOKUP_COLUMNS:
+                column, lookup = _LOOKUP_COLUMNS[field]
+                # Справочники обычно уже получили свои изменения раньше по журналу
+                self.backend.execute(
+                    "INSERT OR IGNORE INTO manufacture (name, country) VALUES (?, '')" if lookup == "manufacture"
+                    else "INSERT OR IGNORE INTO model (name) VALUES (?)",
+                    (value,),
+                )
+                assignments.append(f"{column} = (SELECT id FROM {lookup} WHERE name = ?)")
+            else:
+                assignments.append(f"{field} = ?")
+            params.append(value)
+        keyField = CHANGE_LOG_TABLES[table][0]
+        self.backend.execute(f"UPDATE {table} SET {', '.join(assignments)} WHERE {keyField} = ?", params + [key])
+
+    def delete(self, table, key):
+        keyField = CHANGE_LOG_TABLES[table][0]
+        self.backend.execute(f"DELETE FROM {table} WHERE {keyField} = ?", (key,))
+
+    def apply(self, change):
+        """Применяет изменение; возвращает None, "skipped" или причину конфликта"""
+        table, op, key, old, new = change["table"], change["op"], change["key"], change["old"], change["new"]
+        fields = CHANGE_LOG_TABLES[table][1]
+        keyField = CHANGE_LOG_TABLES[table][0]
+        # Строка получателя до изменения - для отчета о конфликте
+        local = self.local = self.current(table, key)
+        if op == "insert":
+            if local is None:
+                self.insert(table, new)
+                return None
+            if self.matches(table, local, new, fields):
+                return "skipped"
+            if self.force:
+                self.update(table, key, {field: new[field] for field in fields if local[field] != new[field]})
+            return "exists"
+        if op == "update":
+            changed = [field for field in fields if old[field] != new[field]]
+            if local is None:
+                renamed = new[keyField] != key and self.current(table, new[keyField])
+                if renamed and self.matches(table, renamed, new, fields):
+                    return "skipped"
+                if self.force and not renamed:
+                    self.insert(table, new)
+                return "missing"
+            if self.matches(table, local, new, changed):
+                return "skipped"
+            if new[keyField] != key and self.current(table, new[keyField]) is not None:
+                return "exists"
+            conflict = not self.matches(table, local, old, changed)
+            if not conflict or self.force:
+                self.update(table, key, {field: new[field] for field in changed})
+            return "changed" if conflict else None
+        # delete
+        if local is None:
+            return "skipped"
+        if table in _IN_USE_SQL and any(True for _ in self.backend.rows(_IN_USE_SQL[table], (key,))):
+            return "in use"
+        conflict = not self.matches(table, local, old, fields)
+        if not conflict or self.force:
+            self.delete(table, key)
+        return "changed" if conflict else None
+
+
+def applyChanges(repository, lines, batchSize=APPLY_BATCH, force=False):
+    """Применяет файл изменений (строки) к БД repository
+
+    Каждая порция из batchSize изменений - отдельная транзакция, в которой
+    сохраняется и номер последнего примененного изменения копии-источника;
+    прерванное применение продолжается с него. Конфликтные изменения не
+    применяются (с force - применяются поверх изменений получателя) и
+    возвращаются в отчете. Результат: словарь со счетчиками applied,
+    skipped, conflicts (список), missingImages, site и seq источника.
+    """
+    header, changes = readChanges(lines)
+    local = siteId(repository)
+    source = header.get("site")
+    if not source:
+        raise SyncError("в заголовке файла изменений нет идентификатора копии")
+    if source == local:
+        raise SyncError(
+            "файл изменений создан этой же копией БД (или ее копией без нового идентификатора: "
+            "python -m dbdrones journal --new-site)"
+        )
+    watermark = repository._value("SELECT seq FROM sync_peer WHERE site = ?", (source,)) or 0
+    applier = _Applier(repository, force)
+    result = {"site": source, "seq": watermark, "applied": 0, "skipped": 0, "conflicts": []}
+    while True:
+        batch = list(islice(changes, batchSize))
+        if not batch:
+            break
+        last = batch[-1]["seq"]
+        if last <= watermark:
+            result["skipped"] += len(batch)
+            continue
+        with repository.transaction():
+            origin = None
+            for change in batch:
+                # Уже примененные изменения и свои изменения, вернувшиеся через другую копию
+                if change["seq"] <= watermark or change["origin"] == local:
+                    result["skipped"] += 1
+                    continue
+                if change["origin"] != origin:
+                    origin = change["origin"]
+                    repository.backend.execute("UPDATE sync_site SET applying = ?", (origin,))
+                outcome = applier.apply(change)
+                if outcome is None:
+                    result["applied"] += 1
+                elif outcome == "skipped":
+                    result["skipped"] += 1
+                else:
+                    result["conflicts"].append(dict(change, reason=outcome, local=applier.local))
+            repository.backend.execute("UPDATE sync_site SET applying = NULL")
+            repository.backend.execute(
+                "INSERT INTO sync_peer (site, seq) VALUES (?, ?) "
+                "ON CONFLICT (site) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+                (source, last),
+            )
+        watermark = result["seq"] = max(watermark, last)
+    result["missingImages"] = len(applier.missingImages)
+    return result
@@ -0,0 +1,58 @@
+
+
+"""Этот модуль приводит вес и дистанцию к единым единицам измерения"""
+
+import re
+
+# Множители к граммам
+WEIGHT_UNITS = {
+    "": 1.0,
+    "g": 1.0,
+    "г": 1.0,
+    "гр": 1.0,
+    "mg": 0.001,
+    "мг": 0.001,
+    "kg": 1000.0,
+    "кг": 1000.0,
+    "lb": 453.59237,
+    "lbs": 453.59237,
+    "oz": 28.349523125,
+}
+
+# Множители к метрам
+DISTANCE_UNITS = {
+    "": 1.0,
+    "m": 1.0,
+    "м": 1.0,
+    "km": 1000.0,
+    "км": 1000.0,
+    "mi": 1609.344,
+    "ft": 0.3048,
+}
+
+_QUANTITY = re.compile(r"^\s*([-+]?\d+(?:[.,]\d+)?)\s*([^\W\d_]*)\.?\s*$")
+
+
+def parseQuantity(value, units):
+    """Переводит значение вида "0,25 кг" в базовую единицу; None - если разобрать не удалось"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if value is None:
+        return None
+    match = _QUANTITY.match(str(value))
+    if match is None:
+        return None
+    factor = units.get(match.group(2).lower())
+    if factor is None:
+        return None
+    return float(match.group(1).replace(",", ".")) * factor
+
+
+def parseWeight(value):
+    """Вес в граммах"""
+    return parseQuantity(value, WEIGHT_UNITS)
+
+
+def parseDistance(value):
+    """Дистанция в метрах"""
+    return parseQuantity(value, DISTANCE_UNITS)
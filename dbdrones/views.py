@@ -3,13 +3,14 @@
 """Этот модуль предоставляет управление таблицей"""
 
 
-from PyQt5.QtCore import Qt
+import html
+import os
+
+from PyQt5.QtCore import Qt, QEvent, QTimer
 from PyQt5.QtWidgets import (
     QStyledItemDelegate,
     QAbstractItemView,
     QDialog,
-    QDialogButtonBox,
-    QFormLayout,
     QHBoxLayout,
     QLineEdit,
     QMainWindow,
@@ -20,12 +21,25 @@ from PyQt5.QtWidgets import (
     QWidget,
     QHeaderView,
     QSizePolicy,
-
+    QProgressDialog,
+    QApplication,
 )
+from . import startup
 from .model import ContactsModel
-from PyQt5.QtWidgets import QComboBox, QInputDialog
+from .units import parseDistance, parseWeight
+from .images import AsyncThumbnailLoader, ThumbnailCache
+from PyQt5.QtWidgets import QComboBox
 from PyQt5.QtWidgets import QFileDialog, QLabel, QVBoxLayout
-from PyQt5.QtGui import QPixmap
+
+# Задержка перед запуском поиска после последнего нажатия клавиши (мс)
+SEARCH_DEBOUNCE_MS = 250
+# Сколько строк измеряется при подборе ширины столбцов
+COLUMN_SAMPLE_ROWS = 100
+# Наибольшая автоматическая ширина столбца (пикс.)
+MAX_COLUMN_WIDTH = 400
+# Отступы текста в ячейке (пикс.)
+CELL_PADDING = 12
+
 
 class Window(QMainWindow):
     """Главное окно приложения для управления базой данных дронов"""
@@ -46,8 +60,13 @@ class Window(QMainWindow):
         self.mainLayout.setContentsMargins(0, 0, 0, 0)
         self.mainLayout.setSpacing(0)
 
-        # Инициализация модели данных
+        # Инициализация модели данных; поиск и подсчет строк идут в фоновом потоке
         self.contactsModel = ContactsModel()
+        queries = self.contactsModel.startBackgroundQueries()
+        queries.busyChanged.connect(self.showBusy)
+        self.contactsModel.model.countReady.connect(lambda count: startup.mark("rows_counted"))
+        # Панель статистики создается при первом открытии
+        self.statisticsPanel = None
 
         # Настройка интерфейса
         self.setupUI()
@@ -80,8 +99,16 @@ class Window(QMainWindow):
         # Политика размеров - растягивание по обоим направлениям
         self.table.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 
-        # Первоначальное масштабирование столбцов
-        self.table.resizeColumnsToContents()
+        # Первоначальное масштабирование столбцов по выборке строк
+        self.columnSizer = ColumnSizer(self.table, fixedWidths={5: 200})
+        self.columnSizer.resizeAll()
+
+        # Сортировка щелчком по заголовку выполняется в SQL (не через setSortingEnabled)
+        header = self.table.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.setToolTip("Щелчок - сортировка по столбцу, Shift+щелчок - добавить столбец к сортировке")
+        header.sectionClicked.connect(self.sortData)
+        self.showSortOrder()
 
         # ===== ПАНЕЛЬ КНОПОК =====
         # Контейнер для кнопок с фиксированной шириной
@@ -93,12 +120,77 @@ class Window(QMainWindow):
         buttonsLayout.setSpacing(10)
         buttonsLayout.setAlignment(Qt.AlignTop)
 
+        # Поле поиска: запрос выполняется после паузы в наборе текста
+        self.searchField = QLineEdit()
+        self.searchField.setPlaceholderText("Поиск...")
+        self.searchField.setClearButtonEnabled(True)
+        self.searchField.setFixedHeight(30)
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.searchTimer.timeout.connect(self.searchData)
+        self.searchField.textChanged.connect(self.searchTimer.start)
+        buttonsLayout.addWidget(self.searchField)
+
+        # Варианты исправления, если поиск ничего не нашел
+        self.suggestions = []
+        self.suggestionLabel = QLabel()
+        self.suggestionLabel.setWordWrap(True)
+        self.suggestionLabel.setTextFormat(Qt.RichText)
+        self.suggestionLabel.linkActivated.connect(self.applySuggestion)
+        self.suggestionLabel.hide()
+        self.searchField.textChanged.connect(self.suggestionLabel.hide)
+        self.contactsModel.model.modelReset.connect(self.suggestCorrections)
+        buttonsLayout.addWidget(self.suggestionLabel)
+
+        # Фильтры по диапазону: значения можно вводить с единицами ("5 км", "0,25 кг")
+        self.rangeFields = {}
+        for column, title, parse in (
+            ("weight", "Вес (г):", parseWeight),
+            ("max_distance", "Дистанция (м):", parseDistance),
+        ):
+            lowField = QLineEdit()
+            lowField.setPlaceholderText("от")
+            highField = QLineEdit()
+            highField.setPlaceholderText("до")
+            rangeLayout = QHBoxLayout()
+            rangeLayout.addWidget(lowField)
+            rangeLayout.addWidget(highField)
+            for field in (lowField, highField):
+                field.textChanged.connect(self.searchTimer.start)
+            self.rangeFields[column] = (lowField, highField, parse)
+            buttonsLayout.addWidget(QLabel(title))
+            buttonsLayout.addLayout(rangeLayout)
+
+        # Пакетная правка: изменения ячеек копятся и записываются одной транзакцией
+        self.batchButton = QPushButton("Пакетная правка")
+        self.batchButton.setCheckable(True)
+        self.batchButton.setFixedHeight(40)
+        self.batchButton.toggled.connect(self.setBatchMode)
+        buttonsLayout.addWidget(self.batchButton)
+        self.pendingLabel = QLabel()
+        self.applyButton = QPushButton("Применить")
+        self.applyButton.clicked.connect(self.commitBatch)
+        self.discardButton = QPushButton("Отменить")
+        self.discardButton.clicked.connect(self.contactsModel.model.rollbackBatch)
+        batchLayout = QHBoxLayout()
+        batchLayout.addWidget(self.applyButton)
+        batchLayout.addWidget(self.discardButton)
+        buttonsLayout.addWidget(self.pendingLabel)
+        buttonsLayout.addLayout(batchLayout)
+        self.contactsModel.model.pendingChanged.connect(self.showPending)
+        self.showPending(0)
+
         # Список кнопок
         buttons = [
             ("Добавить...", self.openAddDialog),
+            ("Импорт...", self.importData),
+            ("Экспорт...", self.exportData),
+            ("Статистика", self.toggleStatistics),
+            ("Повторы...", self.openDuplicates),
+            ("Диагностика...", self.openDiagnostics),
             ("Удалить", self.deleteData),
             ("Очистить все", self.clearData),
-            ("Поиск", self.searchData),
             ("Сбросить поиск", self.resetSearch)
         ]
 
@@ -110,7 +202,7 @@ class Window(QMainWindow):
             buttonsLayout.addWidget(btn)
 
         # Добавляем растягивающееся пространство между кнопками
-        buttonsLayout.insertStretch(2)
+        buttonsLayout.insertStretch(buttonsLayout.count() - 2)
 
         # ===== РАСПОЛОЖЕНИЕ ЭЛЕМЕНТОВ =====
         # Добавляем таблицу и панель кнопок в главный макет
@@ -123,18 +215,184 @@ class Window(QMainWindow):
         # Устанавливаем фокус на таблицу
         self.table.setFocus()
 
-    def resizeEvent(self, event):
-        """Обработчик изменения размера окна"""
-        super().resizeEvent(event)
-        # При изменении размера обновляем таблицу
-        self.table.resizeColumnsToContents()
+        # Полное количество строк считается после первой отрисовки
+        self.table.viewport().installEventFilter(self)
+
+    def showPending(self, count):
+        """Обновляет счетчик несохраненных правок и доступность кнопок пакета"""
+        batch = self.contactsModel.model.isBatchMode()
+        self.pendingLabel.setVisible(batch)
+        self.pendingLabel.setText(f"Несохраненных правок: {count}")
+        for button in (self.applyButton, self.discardButton):
+            button.setVisible(batch)
+            button.setEnabled(count > 0)
+
+    def setBatchMode(self, enabled):
+        """Включает пакетную правку; при выключении предлагает сохранить правки"""
+        model = self.contactsModel.model
+        if not enabled and model.pendingCount():
+            answer = QMessageBox.question(
+                self,
+                "Пакетная правка",
+                f"Сохранить несохраненные правки ({model.pendingCount()})?",
+                QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel,
+            )
+            if answer == QMessageBox.Cancel:
+                # Повторное включение режима очередь не трогает
+                self.batchButton.setChecked(True)
+                return
+            if answer == QMessageBox.Discard:
+                model.rollbackBatch()
+        if not model.setBatchMode(enabled):
+            QMessageBox.warning(self, "Ошибка", "Не удалось сохранить правки, они остались в очереди")
+            self.batchButton.setChecked(True)
+        self.showPending(model.pendingCount())
+
+    def commitBatch(self):
+        """Записывает очередь правок одной транзакцией"""
+        if not self.contactsModel.model.commitBatch():
+            QMessageBox.warning(self, "Ошибка", "Не удалось сохранить правки, они остались в очереди")
+
+    def closeEvent(self, event):
+        """Перед закрытием предлагает сохранить правки пакетного режима"""
+        model = self.contactsModel.model
+        if model.pendingCount():
+            answer = QMessageBox.question(
+                self,
+                "Пакетная правка",
+                f"Сохранить несохраненные правки ({model.pendingCount()})?",
+                QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel,
+            )
+            if answer == QMessageBox.Cancel or (answer == QMessageBox.Save and not model.commitBatch()):
+                event.ignore()
+                return
+        self.contactsModel.stopBackgroundQueries()
+        super().closeEvent(event)
+
+    def eventFilter(self, watched, event):
+        """Отмечает первую отрисовку таблицы и запускает дозагрузку"""
+        if event.type() == QEvent.Paint and watched is self.table.viewport():
+            watched.removeEventFilter(self)
+            startup.mark("first_paint")
+            QTimer.singleShot(0, self.finishLoading)
+        return super().eventFilter(watched, event)
+
+    def finishLoading(self):
+        """Досчитывает строки таблицы, показанной по первой странице"""
+        self.contactsModel.countRows()
+
+    def showBusy(self, busy):
+        """Курсор ожидания над таблицей, пока выполняются фоновые выборки"""
+        if busy:
+            self.table.viewport().setCursor(Qt.BusyCursor)
+        else:
+            self.table.viewport().unsetCursor()
 
     def openAddDialog(self):
         """Открытие диалогового окна (Добавить)"""
+        from .dialogs import AddDialog
+
         dialog = AddDialog(self)  # Передаем self как родителя
         if dialog.exec() == QDialog.Accepted:
+            # Ширина столбцов подстроится под новую строку через ColumnSizer
             self.contactsModel.addData(dialog.data)
-            self.table.resizeColumnsToContents()
+
+    def importData(self):
+        """Массовый импорт записей из файла"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Выберите файл для импорта",
+            "",
+            "Data Files (*.csv *.json *.jsonl *.ndjson)"
+        )
+        if not file_path:
+            return
+
+        from .importer import DroneImporter, ImportFileError
+
+        progress = QProgressDialog("Импорт записей...", "Отмена", 0, 1000, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+
+        def report(processed, fraction, rate):
+            progress.setValue(int(fraction * 1000))
+            progress.setLabelText(f"Обработано: {processed} ({rate:.0f} записей/с)")
+            return not progress.wasCanceled()
+
+        try:
+            result = DroneImporter(progress=report).importFile(file_path)
+        except (OSError, ImportFileError) as e:
+            progress.close()
+            QMessageBox.warning(self, "Ошибка", f"Не удалось импортировать файл: {e}")
+            return
+        progress.close()
+
+        # Импорт мог добавить модели и производителей
+        self.contactsModel.invalidateLookups()
+        self.contactsModel.model.select()
+        details = "\n".join(f"{line}: {message}" for line, message in result.errors[:10])
+        QMessageBox.information(self, "Импорт", "\n\n".join(filter(None, [result.summary(), details])))
+
+    def exportData(self):
+        """Выгрузка записей, показанных в таблице, с учетом поиска и фильтров"""
+        file_path, selected = QFileDialog.getSaveFileName(
+            self,
+            "Сохранить выборку",
+            "",
+            "CSV (*.csv);;JSON Lines (*.jsonl);;Parquet (*.parquet)"
+        )
+        if not file_path:
+            return
+
+        from .export import EXPORT_FORMATS, ExportError
+        from .repository import RepositoryError
+
+        # Без расширения формат берется из выбранного фильтра
+        if os.path.splitext(file_path)[1].lower() not in EXPORT_FORMATS:
+            file_path += selected[selected.rindex("*") + 1:-1]
+
+        progress = QProgressDialog("Экспорт записей...", "Отмена", 0, 1000, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+
+        def report(exported, fraction, rate):
+            progress.setValue(int((fraction or 0) * 1000))
+            progress.setLabelText(f"Выгружено: {exported} ({rate:.0f} записей/с)")
+            return not progress.wasCanceled()
+
+        try:
+            result = self.contactsModel.exportData(file_path, progress=report)
+        except (OSError, ExportError, RepositoryError) as e:
+            progress.close()
+            QMessageBox.warning(self, "Ошибка", f"Не удалось выгрузить данные: {e}")
+            return
+        progress.close()
+        QMessageBox.information(self, "Экспорт", result.summary())
+
+    def toggleStatistics(self):
+        """Показывает или скрывает панель сводки по производителям и моделям"""
+        if self.statisticsPanel is None:
+            from .dialogs import StatisticsPanel
+
+            self.statisticsPanel = StatisticsPanel(self.contactsModel.model, self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.statisticsPanel)
+            self.statisticsPanel.refresh()
+            return
+        self.statisticsPanel.setVisible(not self.statisticsPanel.isVisible())
+
+    def openDuplicates(self):
+        """Поиск и объединение повторяющихся записей"""
+        from .dialogs import DuplicatesDialog
+
+        DuplicatesDialog(self.contactsModel, self).exec()
+
+    def openDiagnostics(self):
+        """Окно со статистикой выполнения SQL-запросов"""
+        from .dialogs import DiagnosticsDialog
+
+        dialog = DiagnosticsDialog(self)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
 
     def deleteData(self):
         """Удаление выбранной позиции из бд"""
@@ -165,276 +423,223 @@ class Window(QMainWindow):
             self.contactsModel.clearData()
 
     def searchData(self):
-        """Открытие диалогового окна (Поиск)"""
-        dialog = SearchDialog(self)
-        if dialog.exec() == QDialog.Accepted:
-            self.contactsModel.searchData(dialog.search_text)
+        """Поиск по тексту из поля поиска с учетом фильтров по диапазону"""
+        for column, (lowField, highField, parse) in self.rangeFields.items():
+            bounds = []
+            for field in (lowField, highField):
+                text = field.text().strip()
+                value = parse(text) if text else None
+                # Неразобранное значение подсвечивается и не участвует в фильтре
+                field.setStyleSheet("border: 1px solid red;" if text and value is None else "")
+                bounds.append(value)
+            self.contactsModel.setRangeFilter(column, *bounds)
+        self.contactsModel.searchData(self.searchField.text().strip())
+
+    def suggestCorrections(self):
+        """Если поиск ничего не нашел, предлагает варианты исправления текста"""
+        text = self.searchField.text().strip()
+        if not text or not self.contactsModel.model.activeFilter()[0] or self.contactsModel.model.rowCount():
+            self.suggestionLabel.hide()
+            return
+        self.contactsModel.suggest(text, self.showSuggestions)
 
-        # Добавляем кнопку сброса поиска
-        self.resetSearchButton = QPushButton("Сброс поиска")
-        self.resetSearchButton.clicked.connect(self.resetSearch)
+    def showSuggestions(self, suggestions):
+        self.suggestions = suggestions
+        if not suggestions:
+            self.suggestionLabel.hide()
+            return
+        links = ", ".join(
+            f'<a href="{number}">{html.escape(suggestion)}</a>' for number, suggestion in enumerate(suggestions)
+        )
+        self.suggestionLabel.setText(f"Возможно, вы имели в виду: {links}")
+        self.suggestionLabel.show()
+
+    def applySuggestion(self, link):
+        """Ищет по выбранному варианту исправления"""
+        self.searchField.setText(self.suggestions[int(link)])
+        self.searchTimer.stop()
+        self.searchData()
+
+    def sortData(self, column):
+        """Сортировка по столбцу заголовка; с Shift - дополнительный ключ сортировки"""
+        append = bool(QApplication.keyboardModifiers() & Qt.ShiftModifier)
+        self.contactsModel.sortData(column, append)
+        self.showSortOrder()
+
+    def showSortOrder(self):
+        """Стрелка в заголовке главного столбца; при нескольких ключах номера показывает модель"""
+        header = self.table.horizontalHeader()
+        sortOrder = self.contactsModel.model.sortOrder()
+        header.setSortIndicatorShown(len(sortOrder) == 1)
+        if len(sortOrder) == 1:
+            header.setSortIndicator(*sortOrder[0])
 
     def resetSearch(self):
-        """Сброс поиска"""
-        self.contactsModel.model.setFilter("")
-        self.contactsModel.model.select()
+        """Сброс поиска и фильтров"""
+        self.searchTimer.stop()
+        for field in [self.searchField] + [
+            field for lowField, highField, _ in self.rangeFields.values() for field in (lowField, highField)
+        ]:
+            field.blockSignals(True)
+            field.clear()
+            field.setStyleSheet("")
+            field.blockSignals(False)
+        self.contactsModel.resetSearch()
 
 
 from PyQt5.QtCore import Qt, QSize  # Добавляем QSize в импорты
 
+
+class ColumnSizer:
+    """Подбирает ширину столбцов по ограниченной выборке строк
+
+    Измеряются первые и видимые строки (не больше COLUMN_SAMPLE_ROWS), ширина
+    каждого столбца кэшируется. Новые и измененные строки только расширяют
+    столбцы, полный пересчет выполняется при сбросе модели. Изменение размера
+    окна ширину не пересчитывает.
+    """
+
+    def __init__(self, table, fixedWidths=None):
+        self.table = table
+        # Столбцы с постоянной шириной (например, изображения) не измеряются
+        self.fixedWidths = dict(fixedWidths or {})
+        self.widths = {}
+        model = table.model()
+        model.modelReset.connect(self.resizeAll)
+        model.rowsInserted.connect(self._rowsInserted)
+        model.dataChanged.connect(self._dataChanged)
+
+    def _sampleRows(self):
+        """Первые строки и строки видимой области, всего не больше COLUMN_SAMPLE_ROWS"""
+        count = self.table.model().rowCount()
+        first = max(self.table.rowAt(0), 0)
+        last = self.table.rowAt(self.table.viewport().height() - 1)
+        if last < 0:
+            last = count - 1
+        visible = range(first, min(last + 1, first + COLUMN_SAMPLE_ROWS))
+        head = range(min(count, COLUMN_SAMPLE_ROWS - len(visible)))
+        return sorted(set(head) | set(visible))
+
+    def _measure(self, column, rows):
+        """Наибольшая ширина текста столбца в строках rows"""
+        model = self.table.model()
+        metrics = self.table.fontMetrics()
+        width = 0
+        for row in rows:
+            value = model.index(row, column).data()
+            if value is not None:
+                width = max(width, metrics.horizontalAdvance(str(value)))
+        return width + CELL_PADDING
+
+    def resizeAll(self):
+        """Пересчитывает ширину всех столбцов по выборке строк"""
+        rows = self._sampleRows()
+        header = self.table.horizontalHeader()
+        for column in range(self.table.model().columnCount()):
+            if column in self.fixedWidths:
+                width = self.fixedWidths[column]
+            else:
+                width = min(
+                    max(header.sectionSizeHint(column), self._measure(column, rows)), MAX_COLUMN_WIDTH
+                )
+            self.widths[column] = width
+            self.table.setColumnWidth(column, width)
+
+    def _grow(self, rows, columns):
+        """Расширяет столбцы, если новые значения в них не помещаются"""
+        for column in columns:
+            if column in self.fixedWidths:
+                continue
+            width = min(self._measure(column, rows), MAX_COLUMN_WIDTH)
+            if width > self.widths.get(column, 0):
+                self.widths[column] = width
+                self.table.setColumnWidth(column, max(width, self.table.columnWidth(column)))
+
+    def _rowsInserted(self, parent, first, last):
+        # Массовое добавление (досчет строк, импорт) выборку не меняет
+        if last - first < COLUMN_SAMPLE_ROWS:
+            self._grow(range(first, last + 1), range(self.table.model().columnCount()))
+
+    def _dataChanged(self, topLeft, bottomRight, roles=()):
+        rows = range(topLeft.row(), min(bottomRight.row() + 1, topLeft.row() + COLUMN_SAMPLE_ROWS))
+        self._grow(rows, range(topLeft.column(), bottomRight.column() + 1))
+
+
 class ImageDelegate(QStyledItemDelegate):
     """Делегат для отображения изображений в таблице"""
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.image_size = QSize(200, 150)  # Фиксированный размер для изображений
+        self.cache = ThumbnailCache()
+        # Изображения читаются в фоне, ячейка перерисовывается по готовности
+        self.loader = AsyncThumbnailLoader(self.cache, self)
+        self.loader.ready.connect(self.updateRows)
+        if isinstance(parent, QTableView):
+            parent.verticalScrollBar().valueChanged.connect(self.cancelHiddenRows)
 
     def paint(self, painter, option, index):
         """Отрисовывает изображение в ячейке"""
         if index.column() == 5:  # Столбец с изображениями
             path = index.data()
             if path:  # Если есть путь к изображению
-                try:
-                    pixmap = QPixmap(path)
-                    if not pixmap.isNull():
-                        # Масштабируем изображение с сохранением пропорций
-                        scaled = pixmap.scaled(
-                            option.rect.width() - 10,  # -10 для отступов
-                            option.rect.height() - 10,
-                            Qt.KeepAspectRatio,
-                            Qt.SmoothTransformation
-                        )
-                        # Выравниваем по центру
-                        x = option.rect.x() + (option.rect.width() - scaled.width()) // 2
-                        y = option.rect.y() + (option.rect.height() - scaled.height()) // 2
-                        painter.drawPixmap(x, y, scaled)
-                        return
-                except Exception as e:
-                    print(f"Error loading image: {e}")
+                target = QSize(option.rect.width() - 10, option.rect.height() - 10)  # -10 для отступов
+                scaled = self.loader.request(path, target, index.row())
+                if scaled is None:
+                    # Изображение еще загружается - рисуем заглушку
+                    painter.fillRect(option.rect.adjusted(5, 5, -5, -5), option.palette.alternateBase())
+                    painter.drawText(option.rect, Qt.AlignCenter, "...")
+                    return
+                if not scaled.isNull():
+                    # Выравниваем по центру
+                    x = option.rect.x() + (option.rect.width() - scaled.width()) // 2
+                    y = option.rect.y() + (option.rect.height() - scaled.height()) // 2
+                    painter.drawPixmap(x, y, scaled)
+                    return
 
         # Если нет изображения или это другой столбец - стандартная отрисовка
         super().paint(painter, option, index)
 
-    def sizeHint(self, option, index):
-        """Задает размер ячейки для изображений"""
-        if index.column() == 5:
-            return self.image_size
-        return super().sizeHint(option, index)
-
-
-class AddDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent=parent)
-        self.setWindowTitle("Добавить дрон")
-        self.main_layout = QVBoxLayout()  # Используем только один layout
-        self.setLayout(self.main_layout)
-        self.data = None
-        self.image_path = ""
-        self.setupUI()
-        self.setupImageUI()
-
-    def setupUI(self):
-        # Создаем выпадающие списки
-        self.modelCombo = QComboBox()
-        self.manufacturerCombo = QComboBox()
-
-        # Настраиваем списки
-        self.setupComboBox(self.modelCombo, "модель", self.getModels)
-        self.setupComboBox(self.manufacturerCombo, "производителя", self.getManufacturers)
-
-        # Остальные поля
-        self.weightField = QLineEdit()
-        self.distanceField = QLineEdit()
-
-        # Форма для основных полей
-        form_layout = QFormLayout()
-        form_layout.addRow("Модель:", self.modelCombo)
-        form_layout.addRow("Производитель:", self.manufacturerCombo)
-        form_layout.addRow("Вес (г):", self.weightField)
-        form_layout.addRow("Макс. дистанция (м):", self.distanceField)
-
-
-        # Добавляем форму в главный layout
-        self.main_layout.addLayout(form_layout)
-
-        # Кнопки
-        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
-        buttons.accepted.connect(self.accept)
-        buttons.rejected.connect(self.reject)
-        self.main_layout.addWidget(buttons)
-
-    def setupImageUI(self):
-        """Элементы для работы с изображением"""
-        self.btn_load = QPushButton("Загрузить фото дрона")
-        self.btn_load.clicked.connect(self.loadImage)
-
-        self.lbl_preview = QLabel()
-        self.lbl_preview.setFixedSize(200, 200)
-        self.lbl_preview.setStyleSheet("border: 1px solid #ccc;")
-        self.lbl_preview.setAlignment(Qt.AlignCenter)
-
-        # Layout для изображения
-        image_layout = QVBoxLayout()
-        image_layout.addWidget(QLabel("Фото дрона:"))
-        image_layout.addWidget(self.btn_load)
-        image_layout.addWidget(self.lbl_preview)
-
-        # Вставляем layout с изображением перед кнопками
-        self.main_layout.insertLayout(self.main_layout.count() - 1, image_layout)
-
-
-
-
-    def setupComboBox(self, combo, item_type, data_func):
-        """Настраивает выпадающий список"""
-        combo.clear()
-        combo.addItems(data_func())
-        combo.insertItem(0, "")  # Пустая строка в начале
-        combo.addItem(f"+ Добавить {item_type}", "add_item")
-        combo.setCurrentIndex(0)  # Выбираем пустую строку по умолчанию
-
-        combo.currentIndexChanged.connect(
-            lambda: self.handleComboSelection(combo, item_type, data_func)
-        )
-
-    def handleComboSelection(self, combo, item_type, data_func):
-        """Обрабатывает выбор элемента"""
-        if combo.currentData() == "add_item":
-            # Запоминаем текущий индекс перед открытием диалога
-            prev_index = combo.currentIndex()
-
-            if item_type == "модель":
-                new_item, ok = QInputDialog.getText(
-                    self, f"Добавить {item_type}", f"Введите название {item_type}:")
-
-                if ok and new_item:
-                    if self.parent().contactsModel.addModel(new_item):
-                        self.refreshCombo(combo, item_type, data_func, new_item)
-                    else:
-                        QMessageBox.warning(self, "Ошибка", "Не удалось добавить")
-                        combo.setCurrentIndex(0)
-                else:
-                    # При отмене возвращаем выбор на первый элемент
-                    combo.setCurrentIndex(0)
-            else:
-                manufacturer, ok = QInputDialog.getText(
-                    self, "Добавить производителя", "Введите название производителя:")
-
-                if ok and manufacturer:
-                    country, ok = QInputDialog.getText(
-                        self, "Страна производителя", "Введите страну производителя:")
-
-                    if ok and country:
-                        if self.parent().contactsModel.addManufacturer(manufacturer, country):
-                            self.refreshCombo(combo, item_type, data_func, manufacturer)
-                        else:
-                            QMessageBox.warning(self, "Ошибка", "Не удалось добавить")
-                            combo.setCurrentIndex(0)
-                    else:
-                        combo.setCurrentIndex(0)
-                else:
-                    combo.setCurrentIndex(0)
-
-    def refreshCombo(self, combo, item_type, data_func, select_item=None):
-        """Обновляет содержимое комбобокса"""
-        current_text = combo.currentText()
-        combo.clear()
-        combo.addItems(data_func())
-        combo.insertItem(0, "")
-        combo.addItem(f"+ Добавить {item_type}", "add_item")
-
-        if select_item:
-            index = combo.findText(select_item)
-            if index >= 0:
-                combo.setCurrentIndex(index)
-        else:
-            combo.setCurrentIndex(0)
-
-    def getModels(self):
-        return self.parent().contactsModel.getModels()
-
-    def getManufacturers(self):
-        return self.parent().contactsModel.getManufacturers()
-
-
-    def loadImage(self):
-        """Диалог выбора изображения"""
-        file_path, _ = QFileDialog.getOpenFileName(
-            self,
-            "Выберите изображение дрона",
-            "",
-            "Image Files (*.png *.jpg *.jpeg)"
-        )
-
-        if file_path:
-            self.image_path = file_path
-            pixmap = QPixmap(file_path).scaled(
-                200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            self.lbl_preview.setPixmap(pixmap)
-
-    def accept(self):
-        """Проверка данных перед сохранением"""
-        model = self.modelCombo.currentText()
-        manufacturer = self.manufacturerCombo.currentText()
-        weight = self.weightField.text()
-        distance = self.distanceField.text()
-
-        # Проверка заполненности полей
-        if not all([model, manufacturer, weight, distance]):
-            QMessageBox.warning(self, "Ошибка", "Все поля должны быть заполнены")
+    def createEditor(self, parent, option, index):
+        """Для столбцов модели и производителя - выбор из справочника"""
+        if index.column() in (1, 3):
+            combo = QComboBox(parent)
+            combo.addItems(index.model().relationNames(index.column()))
+            return combo
+        return super().createEditor(parent, option, index)
+
+    def setEditorData(self, editor, index):
+        if isinstance(editor, QComboBox):
+            editor.setCurrentIndex(max(editor.findText(index.data()), 0))
             return
+        super().setEditorData(editor, index)
 
-        # Проверка, что выбраны существующие значения (не пустая строка и не "+ Добавить")
-        if model == "" or self.modelCombo.currentData() == "add_item":
-            QMessageBox.warning(self, "Ошибка", "Выберите модель из списка")
+    def setModelData(self, editor, model, index):
+        if isinstance(editor, QComboBox):
+            model.setData(index, editor.currentText())
             return
-
-        if manufacturer == "" or self.manufacturerCombo.currentData() == "add_item":
-            QMessageBox.warning(self, "Ошибка", "Выберите производителя из списка")
+        super().setModelData(editor, model, index)
+
+    def updateRows(self, rows):
+        """Перерисовывает ячейки, для которых загрузилось изображение"""
+        table = self.parent()
+        model = table.model()
+        for row in rows:
+            table.update(model.index(row, 5))
+
+    def cancelHiddenRows(self):
+        """Отменяет загрузку изображений для строк, ушедших из видимой области"""
+        table = self.parent()
+        if table.model() is None:
             return
+        first = table.rowAt(0)
+        last = table.rowAt(table.viewport().height() - 1)
+        if last < 0:
+            last = table.model().rowCount() - 1
+        self.loader.cancelOutside(max(first, 0), last)
 
-        self.data = [model, weight, manufacturer, distance, self.image_path]
-        super().accept()
-
-
-class SearchDialog(QDialog):
-    """Диалоговое окно (Поиск)"""
-
-    def __init__(self, parent=None):
-        super().__init__(parent=parent)
-        self.setWindowTitle("Search")
-        self.layout = QVBoxLayout()
-        self.setLayout(self.layout)
-        self.search_text = None
-        self.setupUI()
-
-    def setupUI(self):
-        """Установка графического интерфейса диалогового окна (Поиск)"""
-        self.searchField = QLineEdit()
-        self.searchField.setPlaceholderText("Введите текст...")
-
-        layout = QFormLayout()
-        layout.addRow("Поиск:", self.searchField)
-        self.layout.addLayout(layout)
-
-        self.buttonsBox = QDialogButtonBox(self)
-        self.buttonsBox.setOrientation(Qt.Horizontal)
-        self.buttonsBox.setStandardButtons(
-            QDialogButtonBox.Ok | QDialogButtonBox.Cancel
-        )
-        self.buttonsBox.accepted.connect(self.accept)
-        self.buttonsBox.rejected.connect(self.reject)
-        self.layout.addWidget(self.buttonsBox)
-
-    def accept(self):
-        """Подтверждение поиска"""
-        self.search_text = self.searchField.text()
-        if not self.search_text:
-            QMessageBox.critical(
-                self,
-                "Error!",
-                "Вы должны ввести текст",
-            )
-            self.search_text = None
-            return
-        super().accept()
\ No newline at end of file
+    def sizeHint(self, option, index):
+        """Задает размер ячейки для изображений"""
+        if index.column() == 5:
+            return self.image_size
+        return super().sizeHint(option, index)
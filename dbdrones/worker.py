@@ -0,0 +1,192 @@
+"""Этот модуль выполняет выборки в фоновом потоке со своим подключением к БД
+
+QSQLITE собирает SQLite внутрь драйвера и не дает доступа к sqlite3_interrupt
+и обработчику прогресса, поэтому долгие выборки разбиваются на порции по
+диапазонам id (QueryContext.idRanges). Перед каждой порцией задача проверяет,
+не пришел ли в тот же канал более новый запрос, и если пришел - прерывается.
+Результаты устаревших запросов в GUI не передаются.
+"""
+
+from itertools import count
+
+from PyQt5.QtCore import QCoreApplication, QObject, QThread, Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtSql import QSqlDatabase
+
+from .database import openReadConnection
+from .querylog import InstrumentedQuery
+
+# Сколько id просматривается одной порцией между проверками отмены
+CHUNK_IDS = 20000
+# Префикс имени подключения фонового потока (у каждого потока свое подключение)
+WORKER_CONNECTION = "dbdrones_worker"
+_workerNumbers = count(1)
+
+
+class QueryCancelled(Exception):
+    """Запрос заменен более новым"""
+
+
+class QueryError(Exception):
+    """Ошибка выполнения фонового запроса"""
+
+
+class QueryContext:
+    """Подключение и проверка отмены для задачи
+
+    Без аргументов - подключение по умолчанию и задача, которую нельзя отменить:
+    так те же задачи выполняются синхронно в потоке GUI.
+    """
+
+    def __init__(self, connectionName=None, isCurrent=None):
+        self.connectionName = connectionName
+        self._isCurrent = isCurrent
+        self._queries = {}
+
+    def checkCancelled(self):
+        if self._isCurrent is not None and not self._isCurrent():
+            raise QueryCancelled()
+
+    def query(self, sql, params=()):
+        """Выполняет подготовленный запрос (подготовка - один раз на задачу)"""
+        query = self._queries.get(sql)
+        if query is None:
+            if self.connectionName is None:
+                query = InstrumentedQuery()
+            else:
+                query = InstrumentedQuery(QSqlDatabase.database(self.connectionName))
+            query.setForwardOnly(True)
+            if not query.prepare(sql):
+                raise QueryError(query.lastError().text())
+            self._queries[sql] = query
+        else:
+            query.finish()
+        for position, value in enumerate(params):
+            query.bindValue(position, value)
+        if not query.exec():
+            raise QueryError(query.lastError().text())
+        return query
+
+    def idRanges(self, table="data"):
+        """Диапазоны (после, до] по CHUNK_IDS id; перед каждым проверяется отмена"""
+        query = self.query(f"SELECT MIN(id), MAX(id) FROM {table}")
+        if not query.next() or query.value(1) is None:
+            return
+        low, last = query.value(0) - 1, query.value(1)
+        query.finish()
+        while low < last:
+            self.checkCancelled()
+            yield low, min(low + CHUNK_IDS, last)
+            low += CHUNK_IDS
+
+
+class _Worker(QObject):
+    finished = pyqtSignal(str, int, object)
+    failed = pyqtSignal(str, int, str)
+
+    def __init__(self, databaseName, queries):
+        super().__init__()
+        self.databaseName = databaseName
+        self.queries = queries
+        self.connectionName = f"{WORKER_CONNECTION}_{next(_workerNumbers)}"
+        self.opened = False
+
+    @pyqtSlot(str, int, object)
+    def run(self, channel, generation, task):
+        if not self.queries.isCurrent(channel, generation):
+            return
+        if not self.opened:
+            # Подключение используется только в потоке, который его создал
+            error = openReadConnection(self.connectionName, self.databaseName)
+            if error is not None:
+                self.failed.emit(channel, generation, error)
+                return
+            self.opened = True
+        context = QueryContext(self.connectionName, lambda: self.queries.isCurrent(channel, generation))
+        try:
+            result = task(context)
+        except QueryCancelled:
+            return
+        except QueryError as e:
+            self.failed.emit(channel, generation, str(e))
+            return
+        self.finished.emit(channel, generation, result)
+
+    def close(self):
+        if self.opened:
+            QSqlDatabase.database(self.connectionName, open=False).close()
+            self.opened = False
+        QSqlDatabase.removeDatabase(self.connectionName)
+
+
+class BackgroundQueries(QObject):
+    """Очередь фоновых выборок по каналам
+
+    submit(канал, задача, обработчик): задача task(QueryContext) выполняется в
+    фоновом потоке, обработчик получает результат в потоке GUI. Новый запрос
+    канала отменяет предыдущий, если тот еще не закончен.
+    """
+
+    busyChanged = pyqtSignal(bool)
+    _request = pyqtSignal(str, int, object)
+
+    def __init__(self, databaseName, parent=None):
+        super().__init__(parent)
+        self._generations = {}
+        self._callbacks = {}
+        self.thread = QThread()
+        self.worker = _Worker(databaseName, self)
+        self.worker.moveToThread(self.thread)
+        self._request.connect(self.worker.run)
+        self.worker.finished.connect(self._finished)
+        self.worker.failed.connect(self._failed)
+        # Подключение закрывается в фоновом потоке перед его завершением
+        self.thread.finished.connect(self.worker.close, Qt.DirectConnection)
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+        self.thread.start()
+
+    def submit(self, channel, task, callback):
+        """Ставит задачу в очередь и возвращает номер запроса канала"""
+        generation = self._generations.get(channel, 0) + 1
+        self._generations[channel] = generation
+        busy = self.isBusy()
+        self._callbacks[channel] = callback
+        self._request.emit(channel, generation, task)
+        if not busy:
+            self.busyChanged.emit(True)
+        return generation
+
+    def cancel(self, channel):
+        """Отменяет незаконченный запрос канала"""
+        if channel in self._callbacks:
+            self._generations[channel] += 1
+            del self._callbacks[channel]
+            if not self.isBusy():
+                self.busyChanged.emit(False)
+
+    def isCurrent(self, channel, generation):
+        """Запрос еще нужен (вызывается и из фонового потока)"""
+        return self._generations.get(channel) == generation
+
+    def isBusy(self):
+        return bool(self._callbacks)
+
+    def _finished(self, channel, generation, result):
+        if not self.isCurrent(channel, generation) or channel not in self._callbacks:
+            return
+        callback = self._callbacks.pop(channel)
+        if not self.isBusy():
+            self.busyChanged.emit(False)
+        callback(result)
+
+    def _failed(self, channel, generation, message):
+        print("SQL Error:", message)
+        if self.isCurrent(channel, generation):
+            self.cancel(channel)
+
+    def stop(self):
+        """Отменяет все запросы и останавливает поток"""
+        for channel in list(self._callbacks):
+            self.cancel(channel)
+        if self.thread.isRunning():
+            self.thread.quit()
+            self.thread.wait()
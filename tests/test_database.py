@@ -0,0 +1,98 @@
+"""Миграции схемы и сводные таблицы (dbdrones.database)"""
+
+import os
+import sqlite3
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from dbdrones import database  # noqa: E402
+from dbdrones.repository import SCHEMA_VERSION, DroneRepository  # noqa: E402
+
+# Записи первой версии приложения: вес и дистанция - текст в свободной форме
+LEGACY_ROWS = [
+    (1, "Mavic", "0,25 кг", "DJI", "5 km"),
+    (2, "Phantom", "1380 г", "DJI", "7000"),
+    (3, "Mini", "249", "Autel", ""),
+    (5, "Air", "about 410", "DJI", "n/a"),
+]
+
+
+@pytest.fixture
+def legacyDatabase(tmp_path):
+    path = tmp_path / "drones.sqlite"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        """
+        CREATE TABLE data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE NOT NULL,
+            model_name VARCHAR(40) NOT NULL,
+            weight VARCHAR(50) NOT NULL,
+            manufacture VARCHAR(40) NOT NULL,
+            max_distance VARCHAR(50) NOT NULL,
+            image_path TEXT
+        )
+        """
+    )
+    connection.executemany(
+        "INSERT INTO data (id, model_name, weight, manufacture, max_distance) VALUES (?, ?, ?, ?, ?)",
+        LEGACY_ROWS,
+    )
+    connection.commit()
+    connection.close()
+    database.coreApplication()
+    yield path
+    database.closeConnection()
+
+
+def test_legacy_database_migrates_and_keeps_unparsed_values(legacyDatabase):
+    assert database.openConnection(str(legacyDatabase)) is None
+    assert database.schemaVersion() == SCHEMA_VERSION
+    assert database._migrationRejects == 2
+
+    records = {record["id"]: record for record in DroneRepository(database.QtSqlBackend()).search()}
+    assert (records[1]["weight"], records[1]["max_distance"]) == (250.0, 5000.0)
+    assert records[5]["weight"] is None and records[5]["max_distance"] is None
+    assert (records[3]["weight"], records[3]["max_distance"]) == (249.0, None)
+    assert database.migrationRejects() == [(5, "max_distance", "n/a"), (5, "weight", "about 410")]
+    assert database.verifyStatistics() == []
+
+    # Перенумерация переносит нераспознанные значения вместе с записями
+    assert database.rekeyData() == len(LEGACY_ROWS)
+    assert [rowId for rowId, _, _ in database.migrationRejects()] == [4, 4]
+
+    # Повторное открытие уже обновленной БД ничего не отклоняет
+    assert database.openConnection(str(legacyDatabase)) is None
+    assert database._migrationRejects == 0
+    assert len(database.migrationRejects()) == 2
+
+
+def test_statistics_follow_mutations(tmp_path):
+    database.coreApplication()
+    assert database.openConnection(str(tmp_path / "drones.sqlite")) is None
+    try:
+        repository = DroneRepository(database.QtSqlBackend())
+        ids = [
+            repository.insert({"model_name": model, "weight": weight, "manufacture": manufacture, "max_distance": 100})
+            for model, weight, manufacture in (
+                ("Mavic", 895, "DJI"), ("Mavic", None, "DJI"), ("Evo", 1150, "Autel"), ("Mini", 249, "DJI"),
+            )
+        ]
+        assert database.verifyStatistics() == []
+
+        with repository.transaction():
+            repository.backend.execute("UPDATE data SET weight = 900, max_distance = 8000 WHERE id = ?", (ids[0],))
+            repository.backend.execute(
+                "UPDATE data SET model_id = (SELECT id FROM model WHERE name = 'Evo') WHERE id = ?", (ids[3],)
+            )
+            repository.backend.execute(
+                "UPDATE data SET manufacture_id = (SELECT id FROM manufacture WHERE name = 'Autel') WHERE id = ?",
+                (ids[1],),
+            )
+        assert database.verifyStatistics() == []
+
+        assert repository.delete([ids[0], ids[2]]) == 2
+        assert database.verifyStatistics() == []
+    finally:
+        database.closeConnection()
@@ -0,0 +1,39 @@
+"""Массовый импорт записей (dbdrones.importer)"""
+
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from dbdrones import database  # noqa: E402
+from dbdrones.importer import DroneImporter  # noqa: E402
+from dbdrones.repository import DroneRepository  # noqa: E402
+
+
+def test_rows_rejected_by_database_do_not_cancel_batch(tmp_path):
+    source = tmp_path / "drones.csv"
+    lines = ["model_name,weight,manufacture,max_distance,uid"]
+    lines += [f"Model {i % 3},{100 + i},Maker {i % 2},{1000 + i},uid-{i}" for i in range(20)]
+    # Строка 7 повторяет uid строки 3, строка 22 - uid записи из первого пакета
+    lines[6] = "Rejected,1 kg,Other,5 km,uid-1"
+    lines += ["Model 1,300,Maker 0,2 km,uid-2"]
+    source.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    database.coreApplication()
+    assert database.openConnection(str(tmp_path / "drones.sqlite")) is None
+    try:
+        result = DroneImporter(batchSize=10).importFile(str(source))
+        assert (result.inserted, result.skipped) == (19, 2)
+        assert [line for line, _ in result.errors] == [7, 22]
+        assert all("UNIQUE" in message for _, message in result.errors)
+
+        records = list(DroneRepository(database.QtSqlBackend()).search())
+        assert [record["id"] for record in records] == list(range(1, 20))
+        assert len({record["uid"] for record in records}) == 19
+        # Справочники отклоненной строки откатываются вместе с ней
+        assert "Rejected" not in {record["model_name"] for record in records}
+        query = database.execPrepared("SELECT COUNT(*) FROM model WHERE name = 'Rejected'")
+        assert query.next() and query.value(0) == 0
+        query.finish()
+        assert database.verifyStatistics() == []
+    finally:
+        database.closeConnection()
@@ -0,0 +1,93 @@
+"""Постраничная выборка DronesTableModel по ключу сортировки"""
+
+import os
+import random
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt  # noqa: E402
+
+from dbdrones.database import QtSqlBackend, closeConnection, coreApplication, openConnection  # noqa: E402
+from dbdrones.model import COLUMNS, PAGE_SIZE, DronesTableModel  # noqa: E402
+from dbdrones.repository import DroneRepository  # noqa: E402
+
+MODELS = ("Mavic", "Air", "Mini", "Phantom")
+SORTS = [
+    [(2, Qt.DescendingOrder)],
+    [(4, Qt.AscendingOrder)],
+    [(1, Qt.AscendingOrder)],
+    [(3, Qt.DescendingOrder), (4, Qt.AscendingOrder)],
+]
+
+
+@pytest.fixture
+def repository(tmp_path):
+    coreApplication()
+    assert openConnection(str(tmp_path / "drones.sqlite")) is None
+    repository = DroneRepository(QtSqlBackend())
+    generator = random.Random(1)
+    repository.insertMany(
+        {
+            "model_name": generator.choice(MODELS),
+            "weight": generator.randrange(100, 120),
+            "manufacture": generator.choice(("DJI", "Autel")),
+            "max_distance": generator.randrange(1000, 1050),
+        }
+        for _ in range(3 * PAGE_SIZE + 50)
+    )
+    yield repository
+    closeConnection()
+
+
+def _modelIds(model):
+    return [model.rowId(row) for row in range(model.rowCount())]
+
+
+def _expectedIds(repository, model):
+    return [record["id"] for record in repository.search(sort=model.activeSort())]
+
+
+def _sortedModel(sortOrder):
+    model = DronesTableModel()
+    model.setSortOrder(sortOrder)
+    model.select()
+    # Прокрутка до конца запоминает границы всех страниц
+    _modelIds(model)
+    return model
+
+
+@pytest.mark.parametrize("sortOrder", SORTS)
+def test_edit_of_sort_key_keeps_sql_order(repository, sortOrder):
+    model = _sortedModel(sortOrder)
+    column = sortOrder[0][0]
+    edits = {
+        "weight": (1, 500),
+        "max_distance": (1, 5000),
+        "model_name": ("Air", "Phantom"),
+        "manufacture": ("Autel", "DJI"),
+    }[COLUMNS[column]]
+    # Правки переносят записи между страницами в обе стороны
+    for row, value in ((PAGE_SIZE + 10, edits[0]), (10, edits[1]), (2 * PAGE_SIZE - 1, edits[0])):
+        assert model.setData(model.index(row, column), value)
+        ids = _modelIds(model)
+        assert len(set(ids)) == len(ids)
+        assert ids == _expectedIds(repository, model)
+
+
+@pytest.mark.parametrize("sortOrder", SORTS)
+def test_insert_and_delete_keep_sql_order(repository, sortOrder):
+    model = _sortedModel(sortOrder)
+    for weight, distance in ((1, 1025), (110, 1), (10_000, 1020)):
+        rowId = repository.insert(
+            {"model_name": "Mini", "weight": weight, "manufacture": "DJI", "max_distance": distance}
+        )
+        model.recordInserted(rowId)
+        assert _modelIds(model) == _expectedIds(repository, model)
+
+    assert model.removeRows(PAGE_SIZE - 5, 10)
+    assert model.removeRows(0, 1)
+    ids = _modelIds(model)
+    assert len(ids) == 3 * PAGE_SIZE + 50 + 3 - 11
+    assert ids == _expectedIds(repository, model)
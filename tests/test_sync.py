@@ -0,0 +1,54 @@
+"""Обмен изменениями между копиями БД (dbdrones.sync)"""
+
+import io
+import os
+import shutil
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from dbdrones import sync  # noqa: E402
+from dbdrones.repository import DroneRepository  # noqa: E402
+
+
+def _createDatabase(path):
+    """Пустая БД последней версии схемы (миграции выполняются через подключение Qt)"""
+    from PyQt5.QtCore import QCoreApplication
+
+    from dbdrones.database import closeConnection, openConnection
+
+    QCoreApplication.instance() or QCoreApplication([])
+    assert openConnection(str(path)) is None
+    closeConnection()
+
+
+def _exchange(source, target, force=False):
+    output = io.StringIO()
+    since = sync.journalStatus(target)["peers"].get(sync.siteId(source), 0)
+    sync.exportChanges(source, output, since)
+    return sync.applyChanges(target, output.getvalue().splitlines(), force=force)
+
+
+@pytest.mark.parametrize("force", [False, True])
+def test_copy_with_new_site_does_not_echo_original_changes(tmp_path, force):
+    original, copy = tmp_path / "s1.sqlite", tmp_path / "s2.sqlite"
+    _createDatabase(original)
+    with DroneRepository(str(original)) as first:
+        first.insert({"model_name": "Mavic", "weight": 895, "manufacture": "DJI", "max_distance": 8000})
+    shutil.copy(original, copy)
+
+    with DroneRepository(str(original)) as first, DroneRepository(str(copy)) as second:
+        sync.renewSite(second)
+        uid = next(first.search())["uid"]
+        with first.transaction():
+            first.backend.execute("UPDATE data SET weight = 900 WHERE uid = ?", (uid,))
+
+        result = _exchange(second, first, force)
+        assert result["conflicts"] == []
+        assert result["applied"] == 0
+        assert next(first.search())["weight"] == 900
+
+        result = _exchange(first, second)
+        assert result["conflicts"] == []
+        assert next(second.search())["weight"] == 900